@@ -8,6 +8,34 @@ interface Document {
   url: string;
 }
 
+interface IngestionJob {
+  status: 'queued' | 'running' | 'completed' | 'failed';
+  pdf_url?: string;
+  error?: string;
+  progress?: { pages_done?: number; total_pages?: number };
+}
+
+// Uploads are indexed in the background; follow the job's SSE feed until it finishes.
+const waitForIngestion = (eventsUrl: string, onProgress: (job: IngestionJob) => void) =>
+  new Promise<IngestionJob>((resolve, reject) => {
+    const source = new EventSource(`http://localhost:8000${eventsUrl}`);
+    source.onmessage = (event) => {
+      const job: IngestionJob = JSON.parse(event.data);
+      onProgress(job);
+      if (job.status === 'completed') {
+        source.close();
+        resolve(job);
+      } else if (job.status === 'failed') {
+        source.close();
+        reject(new Error(job.error || 'Processing failed'));
+      }
+    };
+    source.onerror = () => {
+      source.close();
+      reject(new Error('Lost connection while processing'));
+    };
+  });
+
 export default function KnowledgeBasePage() {
   const [activeTab, setActiveTab] = useState('documents');
   const [showUploadModal, setShowUploadModal] = useState(false);
@@ -15,6 +43,7 @@ export default function KnowledgeBasePage() {
   const [uploadTitle, setUploadTitle] = useState('');
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
   const [isUploading, setIsUploading] = useState(false);
+  const [uploadProgress, setUploadProgress] = useState('');
   const [error, setError] = useState('');
 
   // Load documents from localStorage on mount
@@ -72,6 +101,14 @@ export default function KnowledgeBasePage() {
 
       const data = await response.json();
 
+      if (data.events_url) {
+        const job = await waitForIngestion(data.events_url, (update) => {
+          const { pages_done, total_pages } = update.progress || {};
+          setUploadProgress(total_pages ? `Processing page ${pages_done} of ${total_pages}` : 'Processing...');
+        });
+        data.pdf_url = job.pdf_url;
+      }
+
       // Store index names in localStorage
       if (data.index_name_pdf) {
         localStorage.setItem('index_name_pdf', data.index_name_pdf);
@@ -99,6 +136,7 @@ export default function KnowledgeBasePage() {
       console.error('Upload error:', err);
     } finally {
       setIsUploading(false);
+      setUploadProgress('');
     }
   };
 
@@ -316,7 +354,7 @@ export default function KnowledgeBasePage() {
                 disabled={isUploading}
                 className="px-4 py-2 bg-blue-600 text-white rounded-lg font-medium hover:bg-blue-700 transition-colors disabled:bg-blue-400 disabled:cursor-not-allowed"
               >
-                {isUploading ? 'Uploading...' : 'Upload'}
+                {isUploading ? uploadProgress || 'Uploading...' : 'Upload'}
               </button>
             </div>
           </div>
@@ -630,10 +630,13 @@ export default function MeetingUI() {
                           <p className="text-xs text-gray-700 leading-relaxed mb-2 line-clamp-3">{result.ocr_text_excerpt}</p>
                         )}
 
-                        {result.page_image_url && (
+                        {/* Small cached thumbnail; the full page image loads only in the preview */}
+                        {(result.thumbnail_url || result.page_image_url) && (
                           <img
-                            src={result.page_image_url}
+                            src={result.thumbnail_url || result.page_image_url}
                             alt={`Page ${result.page_number}`}
+                            loading="lazy"
+                            decoding="async"
                             className="w-28 h-auto rounded-md border border-gray-200 hover:shadow-md transition"
                           />
                         )}
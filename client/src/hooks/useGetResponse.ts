@@ -24,6 +24,7 @@ interface WebResult {
 interface DocResult {
   pdf_url: string | URL;
   page_image_url: any;
+  thumbnail_url?: string | null;
   ocr_text_excerpt: any;
   page_number: any;
   content: string;
@@ -72,8 +73,15 @@ export const useGetResponse = (): GetResponseReturn => {
         text: t.texts.filter(chunk => chunk.is_final).map(chunk => chunk.text).join(' '),
       }));
 
-      // Make POST request to server
-      const response = await fetch('http://localhost:8000/retrieve-response', {
+      if (userQuery.trim()) {
+        setLlmChats(prev => [
+          ...prev,
+          { role: 'user', content: userQuery },
+        ]);
+      }
+
+      // Stream the answer: retrieval results arrive first, then the answer token by token
+      const response = await fetch('http://localhost:8000/retrieve-response/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -88,39 +96,65 @@ export const useGetResponse = (): GetResponseReturn => {
         }),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`Server error: ${response.status} ${response.statusText}`);
       }
 
-      const data = await response.json();
-
-    console.log('Response data:', data);
-    console.log('llm response:', data.data?.llm_response);
-
-    if (userQuery.trim()) {
-    setLlmChats(prev => [
-        ...prev,
-        { role: 'user', content: userQuery },
-    ]);
-    }
-
-    if (data.data?.llm_response) {
-    setLlmChats(prev => [
-        ...prev,
-        { role: 'llm', content: data.data.llm_response },
-    ]);
-    }
-
-      // Update web results
-    if (data.data?.web_results && Array.isArray(data.data.web_results)) {
-    setWebResults(prev => [...prev, ...data.data.web_results]);
-    }
-
-    // Update document results
-    if (data.data?.document_context && Array.isArray(data.data.document_context)) {
-    setDocResults(prev => [...prev, ...data.data.document_context]);
-    }
-
+      let answerStarted = false;
+      const setAnswer = (update: (content: string) => string) => {
+        if (!answerStarted) {
+          answerStarted = true;
+          setIsLoading(false);
+          setLlmChats(prev => [...prev, { role: 'llm', content: update('') }]);
+          return;
+        }
+        setLlmChats(prev => {
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, content: update(last.content) }];
+        });
+      };
+
+      const handleEvent = (event: string, data: any) => {
+        switch (event) {
+          case 'web_results':
+            if (Array.isArray(data)) setWebResults(prev => [...prev, ...data]);
+            break;
+          case 'document_context':
+            if (Array.isArray(data)) setDocResults(prev => [...prev, ...data]);
+            break;
+          case 'token':
+            setAnswer(content => content + data.text);
+            break;
+          case 'done':
+            // The full answer replaces the streamed chunks
+            if (data.llm_response) setAnswer(() => data.llm_response);
+            break;
+          case 'error':
+            throw new Error(data.message || 'Failed to get response');
+        }
+      };
+
+      // Parse the Server-Sent Events stream ("event: x\ndata: {...}\n\n")
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const frame = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          let event = 'message';
+          let data = '';
+          for (const line of frame.split('\n')) {
+            if (line.startsWith('event: ')) event = line.slice(7);
+            else if (line.startsWith('data: ')) data += line.slice(6);
+          }
+          if (data) handleEvent(event, JSON.parse(data));
+        }
+      }
 
     } catch (err) {
       const errorMessage = err instanceof Error ? err.message : 'Failed to get response';
@@ -0,0 +1,402 @@
+"""
+Background ingestion jobs for /upload.
+
+`/upload` only saves the file and enqueues a job; the heavy extraction, OCR,
+embedding and indexing work runs here.
+
+Modes (INGEST_JOB_MODE):
+- "inprocess" (default): jobs run on a dedicated thread pool inside the API
+  process, capped at INGEST_MAX_CONCURRENT_JOBS. Job state and progress are
+  kept in memory, so Redis is optional; when it is reachable they are
+  mirrored there, so other API workers can answer status/SSE requests too.
+- "redis": jobs are pushed onto a Redis list and picked up by separate
+  worker processes started with `python ingestion_jobs.py`. Job state, the
+  progress feed and the uploaded bytes all travel through Redis, so workers
+  need no shared disk. Not available with VECTOR_STORE=local (refused at
+  startup).
+
+In redis mode a worker only takes a job when it has a free slot, and takes
+it with BLMOVE (Redis >= 6.2) into its own processing list, where it stays
+until the job finishes. Workers refresh a heartbeat key; when one stops
+(crash, kill -9), another worker moves the jobs left in its processing
+list back onto the queue and they run again from the start.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from contextlib import asynccontextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Optional
+from uuid import uuid4
+
+from dotenv import load_dotenv
+
+from redis_client import redis_client, redis_binary_client
+from upload_handler import document_processor
+from utils.upload_dedup import record_indexed_document, release_fingerprint
+from utils.vector_store import VECTOR_STORE
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+INGEST_JOB_MODE = os.getenv("INGEST_JOB_MODE", "inprocess")
+INGEST_MAX_CONCURRENT_JOBS = int(os.getenv("INGEST_MAX_CONCURRENT_JOBS", "2"))
+JOB_TTL_SECONDS = int(os.getenv("INGEST_JOB_TTL_SECONDS", str(24 * 3600)))
+
+WORKER_HEARTBEAT_SECONDS = int(os.getenv("INGEST_WORKER_HEARTBEAT_SECONDS", "10"))
+
+QUEUE_KEY = "ingest:queue"
+WORKERS_KEY = "ingest:workers"
+TERMINAL_STATUSES = {"completed", "failed"}
+
+
+def new_job_id() -> str:
+    return uuid4().hex
+
+
+def _job_key(job_id: str) -> str:
+    return f"ingest:job:{job_id}"
+
+
+def _upload_key(job_id: str) -> str:
+    return f"ingest:upload:{job_id}"
+
+
+def _events_channel(job_id: str) -> str:
+    return f"ingest:job:{job_id}:events"
+
+
+def _processing_key(worker_id: str) -> str:
+    return f"ingest:processing:{worker_id}"
+
+
+def _heartbeat_key(worker_id: str) -> str:
+    return f"ingest:worker:{worker_id}"
+
+
+async def _no_updates(timeout: float) -> Optional[str]:
+    await asyncio.sleep(timeout)
+    return None
+
+
+class IngestionJobRunner:
+    """Runs DocumentProcessor jobs off the request path with a concurrency cap."""
+
+    def __init__(self, mode: str = INGEST_JOB_MODE, max_concurrent_jobs: int = INGEST_MAX_CONCURRENT_JOBS):
+        if mode == "redis" and VECTOR_STORE == "local":
+            # The local store lives in one process: the API would never see
+            # vectors written by workers, and several writers corrupt its files.
+            raise ValueError(
+                "INGEST_JOB_MODE=redis needs a shared vector store; "
+                "use VECTOR_STORE=pinecone or INGEST_JOB_MODE=inprocess with VECTOR_STORE=local"
+            )
+        self.mode = mode
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+        # Dedicated pool so ingestion never occupies the default executor
+        # used by request handlers such as /retrieve-response.
+        self._executor = ThreadPoolExecutor(self.max_concurrent_jobs, thread_name_prefix="ingest-job")
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: set[asyncio.Task] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # In-process mode only: job state and SSE subscribers of this process's jobs.
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._subscribers: Dict[str, set[asyncio.Queue]] = {}
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent_jobs)
+        return self._slots
+
+    # ---------------- state ----------------
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if job_id in self._jobs:
+            return dict(self._jobs[job_id])
+        try:
+            raw = await redis_client.get(_job_key(job_id))
+        except Exception as e:
+            if self.mode == "redis":
+                raise
+            logger.warning(f"Could not read ingestion job {job_id} from Redis: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def update(self, job_id: str, **fields: Any) -> Dict[str, Any]:
+        # Read-modify-write; serialise per job so a late progress update
+        # cannot overwrite the final status.
+        lock = self._locks.setdefault(job_id, asyncio.Lock())
+        async with lock:
+            job = await self.get(job_id) or {"job_id": job_id}
+            job.update(fields)
+            job["updated_at"] = time.time()
+            payload = json.dumps(job)
+            if self.mode == "redis":
+                await self._mirror(job_id, payload)
+            else:
+                self._jobs[job_id] = job
+                for queue in self._subscribers.get(job_id, ()):
+                    queue.put_nowait(payload)
+                try:
+                    await self._mirror(job_id, payload)
+                except Exception as e:
+                    logger.warning(f"Could not mirror ingestion job {job_id} to Redis: {e}")
+        if job.get("status") in TERMINAL_STATUSES:
+            self._locks.pop(job_id, None)
+            if job_id in self._jobs:
+                asyncio.get_running_loop().call_later(JOB_TTL_SECONDS, self._jobs.pop, job_id, None)
+        return dict(job)
+
+    async def _mirror(self, job_id: str, payload: str) -> None:
+        await redis_client.setex(_job_key(job_id), JOB_TTL_SECONDS, payload)
+        await redis_client.publish(_events_channel(job_id), payload)
+
+    # ---------------- submission ----------------
+    async def submit(
+        self,
+        content: bytes,
+        filename: str,
+        index_name_ocr: str,
+        index_name_text: str,
+        fingerprint: Optional[str] = None,
+        job_id: Optional[str] = None,
+        document_key: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        job_id = job_id or new_job_id()
+        payload = {
+            "job_id": job_id,
+            "filename": filename,
+            "index_name_ocr": index_name_ocr,
+            "index_name_text": index_name_text,
+            "fingerprint": fingerprint,
+            "document_key": document_key,
+        }
+        job = await self.update(
+            job_id,
+            status="queued",
+            filename=filename,
+            index_name_pdf=index_name_text,
+            index_name_ocr=index_name_ocr,
+            progress={},
+            created_at=time.time(),
+        )
+
+        if self.mode == "redis":
+            await redis_binary_client.setex(_upload_key(job_id), JOB_TTL_SECONDS, content)
+            await redis_client.lpush(QUEUE_KEY, json.dumps(payload))
+            logger.info(f"Queued ingestion job {job_id} on '{QUEUE_KEY}'")
+        else:
+            task = asyncio.create_task(self._run(payload, content))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            logger.info(f"Started in-process ingestion job {job_id}")
+        return job
+
+    # ---------------- execution ----------------
+    async def _run(self, payload: Dict[str, Any], content: Optional[bytes] = None, slot_held: bool = False) -> None:
+        job_id = payload["job_id"]
+        fingerprint = payload.get("fingerprint")
+        loop = asyncio.get_running_loop()
+
+        def _report(progress: Dict[str, Any]) -> None:
+            # Called from ingestion threads; hop back onto the loop.
+            asyncio.run_coroutine_threadsafe(self.update(job_id, progress=progress), loop)
+
+        async with nullcontext() if slot_held else self._get_slots():
+            await self.update(job_id, status="running", started_at=time.time())
+            try:
+                if content is None:
+                    content = await redis_binary_client.get(_upload_key(job_id))
+                    if content is None:
+                        raise RuntimeError("Uploaded file expired before the job started")
+                result = await loop.run_in_executor(
+                    self._executor,
+                    partial(
+                        document_processor.process_file,
+                        content,
+                        payload["filename"],
+                        payload["index_name_ocr"],
+                        payload["index_name_text"],
+                        progress_callback=_report,
+                        document_key=payload.get("document_key"),
+                    ),
+                )
+                await self.update(
+                    job_id,
+                    status="completed",
+                    finished_at=time.time(),
+                    index_name_pdf=result["index_name_text"],
+                    index_name_ocr=result["index_name_ocr"],
+                    pdf_url=result["pdf_url"],
+                    result=result,
+                )
+                if fingerprint:
+                    await record_indexed_document(fingerprint, {
+                        "index_name_pdf": result["index_name_text"],
+                        "index_name_ocr": result["index_name_ocr"],
+                        "pdf_url": result["pdf_url"],
+                        "filename": payload["filename"],
+                        "job_id": job_id,
+                        "indexed_at": time.time(),
+                    })
+                logger.info(f"Ingestion job {job_id} completed")
+            except Exception as e:
+                logger.exception(f"Ingestion job {job_id} failed")
+                if fingerprint:
+                    await release_fingerprint(fingerprint, job_id)
+                await self.update(job_id, status="failed", finished_at=time.time(), error=getattr(e, "detail", str(e)))
+            # Kept if the job is cancelled, so a requeued job can still read it.
+            if self.mode == "redis":
+                await redis_binary_client.delete(_upload_key(job_id))
+
+    async def run_worker(self) -> None:
+        """Consume jobs from the Redis queue forever (INGEST_JOB_MODE=redis)."""
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+        processing_key = _processing_key(worker_id)
+        logger.info(f"Ingestion worker {worker_id} listening on '{QUEUE_KEY}' (max {self.max_concurrent_jobs} concurrent jobs)")
+        await self._beat(worker_id)
+        await self._recover_dead_workers(worker_id)
+        heartbeat = asyncio.create_task(self._heartbeat(worker_id))
+        slots = self._get_slots()
+        try:
+            while True:
+                # Take a job only with a free slot; until then it stays on the
+                # queue for other workers. The slot is released when the job ends.
+                await slots.acquire()
+                try:
+                    raw = await redis_client.blmove(QUEUE_KEY, processing_key, 5, "RIGHT", "LEFT")
+                except BaseException:
+                    slots.release()
+                    raise
+                if raw is None:
+                    slots.release()
+                    continue
+                task = asyncio.create_task(self._run_claimed(raw, processing_key, slots))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            heartbeat.cancel()
+
+    async def _run_claimed(self, raw: str, processing_key: str, slots: asyncio.Semaphore) -> None:
+        try:
+            try:
+                await self._run(json.loads(raw), slot_held=True)
+            except Exception:
+                logger.exception(f"Could not run queued job {raw[:200]}")
+            # Not reached when the worker is cancelled mid-job: the job stays in the
+            # processing list and is requeued once this worker's heartbeat expires.
+            await redis_client.lrem(processing_key, 1, raw)
+        finally:
+            slots.release()
+
+    async def _beat(self, worker_id: str) -> None:
+        # Heartbeat first: a registered worker without one counts as dead.
+        await redis_client.setex(_heartbeat_key(worker_id), 3 * WORKER_HEARTBEAT_SECONDS, "1")
+        await redis_client.sadd(WORKERS_KEY, worker_id)
+
+    async def _heartbeat(self, worker_id: str) -> None:
+        """Keep this worker's heartbeat alive and requeue the jobs of workers whose heartbeat expired."""
+        while True:
+            await asyncio.sleep(WORKER_HEARTBEAT_SECONDS)
+            try:
+                await self._beat(worker_id)
+                await self._recover_dead_workers(worker_id)
+            except Exception as e:
+                logger.warning(f"Ingestion worker heartbeat failed: {e}")
+
+    async def _recover_dead_workers(self, worker_id: str) -> None:
+        for other in await redis_client.smembers(WORKERS_KEY):
+            if other == worker_id or await redis_client.exists(_heartbeat_key(other)):
+                continue
+            requeued = 0
+            # LMOVE is atomic, so workers recovering the same list never requeue a job twice.
+            # Pushed at the consuming end: interrupted jobs run before newer uploads.
+            while await redis_client.lmove(_processing_key(other), QUEUE_KEY, "RIGHT", "RIGHT") is not None:
+                requeued += 1
+            await redis_client.srem(WORKERS_KEY, other)
+            if requeued:
+                logger.warning(f"Requeued {requeued} ingestion jobs of dead worker {other}")
+
+    # ---------------- progress feed ----------------
+    async def events(self, job_id: str, keepalive_seconds: float = 15.0):
+        """Yield Server-Sent Events for a job until it completes or fails."""
+        async with self._subscribe(job_id) as next_update:
+            # Subscribe before the snapshot so no update slips in between.
+            job = await self.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            yield f"data: {json.dumps(job)}\n\n"
+            if job.get("status") in TERMINAL_STATUSES:
+                return
+
+            while True:
+                payload = await next_update(keepalive_seconds)
+                if payload is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {payload}\n\n"
+                if json.loads(payload).get("status") in TERMINAL_STATUSES:
+                    return
+
+    @asynccontextmanager
+    async def _subscribe(self, job_id: str):
+        """
+        Yields `next_update(timeout)`, which returns the next job payload or
+        None on timeout. Jobs of this process are followed in memory, all
+        others through their Redis channel.
+        """
+        if job_id in self._jobs:
+            queue: asyncio.Queue = asyncio.Queue()
+            self._subscribers.setdefault(job_id, set()).add(queue)
+
+            async def next_update(timeout: float) -> Optional[str]:
+                try:
+                    return await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    return None
+
+            try:
+                yield next_update
+            finally:
+                subscribers = self._subscribers.get(job_id, set())
+                subscribers.discard(queue)
+                if not subscribers:
+                    self._subscribers.pop(job_id, None)
+            return
+
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(_events_channel(job_id))
+        except Exception as e:
+            if self.mode == "redis":
+                raise
+            # Not a job of this process and no Redis to follow it through.
+            logger.warning(f"Could not subscribe to ingestion job {job_id}: {e}")
+            await pubsub.aclose()
+            yield _no_updates
+            return
+
+        async def next_update(timeout: float) -> Optional[str]:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+            return message["data"] if message else None
+
+        try:
+            yield next_update
+        finally:
+            await pubsub.unsubscribe(_events_channel(job_id))
+            await pubsub.aclose()
+
+
+ingestion_jobs = IngestionJobRunner()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(IngestionJobRunner(mode="redis").run_worker())
@@ -1,17 +1,40 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, Request, Response
+from fastapi import FastAPI, Form, WebSocket, WebSocketDisconnect, UploadFile, Request, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from upload_handler import document_processor
+from ingestion_jobs import ingestion_jobs, new_job_id
+from utils.upload_dedup import (
+    CLAIM_STATUS_RETRIES,
+    CLAIM_STATUS_RETRY_SECONDS,
+    claim_fingerprint,
+    get_indexed_document,
+    take_over_fingerprint,
+    upload_fingerprint,
+)
+from utils.embedding_cache import get_embedding_cache
+from utils.page_manifest import document_indexes, remember_document_indexes
+from utils.word_boxes import load_page_word_boxes, match_words
+from utils.asset_store import ASSET_STORE, ASSET_STORE_DIR
+from utils.serper import aclose_serper
+from utils.page_images import (
+    PAGE_IMAGE_MAX_AGE_SECONDS,
+    PAGE_IMAGE_SIZES,
+    etag_matches,
+    get_page_rendition,
+    rendition_etag,
+)
 import asyncio
 import logging
 import json
+import os
 import struct
 from uuid import uuid4
 from utils.delete_index import delete_index_after_delay
 # from assembly_handler import assembly_handler
 # from deepgram_handler import deepgram_handler
 from deepgram_handler import handle_deepgram_stream
-from fastapi.responses import JSONResponse
-from retrieve_response import retrieve_response_pipeline
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from retrieve_response import retrieve_response_pipeline, retrieve_response_stream
 from deepgram_handler_dual import handle_deepgram_dual_channel
 # Configure logging with more detail
 logging.basicConfig(
@@ -35,8 +58,83 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Local asset store: uploaded PDFs and images are served from disk.
+if ASSET_STORE == "local":
+    os.makedirs(ASSET_STORE_DIR, exist_ok=True)
+    app.mount("/assets", StaticFiles(directory=ASSET_STORE_DIR), name="assets")
+
+def _job_accepted_response(job: dict, index_name_text: str, index_name_ocr: str, deduplicated: bool = False) -> JSONResponse:
+    return JSONResponse(
+        content={
+            "success": True,
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "status_url": f"/upload/jobs/{job['job_id']}",
+            "events_url": f"/upload/jobs/{job['job_id']}/events",
+            "index_name_pdf": index_name_text,
+            "index_name_ocr": index_name_ocr,
+            "pdf_url": job.get("pdf_url"),
+            "deduplicated": deduplicated,
+            "message": "Upload accepted, processing in background",
+        },
+        status_code=202,
+    )
+
+
 @app.post("/upload")
-async def upload_pdf(file: UploadFile, index_name_text: str | None = None, index_name_ocr: str | None = None):
+async def upload_pdf(
+    file: UploadFile,
+    index_name_text: str | None = None,
+    index_name_ocr: str | None = None,
+    document_key: str | None = Form(None),
+):
+    content = await document_processor.read_upload(file)
+
+    # A revision of a keyed document goes into the indexes it was uploaded to before.
+    if document_key and not (index_name_text or index_name_ocr):
+        known = await document_indexes(document_key)
+        if known:
+            index_name_text, index_name_ocr = known["index_name_pdf"], known["index_name_ocr"]
+
+    # Same bytes (and same target indexes/document key, if given) -> reuse the earlier result
+    fingerprint = upload_fingerprint(content, index_name_text, index_name_ocr, document_key)
+    existing = await get_indexed_document(fingerprint)
+    if existing:
+        logger.info(f"Duplicate upload of {file.filename}; reusing {existing['index_name_pdf']}/{existing['index_name_ocr']}")
+        return JSONResponse(
+            content={
+                "success": True,
+                "job_id": existing.get("job_id"),
+                "status": "completed",
+                "index_name_pdf": existing["index_name_pdf"],
+                "index_name_ocr": existing["index_name_ocr"],
+                "pdf_url": existing["pdf_url"],
+                "deduplicated": True,
+                "message": "Document already indexed",
+            },
+            status_code=200,
+        )
+
+    job_id = new_job_id()
+    running_job_id = await claim_fingerprint(fingerprint, job_id)
+    if running_job_id:
+        running_job = None
+        # A fresh claim may not have its first status write yet; give it a moment.
+        for _ in range(CLAIM_STATUS_RETRIES):
+            running_job = await ingestion_jobs.get(running_job_id)
+            if running_job:
+                break
+            await asyncio.sleep(CLAIM_STATUS_RETRY_SECONDS)
+        if running_job:
+            logger.info(f"Duplicate upload of {file.filename}; joining running job {running_job_id}")
+            return _job_accepted_response(
+                running_job, running_job["index_name_pdf"], running_job["index_name_ocr"], deduplicated=True
+            )
+        # The claim points at a job that no longer exists: take it over, never run without it.
+        if not await take_over_fingerprint(fingerprint, running_job_id, job_id):
+            raise HTTPException(status_code=409, detail="This document is already being processed; retry shortly")
+        logger.info(f"Took over stale upload claim of job {running_job_id} for {file.filename}")
+
     if not index_name_text:
         index_name_text = f"pdf-index-{uuid4().hex[:8]}"
     if not index_name_ocr:
@@ -44,20 +142,61 @@ async def upload_pdf(file: UploadFile, index_name_text: str | None = None, index
 
     logger.info(f"Using index name: {index_name_text} for text embeddings")
     logger.info(f"Using index name: {index_name_ocr} for OCR embeddings")
-    result = await document_processor.process_input(file, index_name_ocr, index_name_text)
+    if document_key:
+        await remember_document_indexes(document_key, index_name_text, index_name_ocr)
+    job = await ingestion_jobs.submit(
+        content, file.filename, index_name_ocr, index_name_text,
+        fingerprint=fingerprint, job_id=job_id, document_key=document_key,
+    )
     # asyncio.create_task(delete_index_after_delay(index_name, delay=600))
-    return JSONResponse(
-        content={
-            "success": True,
-            "index_name_pdf": result["index_name_text"],
-            "index_name_ocr": result["index_name_ocr"],
-            "pdf_url": result["pdf_url"],
-            "message": "Upload complete",
-        },
-        status_code=200,
+    return _job_accepted_response(job, index_name_text, index_name_ocr)
+
+
+@app.get("/upload/jobs/{job_id}")
+async def upload_job_status(job_id: str):
+    job = await ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/upload/jobs/{job_id}/events")
+async def upload_job_events(job_id: str):
+    """Server-Sent Events feed of job status and per-page progress."""
+    return StreamingResponse(
+        ingestion_jobs.events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
+@app.get("/documents/{doc_id}/pages/{page_number}/words")
+async def page_word_boxes(doc_id: str, page_number: int, terms: str | None = None):
+    """OCR word boxes for one page; with `terms`, only the boxes to highlight."""
+    words = await load_page_word_boxes(doc_id, page_number)
+    if words is None:
+        raise HTTPException(status_code=404, detail="No word boxes for this page")
+    if terms:
+        words = match_words(words, terms)
+    return {"doc_id": doc_id, "page_number": page_number, "words": words}
+
+
+@app.get("/documents/{doc_id}/pages/{page_number}/image")
+async def page_image(doc_id: str, page_number: int, request: Request, size: str = "thumb"):
+    """A page rendered at `size` (thumb/medium WebP, full PNG), cached on disk and by browsers."""
+    if size not in PAGE_IMAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {list(PAGE_IMAGE_SIZES)}")
+    path = await get_page_rendition(doc_id, page_number, size)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Page image not available")
+
+    etag = rendition_etag(path)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={PAGE_IMAGE_MAX_AGE_SECONDS}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=PAGE_IMAGE_SIZES[size], headers=headers)
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
@@ -105,42 +244,42 @@ async def websocket_dual_channel_endpoint(websocket: WebSocket):
         logger.info("Dual-channel connection closed")
 
 
-@app.post("/retrieve-response")
-async def retrieve_response(request: Request):
-    try:
-        # Try to parse JSON body
-        body_bytes = await request.body()
-        if not body_bytes:
-            logger.error("Empty request body")
-            return JSONResponse(status_code=400, content={"error": "Empty request body"})
+async def _retrieve_params(request: Request):
+    """Pipeline arguments from a /retrieve-response body, or (None, error response)."""
+    # Try to parse JSON body
+    body_bytes = await request.body()
+    if not body_bytes:
+        logger.error("Empty request body")
+        return None, JSONResponse(status_code=400, content={"error": "Empty request body"})
 
-        try:
-            data = json.loads(body_bytes)
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON received: {body_bytes[:200]!r}")
-            return JSONResponse(status_code=400, content={"error": "Invalid JSON payload"})
+    try:
+        data = json.loads(body_bytes)
+    except json.JSONDecodeError:
+        logger.error(f"Invalid JSON received: {body_bytes[:200]!r}")
+        return None, JSONResponse(status_code=400, content={"error": "Invalid JSON payload"})
 
-        logger.info(f"Received /retrieve-response with data: {data}")
+    logger.info(f"Received {request.url.path} with data: {data}")
 
-        # Extract parameters safely
-        index_name_pdf = data.get("index_name_pdf")
-        index_name_ocr = data.get("index_name_ocr")
-        conversations = data.get("conversations", [])
-        query = data.get("query", "")
-        isWebSearchOn = data.get("isWebSearchOn", False)
-        isDocSearchOn = data.get("isDocSearchOn", False)
+    # Extract parameters safely
+    return {
+        "index_name_pdf": data.get("index_name_pdf"),
+        "index_name_ocr": data.get("index_name_ocr"),
+        "conversations": data.get("conversations", []),
+        "query": data.get("query", ""),
+        "isWebSearchOn": data.get("isWebSearchOn", False),
+        "isDocSearchOn": data.get("isDocSearchOn", False),
+    }, None
 
 
+@app.post("/retrieve-response")
+async def retrieve_response(request: Request):
+    try:
+        params, error = await _retrieve_params(request)
+        if error is not None:
+            return error
 
         # Pass everything to your retrieval pipeline
-        response = await retrieve_response_pipeline(
-            index_name_pdf=index_name_pdf,
-            index_name_ocr=index_name_ocr,
-            conversations=conversations,
-            query=query,
-            isWebSearchOn=isWebSearchOn,
-            isDocSearchOn=isDocSearchOn,
-        )
+        response = await retrieve_response_pipeline(**params)
 
         return {"status": "success", "data": response}
 
@@ -152,6 +291,36 @@ async def retrieve_response(request: Request):
         )
 
 
+@app.post("/retrieve-response/stream")
+async def retrieve_response_streaming(request: Request):
+    """
+    Server-Sent Events form of /retrieve-response (same request body).
+    Retrieval results are sent as soon as they are ready, then the answer as
+    `token` events while Gemini generates it, then `done`.
+    """
+    params, error = await _retrieve_params(request)
+    if error is not None:
+        return error
+
+    async def _events():
+        stream = retrieve_response_stream(**params)
+        try:
+            async for event, payload in stream:
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            logger.exception("Error in /retrieve-response/stream")
+            yield f"event: error\ndata: {json.dumps({'status': 'error', 'message': str(e)})}\n\n"
+        finally:
+            # Also runs when the client disconnects, so unfinished branches are cancelled.
+            await stream.aclose()
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -165,10 +334,12 @@ async def health():
     """Detailed health check"""
     import os
     deepgram_key_set = bool(os.getenv("DEEPGRAM_API_KEY") and os.getenv("DEEPGRAM_API_KEY") != "your_api_key_here")
+    embedding_cache = get_embedding_cache()
     return {
         "status": "healthy",
         "service": "Deepgram Transcription Service",
-        "deepgram_api_key_set": deepgram_key_set
+        "deepgram_api_key_set": deepgram_key_set,
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
     }
 
 @app.on_event("startup")
@@ -186,6 +357,7 @@ async def shutdown_event():
     logger.info("=" * 80)
     logger.info(" Shutting down application...")
     logger.info("=" * 80)
+    await aclose_serper()
     logger.info(" Application shutdown complete")
     await disconnect_db()
 
@@ -1,12 +1,19 @@
-import redis.asyncio as redis
+import redis
+import redis.asyncio as aioredis
 from dotenv import load_dotenv
 import os
 load_dotenv()
 
 url: str = os.getenv("REDIS_URL") or "redis://localhost:6379/0"
 
-redis_client = redis.from_url(
+redis_client = aioredis.from_url(
     url,
     encoding="utf-8",
     decode_responses=True
 )
+
+# Binary-safe clients for raw payloads (embedding vectors, etc.).
+# The sync one is for code running in worker threads.
+redis_binary_client = aioredis.from_url(url, decode_responses=False)
+redis_sync_binary_client = redis.Redis.from_url(url, decode_responses=False)
+redis_sync_client = redis.Redis.from_url(url, encoding="utf-8", decode_responses=True)
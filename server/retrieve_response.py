@@ -1,11 +1,22 @@
 import asyncio
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 from utils.prompt_template import get_prompt
-from utils.embedding import get_embeddings
-from utils.db_connections import get_pinecone_connector
-from utils.serper import search_serper
-from utils.llm import chat
+from utils.embedding import aget_embeddings
+from utils.db_connections import resolve_index
+from utils.vector_store import get_vector_store
+from utils.keyword_index import (
+    HYBRID_SEARCH_ENABLED,
+    KEYWORD_FAST_PATH_ENABLED,
+    exact_matches,
+    rrf_fuse,
+    search_keywords,
+)
+from utils.context_packer import pack_context
+from utils.page_images import document_pdf_url, page_image_url, thumbnail_url
+from utils.serper import asearch_serper
+from utils.llm import CHAT_ERROR, chat, chat_stream
+from utils.answer_cache import context_fingerprint, lookup_answer, store_answer
 import requests
 from utils.prompt_enhancement import enhance_prompt
 
@@ -15,6 +26,209 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s",
 )
 
+async def _query_index(index_name: str, namespace, vector: List[float], top_k: int, include_values: bool = False) -> List[Dict]:
+    """Vector query on a worker thread; index handles may do network I/O too."""
+    def _run():
+        index = get_vector_store().index(index_name)
+        return index.query(
+            vector=vector, top_k=top_k, include_metadata=True, include_values=include_values, namespace=namespace
+        )
+
+    results = await asyncio.to_thread(_run)
+    return results.get("matches", [])
+
+
+def _embed_query(query: str) -> "asyncio.Task":
+    logging.info("Generating embeddings for query...")
+
+    async def _embed():
+        embedding = (await aget_embeddings([query]))[0]
+        logging.info("Embedding generated successfully.")
+        return embedding
+
+    return asyncio.create_task(_embed())
+
+
+async def _search_pdf(index_name: str, namespace, query: str, keyword_matches: List[Dict], embedding: Optional["asyncio.Task"]):
+    """
+    PDF-index matches packed for the prompt (utils.context_packer) and the
+    retrieval mode; `embedding` is None on the keyword fast path.
+    """
+    if embedding is None:
+        fast_path_matches = exact_matches(query, keyword_matches)
+        logging.info(f"Keyword fast path: {len(fast_path_matches)} exact matches, skipping embeddings.")
+        return pack_context(fast_path_matches), "keyword"
+
+    logging.info("Querying PDF Index...")
+    query_vector = await embedding
+    # Chunk vectors let the packer spot near-duplicate chunks.
+    pdf_matches = await _query_index(index_name, namespace, query_vector, top_k=10, include_values=True)
+    logging.info(f"Retrieved {len(pdf_matches)} PDF matches from the vector store.")
+    if keyword_matches:
+        return pack_context(rrf_fuse(pdf_matches, keyword_matches, top_k=10), query_vector), "hybrid"
+    return pack_context(pdf_matches, query_vector), "vector"
+
+
+def _build_pdf_context(pdf_matches: List[Dict]) -> str:
+    if not pdf_matches:
+        logging.warning("No PDF matches found.")
+        return ""
+
+    extracted_items = []
+    for i, match in enumerate(pdf_matches, start=1):
+        metadata = match.get("metadata", {})
+        text = metadata.get("text", "").strip()
+        image_url = metadata.get("image_url", "").strip()
+
+        logging.info(f"Match {i}: score={match.get('score', 0):.4f}")
+        logging.debug(f"   ➜ Text snippet: {text[:100]}{'...' if len(text) > 100 else ''}")
+        if image_url:
+            logging.info(f" Image URL: {image_url}")
+
+        if text or image_url:
+            item_str = ""
+            if text:
+                item_str += f"Text: {text}"
+            if image_url:
+                item_str += f"\nImage: {image_url}"
+            extracted_items.append(item_str.strip())
+
+    return "\n\n".join(extracted_items) if extracted_items else "No relevant context found."
+
+
+async def _search_web(query: str) -> List[Dict]:
+    logging.info(" Performing web search using Serper...")
+    web_results = await asearch_serper(query)
+    logging.info(f" Retrieved {len(web_results)} web results.")
+    return web_results
+
+
+async def _search_ocr(index_name: str, namespace, query: str, embedding: Optional["asyncio.Task"]) -> List[Dict]:
+    """Formatted OCR-page results (document_context)."""
+    logging.info(" Querying OCR Index...")
+    ocr_keyword_matches = []
+    if HYBRID_SEARCH_ENABLED:
+        ocr_keyword_matches = await search_keywords(index_name, namespace, query, top_k=5)
+    if embedding is None:
+        ocr_matches = exact_matches(query, ocr_keyword_matches)
+    else:
+        ocr_matches = await _query_index(index_name, namespace, await embedding, top_k=5)
+        if ocr_keyword_matches:
+            ocr_matches = rrf_fuse(ocr_matches, ocr_keyword_matches, top_k=5)
+    logging.info(f" Retrieved {len(ocr_matches)} OCR matches.")
+
+    formatted_docs = []
+    for i, match in enumerate(ocr_matches, start=1):
+        metadata = match.get("metadata", {})
+        formatted_docs.append({
+            "doc_id": metadata.get("doc_id"),
+            "page_image_url": metadata.get("page_image_url"),
+            "pdf_url": metadata.get("pdf_url"),
+            "page_number": metadata.get("page_number"),
+            "ocr_text_excerpt": metadata.get("ocr_text_excerpt"),
+            "has_word_boxes": metadata.get("has_word_boxes", False),
+        })
+        logging.debug(f" OCR Match {i}: Page {metadata.get('page_number')}")
+
+    # Chunks upserted while the PDF was still uploading have no pdf_url in their metadata.
+    no_pdf = [d for d in formatted_docs if not d["pdf_url"] and d["doc_id"]]
+    if no_pdf:
+        pdf_urls = await asyncio.gather(*(document_pdf_url(d["doc_id"]) for d in no_pdf))
+        for doc, pdf_url in zip(no_pdf, pdf_urls):
+            doc["pdf_url"] = pdf_url
+
+    # Pages indexed without an uploaded image (lazy mode) get one now.
+    missing = [d for d in formatted_docs if not d["page_image_url"] and d["doc_id"] and d["pdf_url"]]
+    if missing:
+        urls = await asyncio.gather(*(page_image_url(d["doc_id"], d["page_number"], d["pdf_url"]) for d in missing))
+        for doc, url in zip(missing, urls):
+            doc["page_image_url"] = url
+
+    for doc in formatted_docs:
+        doc["thumbnail_url"] = thumbnail_url(doc["doc_id"], doc["page_number"], doc["page_image_url"])
+    return formatted_docs
+
+
+async def _start_branches(
+    index_name_pdf: str,
+    index_name_ocr: str,
+    query: str,
+    isWebSearchOn: bool,
+    isDocSearchOn: bool,
+) -> Dict[str, "asyncio.Task"]:
+    """
+    Start every independent retrieval branch as a task:
+
+        web  ─────────────────────────────► web_results
+        embedding ─┐
+        keywords ──┴─ (fast path?) ─┬─ pdf ─► prompt ─► LLM
+                                    └─ ocr ─► document_context
+
+    Only the LLM waits on PDF retrieval; web search and OCR retrieval run
+    alongside it, so latency tracks the slowest branch. The embedding is
+    cancelled when the keyword fast path answers the query.
+    """
+    pdf_index_name, pdf_namespace = resolve_index(index_name_pdf, "pdf")
+    ocr_index_name, ocr_namespace = resolve_index(index_name_ocr, "ocr")
+    tasks: Dict[str, asyncio.Task] = {}
+    if isWebSearchOn:
+        tasks["web"] = asyncio.create_task(_search_web(query))
+
+    # The embedding runs alongside the keyword search rather than after it.
+    embedding = _embed_query(query)
+
+    # ---- Keyword (BM25) search ----
+    keyword_matches = []
+    if HYBRID_SEARCH_ENABLED:
+        keyword_matches = await search_keywords(pdf_index_name, pdf_namespace, query, top_k=10)
+        logging.info(f"Retrieved {len(keyword_matches)} keyword matches.")
+
+    # Exact identifier lookups are answered from the keyword index alone.
+    if KEYWORD_FAST_PATH_ENABLED and exact_matches(query, keyword_matches):
+        embedding.cancel()
+        embedding = None
+
+    tasks["pdf"] = asyncio.create_task(_search_pdf(pdf_index_name, pdf_namespace, query, keyword_matches, embedding))
+    if isDocSearchOn:
+        tasks["ocr"] = asyncio.create_task(_search_ocr(ocr_index_name, ocr_namespace, query, embedding))
+    if embedding is not None:
+        tasks["embedding"] = embedding
+    return tasks
+
+
+def _build_prompt(pdf_matches: List[Dict], query: str, conversations: List[Dict]) -> str:
+    pdf_context = _build_pdf_context(pdf_matches)
+    logging.info(" Building prompt for Gemini LLM...")
+    prompt = get_prompt(context=pdf_context, query=query, conversations=conversations)
+    logging.debug(f" Prompt preview:\n{prompt[:500]}{'...' if len(prompt) > 500 else ''}")
+    return prompt
+
+
+def _answer_cache_key(
+    index_name_pdf: str,
+    query: str,
+    pdf_matches: List[Dict],
+    conversations: List[Dict],
+    tasks: Dict[str, "asyncio.Task"],
+) -> Dict:
+    """Answers are cached per PDF index/namespace, query embedding and prompt context."""
+    index_name, namespace = resolve_index(index_name_pdf, "pdf")
+    return {
+        "index_name": index_name,
+        "namespace": namespace,
+        "query": query,
+        # Already awaited by PDF retrieval; absent on the keyword fast path.
+        "vector": tasks["embedding"].result() if "embedding" in tasks else None,
+        "fingerprint": context_fingerprint(pdf_matches, conversations),
+    }
+
+
+def _cancel(tasks: Dict[str, "asyncio.Task"]) -> None:
+    for task in tasks.values():
+        if not task.done():
+            task.cancel()
+
+
 async def retrieve_response_pipeline(
     index_name_pdf: str,
     index_name_ocr: str,
@@ -33,87 +247,116 @@ async def retrieve_response_pipeline(
     logging.info(f" PDF Index: {index_name_pdf}, OCR Index: {index_name_ocr}")
     logging.info(f" WebSearch: {isWebSearchOn},  DocSearch: {isDocSearchOn}")
 
-    # ---- Get embedding for the query ----
-    logging.info("Generating embeddings for query...")
-    query_embedding = get_embeddings([query])[0]
-    logging.info("Embedding generated successfully.")
+    tasks = await _start_branches(index_name_pdf, index_name_ocr, query, isWebSearchOn, isDocSearchOn)
+    try:
+        pdf_matches, main_response["retrieval_mode"] = await tasks["pdf"]
+        cache_key = _answer_cache_key(index_name_pdf, query, pdf_matches, conversations, tasks)
+        cached_answer = await lookup_answer(**cache_key)
+        main_response["cached"] = cached_answer is not None
 
-    # ----  Connect to Pinecone ----
-    logging.info("Connecting to Pinecone...")
-    pinecone_client = get_pinecone_connector()
-    logging.info("Connected to Pinecone successfully.")
+        if cached_answer is not None:
+            logging.info(" Answer served from the semantic answer cache.")
+            main_response["llm_response"] = cached_answer
+        else:
+            # ---- Build prompt and call Gemini ----
+            prompt = _build_prompt(pdf_matches, query, conversations)
 
-    # ---- Retrieve from PDF Index ----
-    logging.info("Querying PDF Index...")
-    pdf_index = pinecone_client.Index(index_name_pdf)
-    pdf_results = pdf_index.query(vector=query_embedding, top_k=10, include_metadata=True)
-    pdf_matches = pdf_results.get("matches", [])
-    logging.info(f"Retrieved {len(pdf_matches)} PDF matches from Pinecone.")
-
-    # ---- Extract PDF text + image context ----
-    pdf_context = ""
-    if pdf_matches:
-        extracted_items = []
-        for i, match in enumerate(pdf_matches, start=1):
-            metadata = match.get("metadata", {})
-            text = metadata.get("text", "").strip()
-            image_url = metadata.get("image_url", "").strip()
-
-            logging.info(f"Match {i}: score={match.get('score', 0):.4f}")
-            logging.debug(f"   ➜ Text snippet: {text[:100]}{'...' if len(text) > 100 else ''}")
-            if image_url:
-                logging.info(f" Image URL: {image_url}")
+            logging.info(" Calling Gemini LLM...")
+            gemini_output = await asyncio.to_thread(chat, prompt)
+            main_response["llm_response"] = gemini_output
+            logging.info(" Gemini response received.")
+            logging.debug(f" Gemini Output Preview: {str(gemini_output)[:400]}")
+            if gemini_output != CHAT_ERROR:
+                await store_answer(**cache_key, answer=gemini_output)
 
-            if text or image_url:
-                item_str = ""
-                if text:
-                    item_str += f"Text: {text}"
-                if image_url:
-                    item_str += f"\nImage: {image_url}"
-                extracted_items.append(item_str.strip())
+        # ----  Web search and document OCR search (optional, already running) ----
+        if "web" in tasks:
+            main_response["web_results"] = await tasks["web"]
+        if "ocr" in tasks:
+            main_response["document_context"] = await tasks["ocr"]
+    finally:
+        _cancel(tasks)
 
-        pdf_context = "\n\n".join(extracted_items) if extracted_items else "No relevant context found."
-    else:
-        logging.warning("No PDF matches found.")
+    logging.info(" Pipeline completed successfully.")
+    return main_response
 
-    # ---- Build prompt and call Gemini ----
-    logging.info(" Building prompt for Gemini LLM...")
-    prompt = get_prompt(context=pdf_context, query=query, conversations=conversations)
-    logging.debug(f" Prompt preview:\n{prompt[:500]}{'...' if len(prompt) > 500 else ''}")
 
-    logging.info(" Calling Gemini LLM...")
-    gemini_output = chat(prompt)
-    main_response["llm_response"] = gemini_output
-    logging.info(" Gemini response received.")
-    logging.debug(f" Gemini Output Preview: {str(gemini_output)[:400]}")
+async def retrieve_response_stream(
+    index_name_pdf: str,
+    index_name_ocr: str,
+    conversations: List[Dict],
+    query: str,
+    isWebSearchOn: bool,
+    isDocSearchOn: bool,
+):
+    """
+    Streaming form of `retrieve_response_pipeline`, yielding (event, data)
+    pairs as soon as each piece is ready:
 
-    # ----  Web search (optional) ----
-    if isWebSearchOn:
-        logging.info(" Performing web search using Serper...")
-        web_results = search_serper(query)
-        main_response["web_results"] = web_results
-        logging.info(f" Retrieved {len(web_results)} web results.")
+        retrieval_mode    once PDF retrieval is done, before the first token
+        web_results       when web search finishes
+        document_context  when OCR retrieval finishes
+        token             each chunk of the answer, as Gemini produces it
+        done              the full llm_response and whether it was cached,
+                          after every other event
 
-    # ----  Document OCR search (optional) ----
-    if isDocSearchOn:
-        logging.info(" Querying OCR Index...")
-        ocr_index = pinecone_client.Index(index_name_ocr)
-        ocr_results = ocr_index.query(vector=query_embedding, top_k=5, include_metadata=True)
-        ocr_matches = ocr_results.get("matches", [])
-        logging.info(f" Retrieved {len(ocr_matches)} OCR matches.")
-
-        formatted_docs = []
-        for i, match in enumerate(ocr_matches, start=1):
-            metadata = match.get("metadata", {})
-            formatted_docs.append({
-                "page_image_url": metadata.get("page_image_url"),
-                "pdf_url": metadata.get("pdf_url"),
-                "page_number": metadata.get("page_number"),
-                "ocr_text_excerpt": metadata.get("ocr_text_excerpt"),
-            })
-            logging.debug(f" OCR Match {i}: Page {metadata.get('page_number')}")
-
-        main_response["document_context"] = formatted_docs
+    web_results and document_context usually arrive before the first token,
+    but are never held back behind it.
+    """
+    logging.info("Starting retrieve_response_stream")
+    logging.info(f"Query: {query}")
+    logging.info(f" PDF Index: {index_name_pdf}, OCR Index: {index_name_ocr}")
+    logging.info(f" WebSearch: {isWebSearchOn},  DocSearch: {isDocSearchOn}")
 
-    logging.info(" Pipeline completed successfully.")
-    return main_response
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def _answer() -> Dict:
+        pdf_matches, retrieval_mode = await tasks["pdf"]
+        events.put_nowait(("retrieval_mode", retrieval_mode))
+        cache_key = _answer_cache_key(index_name_pdf, query, pdf_matches, conversations, tasks)
+        cached_answer = await lookup_answer(**cache_key)
+        if cached_answer is not None:
+            logging.info(" Answer served from the semantic answer cache.")
+            events.put_nowait(("token", cached_answer))
+            return {"llm_response": cached_answer, "cached": True}
+
+        prompt = _build_prompt(pdf_matches, query, conversations)
+        logging.info(" Streaming Gemini LLM response...")
+        chunks = []
+        async for text in chat_stream(prompt):
+            chunks.append(text)
+            events.put_nowait(("token", text))
+        logging.info(" Gemini stream finished.")
+        llm_response = "".join(chunks)
+        if CHAT_ERROR not in chunks:
+            await store_answer(**cache_key, answer=llm_response)
+        return {"llm_response": llm_response, "cached": False}
+
+    tasks = await _start_branches(index_name_pdf, index_name_ocr, query, isWebSearchOn, isDocSearchOn)
+    tasks["answer"] = asyncio.create_task(_answer())
+    outputs = {"web": "web_results", "ocr": "document_context", "answer": "done"}
+    pending = [name for name in outputs if name in tasks]
+    for name in pending:
+        tasks[name].add_done_callback(lambda task, name=name: events.put_nowait((name, task)))
+
+    try:
+        remaining = len(pending)
+        answer = {}
+        while remaining:
+            kind, value = await events.get()
+            if kind == "token":
+                yield "token", {"text": value}
+            elif kind == "retrieval_mode":
+                yield "retrieval_mode", {"retrieval_mode": value}
+            else:
+                remaining -= 1
+                result = value.result()
+                if kind == "answer":
+                    answer = result
+                else:
+                    yield outputs[kind], result
+        yield "done", answer
+    finally:
+        _cancel(tasks)
+
+    logging.info(" Stream completed successfully.")
@@ -0,0 +1,188 @@
+"""
+Semantic cache of LLM answers.
+
+Recurring meetings ask near-identical questions ("what's the Q3 target?",
+"what is the Q3 target") against the same documents. An answer is reused
+when, for the same PDF index/namespace:
+
+- the query embedding has cosine similarity >= ANSWER_CACHE_THRESHOLD with
+  a cached query (keyword fast-path queries have no embedding and must match
+  the cached query text exactly, after normalisation), and
+- the retrieved chunks (IDs and texts) are identical, so a revised
+  document or a different set of matches never gets an answer built from
+  other context.
+
+The live meeting transcript is sent with every question and grows with
+every turn, so it is left out of the key by default: a cached answer may
+have been written for an earlier point of the meeting. Setting
+ANSWER_CACHE_CONVERSATION_TURNS=N also keys on the last N turns, which
+keeps follow-up questions apart at the cost of far fewer hits while people
+are still talking.
+
+Keys, per vector index and namespace (`anscache:{index}:{namespace}`):
+    :lru        sorted set entry_id -> last use (unix time)
+    :e:{id}     hash vec (float32), query, fingerprint, answer; expires after ANSWER_CACHE_TTL_SECONDS
+
+At most ANSWER_CACHE_MAX_ENTRIES entries are kept per namespace; the least
+recently used are evicted first. Redis failures count as misses.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from redis_client import redis_binary_client, redis_sync_client
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+ANSWER_CACHE_CONVERSATION_TURNS = int(os.getenv("ANSWER_CACHE_CONVERSATION_TURNS", "0"))
+
+# Only what matching needs; the answer itself is fetched for the hit alone.
+_MATCH_FIELDS = ("vec", "query", "fingerprint")
+
+
+def _prefix(index_name: str, namespace: Optional[str]) -> str:
+    return f"anscache:{index_name}:{namespace or ''}"
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query.lower()).strip(" ?!.")
+
+
+def context_fingerprint(
+    matches: List[Dict],
+    conversations: Optional[List[Dict]] = None,
+    turns: int = ANSWER_CACHE_CONVERSATION_TURNS,
+) -> str:
+    """
+    Hash of the retrieved chunks (order-independent) and, with `turns` > 0,
+    of the last `turns` conversation turns.
+    """
+    digest = hashlib.sha256()
+    for chunk_id, text in sorted((str(m.get("id")), m.get("metadata", {}).get("text", "")) for m in matches):
+        digest.update(chunk_id.encode("utf-8") + b"\0" + text.encode("utf-8") + b"\0")
+    if turns <= 0:
+        return digest.hexdigest()
+    digest.update(b"\1")
+    for turn in (conversations or [])[-turns:]:
+        digest.update(f"{turn.get('role', '')}\0{turn.get('text', '')}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _entry_id(query: str, fingerprint: str) -> str:
+    return hashlib.sha256(f"{normalize_query(query)}\0{fingerprint}".encode("utf-8")).hexdigest()[:24]
+
+
+async def lookup_answer(
+    index_name: str,
+    namespace: Optional[str],
+    query: str,
+    vector: Optional[Sequence[float]],
+    fingerprint: str,
+) -> Optional[str]:
+    """Cached answer for a similar query over the same context, or None."""
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    prefix = _prefix(index_name, namespace)
+    try:
+        ids = await redis_binary_client.zrevrange(f"{prefix}:lru", 0, ANSWER_CACHE_MAX_ENTRIES - 1)
+        if not ids:
+            return None
+        pipe = redis_binary_client.pipeline(transaction=False)
+        for entry_id in ids:
+            pipe.hmget(f"{prefix}:e:{entry_id.decode()}", *_MATCH_FIELDS)
+        rows = await pipe.execute()
+    except Exception as e:
+        logger.warning("Answer cache unavailable: %s", e)
+        return None
+
+    expired = [entry_id for entry_id, row in zip(ids, rows) if row[0] is None]
+    fingerprint_bytes = fingerprint.encode()
+    candidates = [(entry_id, row) for entry_id, row in zip(ids, rows) if row[0] is not None and row[2] == fingerprint_bytes]
+
+    hit = None
+    if vector is None:
+        wanted = normalize_query(query).encode("utf-8")
+        hit = next(((entry_id, row) for entry_id, row in candidates if row[1] == wanted), None)
+    else:
+        q = np.asarray(vector, dtype=np.float32)
+        candidates = [(entry_id, row) for entry_id, row in candidates if len(row[0]) == q.nbytes]
+        if candidates:
+            cached = np.stack([np.frombuffer(row[0], dtype=np.float32) for _, row in candidates])
+            sims = cached @ q / (np.linalg.norm(cached, axis=1) * np.linalg.norm(q) + 1e-12)
+            best = int(np.argmax(sims))
+            if sims[best] >= ANSWER_CACHE_THRESHOLD:
+                hit = candidates[best]
+                logger.info("Answer cache hit (cosine %.4f)", sims[best])
+
+    answer = None
+    try:
+        pipe = redis_binary_client.pipeline(transaction=False)
+        if expired:
+            pipe.zrem(f"{prefix}:lru", *expired)
+        if hit is not None:
+            pipe.zadd(f"{prefix}:lru", {hit[0]: time.time()})
+            pipe.hget(f"{prefix}:e:{hit[0].decode()}", "answer")
+        if expired or hit is not None:
+            results = await pipe.execute()
+            answer = results[-1] if hit is not None else None
+    except Exception as e:
+        logger.warning("Answer cache bookkeeping failed: %s", e)
+    return answer.decode("utf-8") if answer is not None else None
+
+
+async def store_answer(
+    index_name: str,
+    namespace: Optional[str],
+    query: str,
+    vector: Optional[Sequence[float]],
+    fingerprint: str,
+    answer: str,
+) -> None:
+    if not ANSWER_CACHE_ENABLED or not answer:
+        return
+    prefix = _prefix(index_name, namespace)
+    entry_id = _entry_id(query, fingerprint)
+    entry = {
+        # Fast-path queries are cached without a vector; only exact-text lookups find them.
+        "vec": np.asarray(vector if vector is not None else [], dtype=np.float32).tobytes(),
+        "query": normalize_query(query),
+        "fingerprint": fingerprint,
+        "answer": answer,
+    }
+    try:
+        pipe = redis_binary_client.pipeline(transaction=False)
+        pipe.hset(f"{prefix}:e:{entry_id}", mapping=entry)
+        pipe.expire(f"{prefix}:e:{entry_id}", ANSWER_CACHE_TTL_SECONDS)
+        pipe.zadd(f"{prefix}:lru", {entry_id: time.time()})
+        pipe.expire(f"{prefix}:lru", ANSWER_CACHE_TTL_SECONDS)
+        pipe.zcard(f"{prefix}:lru")
+        size = (await pipe.execute())[-1]
+
+        excess = size - ANSWER_CACHE_MAX_ENTRIES
+        if excess > 0:
+            evicted = await redis_binary_client.zpopmin(f"{prefix}:lru", excess)
+            await redis_binary_client.delete(*(f"{prefix}:e:{member.decode()}" for member, _ in evicted))
+            logger.info("Answer cache evicted %d entries from %s", len(evicted), prefix)
+    except Exception as e:
+        logger.warning("Answer cache write failed: %s", e)
+
+
+def drop_answer_cache(index_name: str, namespace: Optional[str] = None) -> None:
+    """Remove every cached answer of one index/namespace."""
+    prefix = _prefix(index_name, namespace)
+    try:
+        keys = list(redis_sync_client.scan_iter(match=f"{prefix}:*", count=1000))
+        for i in range(0, len(keys), 1000):
+            redis_sync_client.delete(*keys[i:i + 1000])
+    except Exception as e:
+        logger.warning("Could not drop answer cache for %s: %s", index_name, e)
@@ -0,0 +1,128 @@
+"""
+Where uploaded PDFs, page images and extracted images are kept.
+
+ASSET_STORE selects the backend:
+
+- "cloudinary" (default): Cloudinary, configured once per process
+- "local": files under ASSET_STORE_DIR, served by this app at /assets;
+  ASSET_BASE_URL is the public URL prefix of the server
+
+`put` is blocking (ingestion threads call it directly); async callers use
+`aput`, which runs it on a worker thread so the event loop is never blocked.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+ASSET_STORE = os.getenv("ASSET_STORE", "cloudinary")
+ASSET_STORE_DIR = os.getenv("ASSET_STORE_DIR", "assets")
+ASSET_BASE_URL = os.getenv("ASSET_BASE_URL", "http://localhost:8000").rstrip("/")
+ASSET_FETCH_TIMEOUT_SECONDS = float(os.getenv("ASSET_FETCH_TIMEOUT_SECONDS", "30"))
+
+
+class AssetStore(ABC):
+    """Stores bytes under a readable name and returns a public URL (None on failure)."""
+
+    # Whether third-party APIs (e.g. the captioning model) can download the URLs.
+    remote_fetchable = True
+
+    @abstractmethod
+    def put(self, data: bytes, name: str, kind: str = "image") -> Optional[str]:
+        ...
+
+    def fetch(self, url: str) -> bytes:
+        response = requests.get(url, timeout=ASSET_FETCH_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return response.content
+
+    def resized_url(self, url: str, width: int) -> Optional[str]:
+        """A URL of the stored image `url` scaled to `width`, if the store can resize; else None."""
+        return None
+
+    async def aput(self, data: bytes, name: str, kind: str = "image") -> Optional[str]:
+        return await asyncio.to_thread(self.put, data, name, kind)
+
+    async def afetch(self, url: str) -> bytes:
+        return await asyncio.to_thread(self.fetch, url)
+
+
+class CloudinaryAssetStore(AssetStore):
+    def __init__(self):
+        # Imported here: the module needs Cloudinary credentials to be usable.
+        from utils import cloudinary_upload
+
+        self._uploads = cloudinary_upload
+
+    def put(self, data: bytes, name: str, kind: str = "image") -> Optional[str]:
+        if kind == "pdf":
+            return self._uploads.upload_pdf_bytes(data, name)
+        return self._uploads.upload_image_bytes(data, name)
+
+    def resized_url(self, url: str, width: int) -> Optional[str]:
+        # Cloudinary derives (and caches) resized renditions from URL transformations.
+        if "/image/upload/" not in url:
+            return None
+        return url.replace("/image/upload/", f"/image/upload/c_limit,w_{width},f_auto,q_auto/", 1)
+
+
+class LocalAssetStore(AssetStore):
+    """Files under `root`, published as `{base_url}/assets/<kind>s/<file>`."""
+
+    # ASSET_BASE_URL is normally this server's own (often localhost) address.
+    remote_fetchable = False
+
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root).resolve()
+        self.base_url = base_url
+        self.prefix = f"{base_url}/assets/"
+
+    def put(self, data: bytes, name: str, kind: str = "image") -> Optional[str]:
+        suffix = Path(name).suffix.lower() or (".pdf" if kind == "pdf" else ".png")
+        relative = f"{kind}s/{Path(name).stem}_{uuid.uuid4().hex[:8]}{suffix}"
+        path = self.root / relative
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(path.suffix + ".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error("Local asset write failed for %s: %s", name, e)
+            return None
+        return self.prefix + relative
+
+    def fetch(self, url: str) -> bytes:
+        if url.startswith(self.prefix):
+            path = (self.root / url[len(self.prefix):]).resolve()
+            if self.root in path.parents:
+                return path.read_bytes()
+        return super().fetch(url)
+
+
+_store_instance: Optional[AssetStore] = None
+_store_lock = threading.Lock()
+
+
+def get_asset_store() -> AssetStore:
+    global _store_instance
+    if _store_instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                if ASSET_STORE == "local":
+                    _store_instance = LocalAssetStore(ASSET_STORE_DIR, ASSET_BASE_URL)
+                elif ASSET_STORE == "cloudinary":
+                    _store_instance = CloudinaryAssetStore()
+                else:
+                    raise ValueError(f"Unknown ASSET_STORE '{ASSET_STORE}' (expected 'cloudinary' or 'local')")
+    return _store_instance
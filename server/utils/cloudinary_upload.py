@@ -1,3 +1,5 @@
+import io
+import logging
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -9,11 +11,29 @@ import uuid
 import fitz  # PyMuPDF for PDF preview rendering
 import tempfile
 import shutil
+import threading
+
+logger = logging.getLogger(__name__)
 
 # ==========================================================
 # Setup Cloudinary
 # ==========================================================
+_configured = False
+_config_lock = threading.Lock()
+
+
 def _setup_cloudinary():
+    """Configure Cloudinary on first use; later calls are free."""
+    global _configured
+    if _configured:
+        return
+    with _config_lock:
+        if not _configured:
+            _configure()
+            _configured = True
+
+
+def _configure():
     """Locate .env and configure Cloudinary."""
     current_dir = Path(__file__).resolve().parent
     env_path = None
@@ -64,6 +84,23 @@ def get_image_url(image_path: str) -> str:
         return None
 
 
+def upload_image_bytes(image_bytes: bytes, name: str = "image") -> str:
+    """Upload in-memory image bytes to Cloudinary and return secure URL."""
+    _setup_cloudinary()
+    public_id = f"{Path(name).stem}_{uuid.uuid4().hex[:6]}"
+    try:
+        res = cloudinary.uploader.upload(
+            io.BytesIO(image_bytes),
+            public_id=public_id,
+            unique_filename=False,
+            overwrite=True,
+        )
+        return CloudinaryImage(res["public_id"]).build_url(secure=True)
+    except Exception as e:
+        logger.error("Image upload failed: %s", e)
+        return None
+
+
 # ==========================================================
 # PDF Upload (with Preview)
 # ==========================================================
@@ -98,6 +135,23 @@ def get_pdf_url(pdf_path: str, dpi: int = 150) -> dict:
 
     return pdf_url
 
+def upload_pdf_bytes(pdf_bytes: bytes, filename: str = "document.pdf") -> str:
+    """Upload in-memory PDF bytes to Cloudinary (as raw) and return its secure URL."""
+    _setup_cloudinary()
+    public_id = f"{Path(filename).stem}_{uuid.uuid4().hex[:8]}"
+    try:
+        pdf_res = cloudinary.uploader.upload(
+            io.BytesIO(pdf_bytes),
+            resource_type="raw",  # ✅ allows proper PDF viewing
+            public_id=public_id,
+            unique_filename=False,
+            overwrite=True,
+        )
+        return pdf_res.get("secure_url")
+    except Exception as e:
+        logger.error("PDF upload failed: %s", e)
+        return None
+
 # ==========================================================
 # Example Usage
 # ==========================================================
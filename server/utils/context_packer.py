@@ -0,0 +1,115 @@
+"""
+Selects which retrieved chunks go into the prompt.
+
+PDF retrieval returns the top 10 chunks, but neighbouring fixed-size chunks
+of one page often say the same thing, and the tail of the list is often
+barely related to the question. `pack_context`:
+
+1. drops chunks whose cosine similarity to the query is below
+   CONTEXT_MIN_SCORE (the best match is always kept)
+2. picks chunks by maximal marginal relevance, trading relevance against
+   similarity to chunks already picked (CONTEXT_MMR_LAMBDA)
+3. skips near-duplicates of a picked chunk (similarity >= CONTEXT_DEDUP_THRESHOLD)
+4. stops adding chunks once CONTEXT_TOKEN_BUDGET would be exceeded
+
+Chunk-to-chunk similarity is the cosine of their vectors (queried with
+include_values). Keyword-only matches have no vector and are compared by
+the overlap of their terms instead; they also skip the score cutoff, since
+they matched the query's exact terms.
+"""
+
+import logging
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils.keyword_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_PACKING_ENABLED = os.getenv("CONTEXT_PACKING_ENABLED", "1") == "1"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_MIN_SCORE = float(os.getenv("CONTEXT_MIN_SCORE", "0.3"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.92"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Rough tokens-per-character ratio for budgeting; no tokenizer round trip per request.
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+
+
+def estimate_tokens(match: Dict) -> int:
+    metadata = match.get("metadata", {})
+    chars = len(metadata.get("text", "")) + len(metadata.get("image_url", ""))
+    return max(1, int(chars / CONTEXT_CHARS_PER_TOKEN))
+
+
+def _unit(values) -> Optional[np.ndarray]:
+    if values is None or len(values) == 0:
+        return None
+    v = np.asarray(values, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else None
+
+
+def _similarity(a: Dict, b: Dict) -> float:
+    if a["unit"] is not None and b["unit"] is not None and a["unit"].shape == b["unit"].shape:
+        return float(a["unit"] @ b["unit"])
+    if not a["terms"] or not b["terms"]:
+        return 0.0
+    return len(a["terms"] & b["terms"]) / len(a["terms"] | b["terms"])
+
+
+def pack_context(
+    matches: List[Dict],
+    query_vector: Optional[Sequence[float]] = None,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    min_score: float = CONTEXT_MIN_SCORE,
+    dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD,
+    mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+) -> List[Dict]:
+    """The subset of `matches` (best first) to put in the prompt."""
+    if not CONTEXT_PACKING_ENABLED or len(matches) <= 1:
+        return matches
+
+    query = _unit(query_vector)
+    top_score = max((m.get("score") or 0.0) for m in matches) or 1.0
+    candidates = []
+    for rank, match in enumerate(matches):
+        unit = _unit(match.get("values"))
+        similarity = float(unit @ query) if unit is not None and query is not None and unit.shape == query.shape else None
+        if rank > 0 and similarity is not None and similarity < min_score:
+            continue
+        candidates.append({
+            "match": match,
+            "unit": unit,
+            "terms": set(tokenize(match.get("metadata", {}).get("text", ""))),
+            # Scores are cosine, RRF or BM25 depending on the retrieval mode; only their ratio is used.
+            "relevance": (match.get("score") or 0.0) / top_score,
+            "tokens": estimate_tokens(match),
+        })
+    below_cutoff = len(matches) - len(candidates)
+
+    selected: List[Dict] = []
+    used_tokens = duplicates = over_budget = 0
+    while candidates:
+        best, best_mmr, best_redundancy = None, -np.inf, 0.0
+        for candidate in candidates:
+            redundancy = max((_similarity(candidate, s) for s in selected), default=0.0)
+            mmr = mmr_lambda * candidate["relevance"] - (1 - mmr_lambda) * redundancy
+            if mmr > best_mmr:
+                best, best_mmr, best_redundancy = candidate, mmr, redundancy
+        candidates.remove(best)
+        if best_redundancy >= dedup_threshold:
+            duplicates += 1
+        elif selected and used_tokens + best["tokens"] > token_budget:
+            over_budget += 1
+        else:
+            selected.append(best)
+            used_tokens += best["tokens"]
+
+    total_tokens = sum(estimate_tokens(m) for m in matches)
+    logger.info(
+        "Context packed: %d/%d chunks, ~%d/%d tokens (%d below score cutoff, %d near-duplicates, %d over budget)",
+        len(selected), len(matches), used_tokens, total_tokens, below_cutoff, duplicates, over_budget,
+    )
+    return [s["match"] for s in selected]
@@ -1,8 +1,16 @@
 import os
+from typing import Optional, Tuple
 from pinecone import Pinecone
 from dotenv import load_dotenv
 load_dotenv()
 
+# "index": every upload gets its own pair of serverless indexes (default).
+# "namespace": uploads share two fixed indexes; the index names handed out by
+# /upload (and stored on User) are namespaces inside them.
+PINECONE_TENANCY = os.getenv("PINECONE_TENANCY", "index")
+SHARED_INDEX_PDF = os.getenv("SHARED_INDEX_PDF", "shared-pdf-index")
+SHARED_INDEX_OCR = os.getenv("SHARED_INDEX_OCR", "shared-ocr-index")
+
 
 _pc_instance = None
 
@@ -15,3 +23,14 @@ def get_pinecone_connector():
             raise ValueError("PINECONE_API_KEY not found in environment variables")
         _pc_instance = Pinecone(api_key=api_key)
     return _pc_instance
+
+
+def resolve_index(name: str, kind: str) -> Tuple[str, Optional[str]]:
+    """
+    Map an index_name_pdf / index_name_ocr value (kind "pdf" or "ocr") to the
+    Pinecone (index, namespace) that holds its vectors.
+    """
+    if PINECONE_TENANCY == "namespace":
+        return (SHARED_INDEX_OCR if kind == "ocr" else SHARED_INDEX_PDF), name
+    return name, None
+
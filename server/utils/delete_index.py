@@ -1,23 +1,69 @@
 import asyncio
 import logging
-from utils.db_connections import get_pinecone_connector
+from utils.answer_cache import drop_answer_cache
+from utils.db_connections import PINECONE_TENANCY, resolve_index
+from utils.keyword_index import drop_keyword_index
+from utils.page_images import forget_document, forget_page_images
+from utils.page_manifest import drop_manifests, list_manifests
+from utils.upload_dedup import forget_indexed_document
+from utils.word_boxes import delete_page_word_boxes
+from utils.vector_store import get_vector_store
 
 logger = logging.getLogger(__name__)
 
-async def delete_index_after_delay(index_name: str, delay: int = 600):
-    """Delete a Pinecone index after a specified delay (in seconds)."""
+
+def drop_document_state(index_name: str, namespace=None) -> None:
+    """
+    Forget every document indexed into `index_name`/`namespace`: page
+    manifests, word boxes and page images. Without this, re-uploading a
+    keyed document into the same index would load the old manifest, treat
+    every page as unchanged and index nothing.
+    """
+    for manifest in list_manifests(index_name, namespace):
+        doc_id = manifest["doc_id"]
+        pages = list(range(1, len(manifest.get("pages", [])) + 1))
+        delete_page_word_boxes(doc_id, pages)
+        forget_page_images(doc_id, pages)
+        forget_document(doc_id)
+    drop_manifests(index_name, namespace)
+
+
+async def delete_index_after_delay(index_name: str, delay: int = 600, kind: str = "pdf"):
+    """
+    Delete a vector index after a specified delay (in seconds).
+    In namespace tenancy mode only the document's namespace is cleared.
+    Per-document state (manifests, word boxes, page images) is keyed on the
+    OCR index, so it is dropped with kind="ocr" only.
+    """
     try:
         logger.info(f"🕒 Scheduled deletion for index '{index_name}' in {delay} seconds...")
         await asyncio.sleep(delay)
 
-        pc = get_pinecone_connector()
-        indexes = [idx["name"] for idx in pc.list_indexes().indexes]
+        # A repeat upload of the same file must not be pointed at the deleted index.
+        await forget_indexed_document(index_name)
+
+        store = get_vector_store()
+        if PINECONE_TENANCY == "namespace":
+            shared_index, namespace = resolve_index(index_name, kind)
+            await asyncio.to_thread(store.index(shared_index).delete, delete_all=True, namespace=namespace)
+            await asyncio.to_thread(drop_keyword_index, shared_index, namespace)
+            await asyncio.to_thread(drop_answer_cache, shared_index, namespace)
+            if kind == "ocr":
+                await asyncio.to_thread(drop_document_state, shared_index, namespace)
+            logger.info(f"🧹 Cleared namespace '{namespace}' in shared index {shared_index}")
+            return
+
+        indexes = await asyncio.to_thread(store.list_indexes)
 
         if index_name in indexes:
-            pc.delete_index(index_name)
-            logger.info(f"🧹 Deleted expired Pinecone index: {index_name}")
+            await asyncio.to_thread(store.delete_index, index_name)
+            await asyncio.to_thread(drop_keyword_index, index_name)
+            await asyncio.to_thread(drop_answer_cache, index_name)
+            if kind == "ocr":
+                await asyncio.to_thread(drop_document_state, index_name)
+            logger.info(f"🧹 Deleted expired index: {index_name}")
         else:
             logger.info(f"Index '{index_name}' already removed or not found.")
 
     except Exception as e:
-        logger.error(f"❌ Error deleting Pinecone index '{index_name}': {str(e)}")
+        logger.error(f"❌ Error deleting index '{index_name}': {str(e)}")
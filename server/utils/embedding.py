@@ -1,7 +1,20 @@
-import requests, os
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
 from dotenv import load_dotenv
+from google import genai
+from google.genai import types
+
+from utils.embedding_cache import EmbeddingCache, cache_key, get_embedding_cache
 
-load_dotenv() 
+load_dotenv()
+logger = logging.getLogger(__name__)
 
 # def get_embeddings(chunks):
 #     response = requests.post(
@@ -13,85 +26,212 @@ load_dotenv()
 #     return response.json()["embeddings"]
 
 
-import os
-from google import genai
-from google.genai import types 
-from typing import List
-
-def get_embeddings(text_chunks: List[str]) -> List[List[float]]:
-    """
-    Generates 384-dimensional embeddings for a list of text chunks.
-    
-    Args:
-        text_chunks: A list of text strings to embed.
-
-    Returns:
-        A list of corresponding 384-dimensional embedding vectors (lists of floats), 
-        or an empty list if authentication or API call fails.
-    """
-    print(f"Generating embeddings for {len(text_chunks)} text chunks.")
-    print("Text chunks preview:", text_chunks[:2])  # Print first 2 chunks for verification
-    if not text_chunks:
-        return []
-
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("Error: GEMINI_API_KEY environment variable not found.")
-        return []
-    
-    try:
-        client = genai.Client(api_key=api_key)
-    except Exception as e:
-        print(f"Error initializing Gemini client: {e}")
-        return []
-
-    try:
-        # Define the configuration using types.EmbedContentConfig
-        embedding_config = types.EmbedContentConfig(
-            task_type="RETRIEVAL_DOCUMENT", 
-            output_dimensionality=384,      
-        )
-
-        # The response object is of type EmbedContentResponse
-        response = client.models.embed_content(
-            model="gemini-embedding-001",
-            contents=text_chunks,
-            config=embedding_config, 
-        )
-
-        # CORRECT WAY TO ACCESS: Use dot notation for the response object 
-        # and access the 'values' attribute of each embedding object.
-        embeddings_vectors = [emb.values for emb in response.embeddings]
-
-        return embeddings_vectors
-
-    except Exception as e:
-        print(f"An error occurred during the API call: {e}")
-        return []
+EMBED_MODEL = "gemini-embedding-001"
+EMBED_DIMENSION = 384
+# Gemini accepts at most 100 contents per embed_content request.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "4"))
+EMBED_BACKOFF_SECONDS = float(os.getenv("EMBED_BACKOFF_SECONDS", "1.0"))
 
 
+class EmbeddingError(RuntimeError):
+    """Raised when embeddings cannot be produced for every input."""
 
 
+class EmbeddingClient:
+    """
+    Long-lived Gemini embedding client.
+
+    Inputs are de-duplicated, split into provider-sized batches and sent
+    concurrently (at most `max_concurrency` requests in flight). Failed
+    batches are retried with exponential backoff; if a batch still fails the
+    whole call raises EmbeddingError instead of returning partial results.
+    `embed` is for worker threads, `aembed` for the event loop. Lookups go
+    through the embedding cache first; only misses reach the API.
+    """
 
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = EMBED_MODEL,
+        dimension: int = EMBED_DIMENSION,
+        batch_size: int = EMBED_BATCH_SIZE,
+        max_concurrency: int = EMBED_MAX_CONCURRENCY,
+        max_retries: int = EMBED_MAX_RETRIES,
+        backoff_seconds: float = EMBED_BACKOFF_SECONDS,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise EmbeddingError("GEMINI_API_KEY environment variable not found.")
+
+        self.model = model
+        self.dimension = dimension
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.cache = cache
+        self._client = genai.Client(api_key=api_key)
+        self._executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="embed")
+        self._async_slots: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+    # ---------------- helpers ----------------
+    def _config(self, task_type: str) -> types.EmbedContentConfig:
+        return types.EmbedContentConfig(task_type=task_type, output_dimensionality=self.dimension)
+
+    def _plan(self, texts: List[str]) -> Tuple[List[str], List[int], List[List[str]]]:
+        """Unique texts, the position of each input in that list, and the batches to send."""
+        positions: Dict[str, int] = {}
+        unique: List[str] = []
+        order: List[int] = []
+        for text in texts:
+            if text not in positions:
+                positions[text] = len(unique)
+                unique.append(text)
+            order.append(positions[text])
+        batches = [unique[i : i + self.batch_size] for i in range(0, len(unique), self.batch_size)]
+        return unique, order, batches
+
+    def _backoff(self, attempt: int) -> float:
+        return self.backoff_seconds * (2 ** (attempt - 1)) * (1 + random.random() * 0.25)
+
+    def _keys(self, texts: List[str], task_type: str) -> List[str]:
+        return [cache_key(self.model, task_type, self.dimension, t) for t in texts]
+
+    def _check(self, batch: List[str], response) -> List[List[float]]:
+        vectors = [list(emb.values) for emb in response.embeddings]
+        if len(vectors) != len(batch):
+            raise EmbeddingError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+        return vectors
+
+    # ---------------- sync API ----------------
+    def _embed_batch(self, batch: List[str], task_type: str) -> List[List[float]]:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self._client.models.embed_content(
+                    model=self.model,
+                    contents=batch,
+                    config=self._config(task_type),
+                )
+                return self._check(batch, response)
+            except Exception as e:
+                if attempt > self.max_retries:
+                    raise EmbeddingError(f"Embedding batch of {len(batch)} failed after {attempt} attempts: {e}") from e
+                wait = self._backoff(attempt)
+                logger.warning("Embedding batch failed (attempt %s). Retrying in %.1fs. Error: %s", attempt, wait, e)
+                time.sleep(wait)
+
+    def _embed_uncached(self, texts: List[str], task_type: str) -> List[List[float]]:
+        unique, order, batches = self._plan(texts)
+        logger.info("Embedding %d texts (%d unique) in %d batches", len(texts), len(unique), len(batches))
+
+        if len(batches) == 1:
+            results = [self._embed_batch(batches[0], task_type)]
+        else:
+            results = list(self._executor.map(lambda b: self._embed_batch(b, task_type), batches))
+
+        unique_vectors = [vec for batch_vectors in results for vec in batch_vectors]
+        return [unique_vectors[i] for i in order]
+
+    def embed(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[List[float]]:
+        if not texts:
+            return []
+        if self.cache is None:
+            return self._embed_uncached(texts, task_type)
+
+        keys = self._keys(texts, task_type)
+        vectors = self.cache.get_many(keys)
+        missing = [i for i, vec in enumerate(vectors) if vec is None]
+        if missing:
+            fresh = self._embed_uncached([texts[i] for i in missing], task_type)
+            for i, vec in zip(missing, fresh):
+                vectors[i] = vec
+            self.cache.put_many([keys[i] for i in missing], fresh)
+        return vectors
+
+    # ---------------- async API ----------------
+    def _slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        slots = self._async_slots.get(loop)
+        if slots is None:
+            slots = self._async_slots[loop] = asyncio.Semaphore(self.max_concurrency)
+        return slots
+
+    async def _aembed_batch(self, batch: List[str], task_type: str) -> List[List[float]]:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self._slots():
+                    response = await self._client.aio.models.embed_content(
+                        model=self.model,
+                        contents=batch,
+                        config=self._config(task_type),
+                    )
+                return self._check(batch, response)
+            except Exception as e:
+                if attempt > self.max_retries:
+                    raise EmbeddingError(f"Embedding batch of {len(batch)} failed after {attempt} attempts: {e}") from e
+                wait = self._backoff(attempt)
+                logger.warning("Embedding batch failed (attempt %s). Retrying in %.1fs. Error: %s", attempt, wait, e)
+                await asyncio.sleep(wait)
+
+    async def _aembed_uncached(self, texts: List[str], task_type: str) -> List[List[float]]:
+        unique, order, batches = self._plan(texts)
+        results = await asyncio.gather(*(self._aembed_batch(b, task_type) for b in batches))
+        unique_vectors = [vec for batch_vectors in results for vec in batch_vectors]
+        return [unique_vectors[i] for i in order]
+
+    async def aembed(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[List[float]]:
+        if not texts:
+            return []
+        if self.cache is None:
+            return await self._aembed_uncached(texts, task_type)
+
+        keys = self._keys(texts, task_type)
+        vectors = await self.cache.aget_many(keys)
+        missing = [i for i, vec in enumerate(vectors) if vec is None]
+        if missing:
+            fresh = await self._aembed_uncached([texts[i] for i in missing], task_type)
+            for i, vec in zip(missing, fresh):
+                vectors[i] = vec
+            await self.cache.aput_many([keys[i] for i in missing], fresh)
+        return vectors
+
+
+_client_instance: Optional[EmbeddingClient] = None
+_client_lock = threading.Lock()
+
+
+def get_embedding_client() -> EmbeddingClient:
+    global _client_instance
+    if _client_instance is None:
+        with _client_lock:
+            if _client_instance is None:
+                _client_instance = EmbeddingClient(cache=get_embedding_cache())
+    return _client_instance
+
+
+def get_embeddings(text_chunks: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[List[float]]:
+    """
+    Generates 384-dimensional embeddings for a list of text chunks.
 
+    Args:
+        text_chunks: A list of text strings to embed.
 
-# # Example Usage
-# if __name__ == "__main__":
-#     # Ensure you have run: export GEMINI_API_KEY="YOUR_API_KEY" in your terminal
-    
-#     input_strings = [
-#         "This code now correctly uses dot notation to access the response attributes.",
-#         "The response object is not subscriptable, it has attributes like 'embeddings'.",
-#         "We successfully access the actual vector values via the '.values' attribute."
-#     ]
+    Returns:
+        A list of corresponding 384-dimensional embedding vectors, in input order.
 
-#     print(f"Number of input strings: {len(input_strings)}")
-#     print("\nGenerating embeddings...")
+    Raises:
+        EmbeddingError: if any batch cannot be embedded after retries.
+    """
+    return get_embedding_client().embed(text_chunks, task_type=task_type)
 
-#     output_vectors_list = get_embeddings_list(input_strings)
 
-#     if output_vectors_list:
-#         print("Embeddings generated successfully:")
-#         print(f"Number of output vectors: {len(output_vectors_list)}")
-#         print(f"Length of the first vector: {len(output_vectors_list[0])}") # Should be 384
-#         print(f"First 5 dimensions: {output_vectors_list[0][:5]}...")
+async def aget_embeddings(text_chunks: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> List[List[float]]:
+    """Async variant of get_embeddings; does not block the event loop."""
+    return await get_embedding_client().aembed(text_chunks, task_type=task_type)
@@ -0,0 +1,187 @@
+"""
+Read-through embedding cache.
+
+Two tiers, both keyed by (model, task_type, dimensionality, sha256(text)):
+- an in-process LRU bounded by bytes (EMBED_CACHE_MEMORY_MB)
+- a shared Redis tier so every API/ingestion worker benefits (EMBED_CACHE_TTL_SECONDS)
+
+Vectors are stored as packed float32. Redis failures are logged and treated
+as misses; the cache never makes an embedding call fail.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from redis_client import redis_binary_client, redis_sync_binary_client
+
+logger = logging.getLogger(__name__)
+
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1") == "1"
+EMBED_CACHE_MEMORY_MB = float(os.getenv("EMBED_CACHE_MEMORY_MB", "64"))
+EMBED_CACHE_TTL_SECONDS = int(os.getenv("EMBED_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+
+def cache_key(model: str, task_type: str, dimension: int, text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"emb:{model}:{task_type}:{dimension}:{digest}"
+
+
+def _pack(vector: Sequence[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(raw: bytes) -> List[float]:
+    vec = array("f")
+    vec.frombytes(raw)
+    return vec.tolist()
+
+
+class EmbeddingCache:
+    """Size-bounded in-process LRU in front of a shared Redis tier."""
+
+    def __init__(
+        self,
+        max_memory_bytes: int = int(EMBED_CACHE_MEMORY_MB * 1024 * 1024),
+        ttl_seconds: int = EMBED_CACHE_TTL_SECONDS,
+        use_shared_tier: bool = True,
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl_seconds = ttl_seconds
+        self.use_shared_tier = use_shared_tier
+        self._lru: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "shared_errors": 0}
+
+    # ---------------- memory tier ----------------
+    def _memory_get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            raw = self._lru.get(key)
+            if raw is not None:
+                self._lru.move_to_end(key)
+            return raw
+
+    def _memory_put(self, key: str, raw: bytes) -> None:
+        size = len(raw) + len(key)
+        with self._lock:
+            old = self._lru.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old) + len(key)
+            self._lru[key] = raw
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes and self._lru:
+                old_key, old_raw = self._lru.popitem(last=False)
+                self._memory_bytes -= len(old_raw) + len(old_key)
+                self._counters["evictions"] += 1
+
+    def _count(self, name: str, n: int = 1) -> None:
+        if n:
+            with self._lock:
+                self._counters[name] += n
+
+    def _from_memory(self, keys: List[str]) -> List[Optional[bytes]]:
+        found = [self._memory_get(k) for k in keys]
+        self._count("memory_hits", sum(1 for raw in found if raw is not None))
+        return found
+
+    def _fill(self, keys: List[str], found: List[Optional[bytes]], shared: List[Optional[bytes]], missing: List[int]) -> List[Optional[List[float]]]:
+        shared_hits = 0
+        for idx, raw in zip(missing, shared):
+            if raw is not None:
+                found[idx] = raw
+                self._memory_put(keys[idx], raw)
+                shared_hits += 1
+        self._count("shared_hits", shared_hits)
+        self._count("misses", sum(1 for raw in found if raw is None))
+        return [_unpack(raw) if raw is not None else None for raw in found]
+
+    # ---------------- sync API ----------------
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        found = self._from_memory(keys)
+        missing = [i for i, raw in enumerate(found) if raw is None]
+        shared: List[Optional[bytes]] = [None] * len(missing)
+        if missing and self.use_shared_tier:
+            try:
+                shared = redis_sync_binary_client.mget([keys[i] for i in missing])
+            except Exception as e:
+                self._count("shared_errors")
+                logger.warning("Embedding cache shared tier unavailable: %s", e)
+        return self._fill(keys, found, shared, missing)
+
+    def put_many(self, keys: List[str], vectors: List[Sequence[float]]) -> None:
+        packed = [_pack(v) for v in vectors]
+        for key, raw in zip(keys, packed):
+            self._memory_put(key, raw)
+        if not self.use_shared_tier or not keys:
+            return
+        try:
+            pipe = redis_sync_binary_client.pipeline(transaction=False)
+            for key, raw in zip(keys, packed):
+                pipe.setex(key, self.ttl_seconds, raw)
+            pipe.execute()
+        except Exception as e:
+            self._count("shared_errors")
+            logger.warning("Embedding cache shared tier write failed: %s", e)
+
+    # ---------------- async API ----------------
+    async def aget_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        found = self._from_memory(keys)
+        missing = [i for i, raw in enumerate(found) if raw is None]
+        shared: List[Optional[bytes]] = [None] * len(missing)
+        if missing and self.use_shared_tier:
+            try:
+                shared = await redis_binary_client.mget([keys[i] for i in missing])
+            except Exception as e:
+                self._count("shared_errors")
+                logger.warning("Embedding cache shared tier unavailable: %s", e)
+        return self._fill(keys, found, shared, missing)
+
+    async def aput_many(self, keys: List[str], vectors: List[Sequence[float]]) -> None:
+        packed = [_pack(v) for v in vectors]
+        for key, raw in zip(keys, packed):
+            self._memory_put(key, raw)
+        if not self.use_shared_tier or not keys:
+            return
+        try:
+            pipe = redis_binary_client.pipeline(transaction=False)
+            for key, raw in zip(keys, packed):
+                pipe.setex(key, self.ttl_seconds, raw)
+            await pipe.execute()
+        except Exception as e:
+            self._count("shared_errors")
+            logger.warning("Embedding cache shared tier write failed: %s", e)
+
+    # ---------------- stats ----------------
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            counters = dict(self._counters)
+            entries, memory_bytes = len(self._lru), self._memory_bytes
+        lookups = counters["memory_hits"] + counters["shared_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["shared_hits"]
+        return {
+            **counters,
+            "entries": entries,
+            "memory_bytes": memory_bytes,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_cache_instance: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Process-wide cache, or None when EMBED_CACHE_ENABLED=0."""
+    global _cache_instance
+    if not EMBED_CACHE_ENABLED:
+        return None
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = EmbeddingCache()
+    return _cache_instance
@@ -1,32 +1,53 @@
 """
-pdf_page_processor.py
+utils/handle_ocr.py
 
 End-to-end pipeline for OCR + Embedding + Pinecone Indexing.
 
+Everything stays in memory: the PDF is opened from bytes and each rendered
+page's PNG buffer is shared by the image upload and the OCR request.
+
+Pages flow through five stages (render -> image upload -> OCR -> embed ->
+upsert). Stages run on their own bounded worker pools so different pages
+overlap; concurrency per stage is configurable (see STAGE_CONCURRENCY).
+
+Pages are streamed through the pipeline in a sliding window
+(OCR_PAGE_WINDOW pages in flight, OCR_MAX_PENDING_BATCHES embedding batches
+waiting), so memory stays flat regardless of document length and chunks
+become searchable batch by batch while later pages are still processing.
+Embedded images are captioned per page window too, and chunks never wait
+for the PDF upload: those upserted before it finishes get their pdf_url
+from the document registry at retrieval time.
+
+Each page is parsed once. When a text index is given, the native text layer
+read during rendering is also chunked into it, and text-layer and OCR chunks
+share the same embedding batches.
+
 Usage:
 
-from pdf_page_processor import process_pdf_to_pinecone
+from utils.handle_ocr import process_pdf_to_pinecone
 
 process_pdf_to_pinecone(
-    pdf_path="path/to/doc.pdf",
+    pdf_bytes=open("path/to/doc.pdf", "rb").read(),
+    index_name="ocr-index-1234",
+    text_index_name="pdf-index-1234",  # optional
 )
 
-Requires helper functions (in same folder):
-- cloudinary_upload(path) -> str
+Requires helper functions (in utils/):
+- get_asset_store() -> AssetStore (Cloudinary or local disk, see utils.asset_store)
 - get_embeddings(text_chunks: List[str]) -> List[List[float]]
-- get_pinecone_connector() -> pinecone-like client
+- get_vector_store() -> VectorStore (Pinecone or local, see utils.vector_store)
 """
 
-import io
-import json
+import asyncio
 import os
 import time
 import uuid
 import logging
-import shutil
-from typing import Callable, Dict, List, Optional, Any
-from pinecone import ServerlessSpec
-import fitz  # PyMuPDF
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Any
 import requests
 from dotenv import load_dotenv
 
@@ -36,26 +57,42 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 # === Local imports ===
-from utils.cloudinary_upload import get_image_url as cloudinary_upload
+from utils.asset_store import get_asset_store
 from utils.embedding import get_embeddings
-from utils.db_connections import get_pinecone_connector
-from utils.cloudinary_upload import get_pdf_url
+from utils.page_render import PageRenderer, page_count
+from utils.word_boxes import delete_page_word_boxes, save_page_word_boxes
+from utils.page_images import PAGE_IMAGES_LAZY, forget_page_images, register_document
+from utils.page_manifest import load_manifest, page_fingerprint, save_manifest
+from utils.vector_store import get_vector_store
+from utils.vector_writer import VectorWriter
+from utils.keyword_index import delete_keywords, index_keywords
+from utils.image_captions import IMAGE_CAPTIONS_ENABLED, ImageCollector, caption_images
 # === Constants ===
 OCR_SPACE_URL = "https://api.ocr.space/parse/image"
 OCR_API_KEY = os.getenv("OCR_SPACE_API_KEY", "")
+# Also write rendered pages to /tmp/pdf_process_<doc_id> for inspection.
 KEEP_DEBUG_PAGES = os.getenv("KEEP_DEBUG_PAGES", "0") == "1"
 
+# Per-stage worker counts. PyMuPDF rendering holds the GIL, so render stays
+# at 1 by default unless INGEST_PROCESS_WORKERS moves it onto a process pool
+# (see utils.page_render); upload/OCR are network-bound and benefit from more.
+STAGE_CONCURRENCY: Dict[str, int] = {
+    "render": int(os.getenv("OCR_RENDER_CONCURRENCY", "1")),
+    "upload": int(os.getenv("OCR_UPLOAD_CONCURRENCY", "4")),
+    "ocr": int(os.getenv("OCR_SPACE_CONCURRENCY", "4")),
+    "embed": int(os.getenv("OCR_EMBED_CONCURRENCY", "2")),
+    "upsert": int(os.getenv("OCR_UPSERT_CONCURRENCY", "2")),
+}
+EMBED_BATCH_CHUNKS = int(os.getenv("OCR_EMBED_BATCH_CHUNKS", "32"))
+# Memory ceiling: pages rendered/OCR'd ahead of the embedder, and embedding
+# batches queued or being upserted, at any one time.
+PAGE_WINDOW = int(os.getenv("OCR_PAGE_WINDOW", "16"))
+MAX_PENDING_BATCHES = int(os.getenv("OCR_MAX_PENDING_BATCHES", "4"))
+
 
 # ==========================================================
 # Helper functions
 # ==========================================================
-def _save_pix_as_png(pix: fitz.Pixmap, out_path: str) -> None:
-    """Convert to RGB if has alpha channel, then save as PNG."""
-    if pix.alpha:
-        pix = fitz.Pixmap(fitz.csRGB, pix)
-    pix.save(out_path)
-
-
 def _retry_request(
     func: Callable[..., requests.Response],
     max_retries: int = 4,
@@ -78,6 +115,71 @@ def _retry_request(
             time.sleep(wait)
 
 
+class StageStats:
+    """Thread-safe item/time counters for one pipeline stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._first_start: Optional[float] = None
+        self._last_end: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, items: int = 1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.items += items
+                self.busy_seconds += end - start
+                if self._first_start is None or start < self._first_start:
+                    self._first_start = start
+                if self._last_end is None or end > self._last_end:
+                    self._last_end = end
+
+    def as_dict(self) -> Dict[str, Any]:
+        wall = (self._last_end - self._first_start) if self._first_start is not None else 0.0
+        return {
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "wall_seconds": round(wall, 3),
+            "items_per_second": round(self.items / wall, 2) if wall > 0 else 0.0,
+        }
+
+
+def _parse_ocr_result(ocr_result: Dict[str, Any]) -> tuple[str, List[Dict[str, Any]], Optional[float]]:
+    """Pull text, word boxes and mean confidence out of an OCR.space response."""
+    text = ""
+    words: List[Dict[str, Any]] = []
+    avg_conf = None
+
+    if not ocr_result.get("IsErroredOnProcessing"):
+        parsed = ocr_result.get("ParsedResults", [])
+        if parsed:
+            pr = parsed[0]
+            text = pr.get("ParsedText", "") or ""
+            overlay = pr.get("TextOverlay", {})
+            for line in overlay.get("Lines", []):
+                for w in line.get("Words", []):
+                    words.append({
+                        "word": w.get("WordText"),
+                        "x": w.get("Left"),
+                        "y": w.get("Top"),
+                        "w": w.get("Width"),
+                        "h": w.get("Height"),
+                        "confidence": w.get("Confidence"),
+                    })
+            confs = [w["confidence"] for w in words if w.get("confidence") is not None]
+            if confs:
+                avg_conf = sum(confs) / len(confs)
+
+    return text, words, avg_conf
+
+
 # ==========================================================
 # OCR.space API
 # ==========================================================
@@ -114,121 +216,238 @@ def call_ocr_space_image_bytes(
     return result
 
 
+# Text-index IDs carry the doc_id, so documents sharing an index never overwrite each other.
+def _text_vector_id(doc_id: str, page_number: int, chunk: int) -> str:
+    return f"{doc_id}-p{page_number}-{chunk}"
+
+
+def _image_vector_id(doc_id: str, sha256: str) -> str:
+    return f"{doc_id}-img-{sha256[:16]}"
+
+
+def _uploaded_pdf_url(future: Future) -> Optional[str]:
+    """The PDF URL if its upload already succeeded, without waiting for it."""
+    if not future.done() or future.cancelled() or future.exception() is not None:
+        return None
+    return future.result()
+
+
 # ==========================================================
 # Main processing pipeline
 # ==========================================================
 def process_pdf_to_pinecone(
-    pdf_path: str,
+    pdf_bytes: bytes,
     index_name: str,
     namespace: Optional[str] = None,
     thumbnail_width: int = 600,
     dpi: int = 150,
     language: str = "eng",
     chunk_size_chars: int = 1600,
+    concurrency: Optional[Dict[str, int]] = None,
+    embed_batch_size: int = EMBED_BATCH_CHUNKS,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    filename: str = "document.pdf",
+    text_index_name: Optional[str] = None,
+    text_chunk_size: int = 700,
+    text_namespace: Optional[str] = None,
+    page_window: int = PAGE_WINDOW,
+    max_pending_batches: int = MAX_PENDING_BATCHES,
+    describe_images: bool = IMAGE_CAPTIONS_ENABLED,
+    document_key: Optional[str] = None,
+    lazy_page_images: bool = PAGE_IMAGES_LAZY,
 ) -> Dict[str, Any]:
     """
-    1. Render each PDF page as PNG
-    2. Upload to Cloudinary
-    3. OCR via OCR.space (with word coordinates)
+    1. Render each PDF page as PNG (reading its native text layer in the same pass)
+    2. Upload to the asset store (skipped with `lazy_page_images`: the image
+       is produced when a search result first shows the page, utils.page_images)
+    3. OCR via OCR.space (with word coordinates); pages with a clean native
+       text layer skip OCR and use PyMuPDF's words instead. Word boxes are
+       stored once per page (utils.word_boxes), not in vector metadata
     4. Compute embeddings per text chunk
     5. Upsert embeddings to Pinecone
 
-    Returns summary + per-page metadata.
+    If `text_index_name` is given, each page's native text layer is also split
+    into `text_chunk_size` character chunks (prefixed with "--- Page N ---")
+    and upserted to that index (in `text_namespace`) as
+    `{doc_id}-p{page}-{i}`. Both chunk sets are embedded together,
+    so the document is opened and walked only once.
+    With `describe_images`, embedded images are extracted in the same pass,
+    de-duplicated/filtered, captioned concurrently (utils.image_captions) and
+    added to the text index as "image" chunks.
+
+    Stages overlap across pages: while page N is being OCR'd, page N+1 is
+    rendering and earlier pages are already embedding/upserting. `concurrency`
+    overrides STAGE_CONCURRENCY per stage. Page order, chunk IDs and metadata
+    are identical to a serial run. `progress_callback`, if given, is called
+    from the calling thread with a progress dict after every page.
+
+    At most `page_window` pages and `max_pending_batches` embedding batches
+    are held at once; nothing is kept per page after its chunks are upserted
+    beyond a small manifest record.
+
+    With a `document_key` already indexed into `index_name`, the upload is
+    a revision of that document (utils.page_manifest): its doc_id is
+    reused, pages whose text+image fingerprint is unchanged are only
+    rendered (no upload, OCR or embedding), changed pages are re-indexed
+    under the same IDs (chunk numbers are per page), and vectors left over
+    from shrunk or removed pages are deleted. Without a key the document is
+    new and is added next to whatever the indexes already hold.
+
+    Pages can later be rendered on demand at other sizes (utils.page_images);
+    `thumbnail_width` is the width of their "thumb" rendition.
+
+    Returns index names, PDF URL, chunk counts and per-stage throughput stats.
     """
-    assert os.path.exists(pdf_path), f"PDF not found: {pdf_path}"
-    doc_id = str(uuid.uuid4())
-    logger.info("Processing PDF: %s  (doc_id=%s)", pdf_path, doc_id)
+    assert pdf_bytes, "Empty PDF"
+    previous = load_manifest(index_name, namespace, document_key) if document_key else None
+    doc_id = previous["doc_id"] if previous else str(uuid.uuid4())
+    previous_pages: List[Dict[str, Any]] = previous["pages"] if previous else []
+    # Text-index records only carry over if the revision targets the same text index.
+    same_text_index = (
+        bool(previous)
+        and previous.get("text_index_name") == text_index_name
+        and previous.get("text_namespace") == text_namespace
+    )
+    logger.info(
+        "Processing PDF: %s  (doc_id=%s, %s)",
+        filename, doc_id, f"revision of {len(previous_pages)} pages" if previous else "new document",
+    )
+
+    describe_images = describe_images and bool(text_index_name)
+    renderer = PageRenderer(pdf_bytes, dpi, extract_images=describe_images)
+    images = ImageCollector() if describe_images else None
+    workers = {
+        **STAGE_CONCURRENCY,
+        "render": max(STAGE_CONCURRENCY["render"], renderer.parallelism),
+        **(concurrency or {}),
+    }
+    workers = {stage: max(1, int(n)) for stage, n in workers.items()}
+    stats = {stage: StageStats(stage) for stage in ("render", "upload", "ocr", "caption", "embed", "upsert")}
+    render_slots = threading.BoundedSemaphore(workers["render"])
+    ocr_slots = threading.BoundedSemaphore(workers["ocr"])
 
     # --- Open PDF ---
-    doc = fitz.open(pdf_path)
-    total_pages = doc.page_count
-    logger.info("Total pages: %d", total_pages)
-
-    # --- Initialize containers ---
-    pages_meta: List[Dict[str, Any]] = []
-    text_chunks: List[str] = []
-    chunk_to_page_idx: List[int] = []
-
-    tmp_dir = os.path.join("/tmp", f"pdf_process_{doc_id}")
-    os.makedirs(tmp_dir, exist_ok=True)
-
-    try:
-        for page_num in range(total_pages):
-            page = doc.load_page(page_num)
-            pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72.0, dpi / 72.0))
-            img_path = os.path.join(tmp_dir, f"page_{page_num + 1}.png")
-            _save_pix_as_png(pix, img_path)
-
-            # Upload image to Cloudinary
+    total_pages = page_count(pdf_bytes)
+    logger.info("Total pages: %d  (stage workers: %s)", total_pages, workers)
+
+    debug_dir = os.path.join("/tmp", f"pdf_process_{doc_id}")
+    if KEEP_DEBUG_PAGES:
+        os.makedirs(debug_dir, exist_ok=True)
+
+    store = get_vector_store()
+    assets = get_asset_store()
+    index_lock = threading.Lock()
+    writers: Dict[tuple, VectorWriter] = {}
+
+    # Page workers hold a render or OCR slot; uploads get their own pool so
+    # they run alongside OCR of the same page.
+    page_pool = ThreadPoolExecutor(workers["render"] + workers["ocr"], thread_name_prefix="ocr-page")
+    upload_pool = ThreadPoolExecutor(workers["upload"], thread_name_prefix="ocr-upload")
+    embed_pool = ThreadPoolExecutor(workers["embed"], thread_name_prefix="ocr-embed")
+    upsert_pool = ThreadPoolExecutor(workers["upsert"], thread_name_prefix="ocr-upsert")
+    caption_pool = ThreadPoolExecutor(1, thread_name_prefix="ocr-caption")
+
+    def _upload_page(img_bytes: bytes, page_number: int) -> Optional[str]:
+        with stats["upload"].track():
             try:
-                img_url = cloudinary_upload(img_path)
+                return assets.put(img_bytes, f"page_{page_number}.png")
             except Exception as e:
-                logger.error("Cloudinary upload failed for page %d: %s", page_num + 1, e)
-                img_url = None
-
+                logger.error("Page image upload failed for page %d: %s", page_number, e)
+                return None
+
+    def _process_page(page_num: int) -> Dict[str, Any]:
+        with render_slots, stats["render"].track():
+            rendered = renderer.render(page_num, images.known_xrefs() if images else frozenset())
+        for image in rendered["images"]:
+            images.add(page_num + 1, image)
+        img_bytes = rendered["png"]
+        fingerprint = page_fingerprint(rendered["text"], img_bytes)
+        if (
+            page_num < len(previous_pages)
+            and previous_pages[page_num]["hash"] == fingerprint
+            and (same_text_index or not text_index_name)
+        ):
+            return {"page_number": page_num + 1, "hash": fingerprint, "unchanged": True}
+        if KEEP_DEBUG_PAGES:
+            with open(os.path.join(debug_dir, f"page_{page_num + 1}.png"), "wb") as f:
+                f.write(img_bytes)
+
+        # Upload the same buffer while this page is OCR'd
+        url_future = None if lazy_page_images else upload_pool.submit(_upload_page, img_bytes, page_num + 1)
+
+        if rendered["needs_ocr"]:
             # OCR this page
-            with open(img_path, "rb") as f:
-                img_bytes = f.read()
+            with ocr_slots, stats["ocr"].track():
+                try:
+                    ocr_result = call_ocr_space_image_bytes(img_bytes, api_key=OCR_API_KEY, language=language)
+                except Exception as e:
+                    logger.error("OCR failed for page %d: %s", page_num + 1, e)
+                    ocr_result = {"IsErroredOnProcessing": True, "ErrorMessage": str(e)}
+
+            text, words, avg_conf = _parse_ocr_result(ocr_result)
+            text_source = "ocr"
+        else:
+            # Clean native text layer: use it with synthetic word boxes
+            text, words, avg_conf = rendered["text"], rendered["words"], 100.0
+            text_source = "native"
+            logger.info("Page %d has a native text layer, skipping OCR (%s)", page_num + 1, rendered["metrics"])
 
-            try:
-                ocr_result = call_ocr_space_image_bytes(img_bytes, api_key=OCR_API_KEY, language=language)
-            except Exception as e:
-                logger.error("OCR failed for page %d: %s", page_num + 1, e)
-                ocr_result = {"IsErroredOnProcessing": True, "ErrorMessage": str(e)}
-
-            # Parse OCR data
-            text = ""
-            words = []
-            avg_conf = None
-
-            if not ocr_result.get("IsErroredOnProcessing"):
-                parsed = ocr_result.get("ParsedResults", [])
-                if parsed:
-                    pr = parsed[0]
-                    text = pr.get("ParsedText", "") or ""
-                    overlay = pr.get("TextOverlay", {})
-                    for line in overlay.get("Lines", []):
-                        for w in line.get("Words", []):
-                            words.append({
-                                "word": w.get("WordText"),
-                                "x": w.get("Left"),
-                                "y": w.get("Top"),
-                                "w": w.get("Width"),
-                                "h": w.get("Height"),
-                                "confidence": w.get("Confidence"),
-                            })
-                    confs = [w["confidence"] for w in words if w.get("confidence") is not None]
-                    if confs:
-                        avg_conf = sum(confs) / len(confs)
-
-            page_meta = {
-                "doc_id": doc_id,
-                "page_number": page_num + 1,
-                "page_image_url": img_url,
-                "ocr_text": text,
-                "ocr_words": words,
-                "ocr_mean_confidence": avg_conf,
-            }
-            pages_meta.append(page_meta)
-
-            # Chunk text for embeddings
-            clean_text = text.strip() or f"[no text extracted from page {page_num + 1}]"
-            for i in range(0, len(clean_text), chunk_size_chars):
-                chunk = clean_text[i : i + chunk_size_chars]
-                text_chunks.append(chunk)
-                chunk_to_page_idx.append(len(pages_meta) - 1)
-
-        # --- Embedding ---
-        logger.info("Embedding %d text chunks...", len(text_chunks))
-        vectors = get_embeddings(text_chunks)
-        pinecone_client = get_pinecone_connector()
-
-        # --- Prepare upserts ---
-        pdf_url = get_pdf_url(pdf_path)
-        logger.info("PDF uploaded to Cloudinary: %s", pdf_url)
-        upserts = []
-        for i, (vec, txt) in enumerate(zip(vectors, text_chunks)):
-            pmeta = pages_meta[chunk_to_page_idx[i]]
+        return {
+            "doc_id": doc_id,
+            "page_number": page_num + 1,
+            "hash": fingerprint,
+            "unchanged": False,
+            "page_image_url": url_future.result() if url_future else "",
+            "native_text": rendered["text"],
+            "ocr_text": text,
+            # Boxes are stored once per page; vectors only record that they exist.
+            "has_word_boxes": bool(words) and save_page_word_boxes(doc_id, page_num + 1, words),
+            "ocr_mean_confidence": avg_conf,
+            "text_source": text_source,
+        }
+
+    def _writer(target: str, target_namespace: Optional[str]) -> VectorWriter:
+        with index_lock:
+            key = (target, target_namespace)
+            if key not in writers:
+                writers[key] = VectorWriter(store.index(target), target_namespace, name=target)
+            return writers[key]
+
+    def _upsert_batch(target: str, target_namespace: Optional[str], upserts: List[Dict[str, Any]], texts: List[str]) -> int:
+        # Raises VectorWriteError if anything is left unwritten; that fails the whole ingestion.
+        with stats["upsert"].track(len(upserts)):
+            store.ensure_index(target, len(upserts[0]["values"]) if upserts else 768)
+            written = _writer(target, target_namespace).upsert(upserts)
+        # Full chunk text goes to the keyword index even where metadata keeps an excerpt.
+        index_keywords(target, target_namespace, ((u["id"], t, u["metadata"]) for u, t in zip(upserts, texts)))
+        return written
+
+    def _embed_batch(batch: List[tuple[str, int, str, Optional[Dict[str, Any]]]]) -> List[Future]:
+        # One embedding call covers both the OCR chunks and the text-layer chunks.
+        with stats["embed"].track(len(batch)):
+            vectors = get_embeddings([txt for _, _, txt, _ in batch])
+        # Chunks never wait for the PDF upload; until it finishes, vectors carry
+        # no pdf_url and retrieval takes it from the document registry.
+        pdf_url = _uploaded_pdf_url(pdf_url_future) or ""
+        ocr_upserts, text_upserts = [], []
+        ocr_texts, text_texts = [], []
+        for (kind, i, txt, pmeta), vec in zip(batch, vectors):
+            if kind == "text":
+                text_texts.append(txt)
+                text_upserts.append({
+                    "id": _text_vector_id(doc_id, pmeta["page_number"], i),
+                    "values": vec,
+                    "metadata": {"text": txt, "image_url": "", "type": "text"},
+                })
+                continue
+            if kind == "image":
+                text_texts.append(txt)
+                text_upserts.append({
+                    "id": _image_vector_id(doc_id, pmeta["sha256"]),
+                    "values": vec,
+                    "metadata": {"text": txt, "image_url": pmeta["image_url"], "type": "image"},
+                })
+                continue
             meta = {
                 "doc_id": str(pmeta.get("doc_id", "")),
                 "page_number": int(pmeta.get("page_number", 0)),
@@ -236,56 +455,244 @@ def process_pdf_to_pinecone(
                 "pdf_url": str(pdf_url),
                 "ocr_text_excerpt": txt[:500] if txt else "",
                 "ocr_mean_confidence": float(pmeta.get("ocr_mean_confidence") or 0.0),
-                "ocr_words": json.dumps(pmeta.get("ocr_words", []))
+                "text_source": pmeta.get("text_source", "ocr"),
+                "has_word_boxes": bool(pmeta.get("has_word_boxes")),
             }
-            upserts.append({
+            ocr_texts.append(txt)
+            ocr_upserts.append({
                 "id": f"{doc_id}_p{pmeta.get('page_number', 0)}_c{i}",
                 "values": vec,
                 "metadata": meta,
             })
-        
-        logger.info("Upserting %d vectors to Pinecone index '%s'...", len(upserts), index_name)
-
+        futures = []
+        if ocr_upserts:
+            futures.append(upsert_pool.submit(_upsert_batch, index_name, namespace, ocr_upserts, ocr_texts))
+        if text_upserts:
+            futures.append(upsert_pool.submit(_upsert_batch, text_index_name, text_namespace, text_upserts, text_texts))
+        return futures
+
+    def _iter_pages() -> Iterator[Dict[str, Any]]:
+        """Yield processed pages in order, keeping at most `page_window` in flight."""
+        in_flight: Deque[Future] = deque()
+        next_page = 0
         try:
-            embed_dim = len(vectors[0]) if vectors else 768
-            if index_name not in pinecone_client.list_indexes().names():
-                pinecone_client.create_index(
-                    name=index_name,
-                    dimension=embed_dim,
-                    metric="cosine",
-                    spec=ServerlessSpec(cloud="aws", region="us-east-1")
-                )
-            pinecone_client.Index(index_name).upsert(vectors=upserts, namespace=namespace)
-
-        except Exception as e:
-            logger.exception("Failed to upsert to Pinecone: %s", e)
-        logger.info("Upsert completed.")
-
-
+            while next_page < total_pages or in_flight:
+                while next_page < total_pages and len(in_flight) < max(1, page_window):
+                    in_flight.append(page_pool.submit(_process_page, next_page))
+                    next_page += 1
+                yield in_flight.popleft().result()
+        finally:
+            for fut in in_flight:
+                fut.cancel()
+
+    def _collect(limit: int) -> None:
+        """Wait for the oldest embedding batches until at most `limit` are outstanding."""
+        nonlocal upserted
+        while len(embed_futures) > limit:
+            upserted += sum(uf.result() for uf in embed_futures.popleft().result())
+
+    def _caption_window(candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # This runs on an ingestion thread, so it can own a short-lived event loop.
+        with stats["caption"].track(len(candidates)):
+            return asyncio.run(caption_images(candidates))
+
+    def _start_captions() -> None:
+        """Caption the images collected so far, so their bytes are not held until the end of the document."""
+        new_candidates = []
+        for candidate in images.drain():
+            vector_id = _image_vector_id(doc_id, candidate["sha256"])
+            if vector_id in previous_images:
+                # Already captioned into this index by an earlier revision; kept as it is.
+                current_images[vector_id] = candidate["page"]
+            else:
+                new_candidates.append(candidate)
+        if new_candidates:
+            # Back-pressure: one window is captioned while the next is collected.
+            _finish_captions(1)
+            caption_futures.append(caption_pool.submit(_caption_window, new_candidates))
+
+    def _finish_captions(limit: int, only_done: bool = False) -> None:
+        """Queue the chunks of finished caption windows for embedding, oldest first."""
+        while len(caption_futures) > limit and (not only_done or caption_futures[0].done()):
+            for chunk in caption_futures.popleft().result():
+                current_images[_image_vector_id(doc_id, chunk["sha256"])] = chunk["page"]
+                image_chunks.append(chunk)
+                pending.append(("image", 0, chunk["text"], chunk))
+
+    started = time.perf_counter()
+    try:
+        # The PDF itself only needs to be uploaded once; start it right away.
+        pdf_url_future = upload_pool.submit(assets.put, pdf_bytes, filename, "pdf")
+        # Registered as soon as it is uploaded, for chunks upserted without a pdf_url.
+        pdf_url_future.add_done_callback(
+            lambda f: _uploaded_pdf_url(f) and register_document(doc_id, f.result(), thumbnail_width)
+        )
+
+        pending: List[tuple[str, int, str, Optional[Dict[str, Any]]]] = []
+        embed_futures: Deque[Future] = deque()
+        page_records: List[Dict[str, Any]] = []
+        upserted = 0
+        previous_images: Dict[str, int] = previous.get("images", {}) if same_text_index else {}
+        current_images: Dict[str, int] = {}
+        image_chunks: List[Dict[str, Any]] = []
+        caption_futures: Deque[Future] = deque()
+        pages_done = 0
+        pages_unchanged = 0
+        chunk_counter = 0
+        text_chunk_counter = 0
+        pages_ocr_skipped = 0
+
+        # Consume pages in order so chunk numbering matches a serial run.
+        for page_meta in _iter_pages():
+            pages_done += 1
+            page_number = page_meta["page_number"]
+
+            if page_meta["unchanged"]:
+                pages_unchanged += 1
+                page_records.append(previous_pages[page_number - 1])
+            else:
+                pages_ocr_skipped += page_meta["text_source"] == "native"
+                record = {"hash": page_meta["hash"], "ocr_chunks": 0, "text_chunks": 0}
+
+                # Chunk numbers restart on every page so a revised page keeps its IDs.
+                clean_text = page_meta["ocr_text"].strip() or f"[no text extracted from page {page_number}]"
+                for i, start in enumerate(range(0, len(clean_text), chunk_size_chars)):
+                    pending.append(("ocr", i, clean_text[start : start + chunk_size_chars], page_meta))
+                    record["ocr_chunks"] += 1
+
+                native_text = page_meta["native_text"].strip()
+                if text_index_name and native_text:
+                    # Pages without a text layer would only index their "--- Page N ---" header.
+                    page_text = f"--- Page {page_number} ---\n{native_text}"
+                    for i, start in enumerate(range(0, len(page_text), text_chunk_size)):
+                        pending.append(("text", i, page_text[start : start + text_chunk_size], page_meta))
+                        record["text_chunks"] += 1
+
+                chunk_counter += record["ocr_chunks"]
+                text_chunk_counter += record["text_chunks"]
+                page_records.append(record)
+
+            if images:
+                # Caption per page window, so image bytes stay bounded like pages are.
+                if pages_done % max(1, page_window) == 0:
+                    _start_captions()
+                _finish_captions(0, only_done=True)
+
+            if len(pending) >= embed_batch_size:
+                # Back-pressure: don't run further ahead than the embedder/upserter.
+                _collect(max(1, max_pending_batches) - 1)
+                embed_futures.append(embed_pool.submit(_embed_batch, pending))
+                pending = []
+
+            if progress_callback:
+                progress_callback({
+                    "stage": "ocr",
+                    "pages_done": pages_done,
+                    "total_pages": total_pages,
+                    "chunks_queued": chunk_counter,
+                    "text_chunks_queued": text_chunk_counter,
+                    "chunks_upserted": upserted,
+                    "pages_ocr_skipped": pages_ocr_skipped,
+                    "pages_unchanged": pages_unchanged,
+                })
+
+        if images:
+            _start_captions()
+            _finish_captions(0)
+
+        if pending:
+            embed_futures.append(embed_pool.submit(_embed_batch, pending))
+
+        pdf_url = pdf_url_future.result()
+        logger.info("PDF uploaded: %s", pdf_url)
+
+        _collect(0)
+        queued = chunk_counter + text_chunk_counter + len(image_chunks)
+
+        # Drop vectors a revision no longer produces: surplus chunks of
+        # re-indexed pages, every chunk of removed pages, and vanished images.
+        stale_ocr: List[str] = []
+        stale_text: List[str] = []
+        for page_number, old in enumerate(previous_pages, start=1):
+            new = page_records[page_number - 1] if page_number <= len(page_records) else {"ocr_chunks": 0, "text_chunks": 0}
+            stale_ocr += [f"{doc_id}_p{page_number}_c{i}" for i in range(new["ocr_chunks"], old["ocr_chunks"])]
+            if same_text_index:
+                stale_text += [_text_vector_id(doc_id, page_number, i) for i in range(new["text_chunks"], old["text_chunks"])]
+        if same_text_index and describe_images:
+            stale_text += [vid for vid in previous_images if vid not in current_images]
+        deleted = _writer(index_name, namespace).delete(stale_ocr)
+        delete_keywords(index_name, namespace, stale_ocr)
+        if text_index_name:
+            deleted += _writer(text_index_name, text_namespace).delete(stale_text)
+            delete_keywords(text_index_name, text_namespace, stale_text)
+        delete_page_word_boxes(doc_id, list(range(total_pages + 1, len(previous_pages) + 1)))
+        # Lazily produced images of pages that changed or vanished are out of date.
+        forget_page_images(doc_id, [
+            page_number for page_number, old in enumerate(previous_pages, start=1)
+            if page_number > len(page_records) or page_records[page_number - 1]["hash"] != old["hash"]
+        ])
+
+        save_manifest(index_name, namespace, document_key or doc_id, {
+            "doc_id": doc_id,
+            "document_key": document_key,
+            "filename": filename,
+            "text_index_name": text_index_name,
+            "text_namespace": text_namespace,
+            "pdf_url": pdf_url,
+            "pages": page_records,
+            "images": current_images if describe_images else previous_images,
+            "updated_at": time.time(),
+        })
+
+        if progress_callback:
+            progress_callback({
+                "stage": "indexed",
+                "pages_done": total_pages,
+                "total_pages": total_pages,
+                "chunks_upserted": upserted,
+            })
+        logger.info(
+            "Upserted %d/%d vectors and deleted %d stale ones (OCR index '%s', text index '%s'); %d/%d pages unchanged.",
+            upserted, queued, deleted, index_name, text_index_name or "-", pages_unchanged, total_pages,
+        )
 
+        stage_stats = {stage: s.as_dict() for stage, s in stats.items()}
         summary = {
             "doc_id": doc_id,
-            "pdf_path": pdf_path,
+            "filename": filename,
             "total_pages": total_pages,
-            "total_embeddings_upserted": len(upserts),
+            "total_embeddings_upserted": upserted,
+            "pages_ocr_skipped": pages_ocr_skipped,
+            "pages_unchanged": pages_unchanged,
+            "vectors_deleted": deleted,
+            "images": images.stats if images else None,
             "index_name": index_name,
+            "text_index_name": text_index_name,
             "namespace": namespace,
-            "pages": pages_meta,
+            "elapsed_seconds": round(time.perf_counter() - started, 3),
+            "stats": stage_stats,
         }
 
-        logger.info("✅ Processing completed successfully.")
+        logger.info("✅ Processing completed successfully. %s", summary)
         return {
+            "doc_id": doc_id,
             "index_name": index_name,
+            "text_index_name": text_index_name,
+            "num_ocr_chunks": chunk_counter,
+            "num_text_chunks": text_chunk_counter,
+            "num_image_chunks": len(image_chunks),
+            "pages_unchanged": pages_unchanged,
+            "pages_removed": max(0, len(previous_pages) - total_pages),
             "pdf_url": pdf_url,
+            "total_pages": total_pages,
+            "pages_ocr_skipped": pages_ocr_skipped,
+            "stats": stage_stats,
         }
 
     finally:
-        # Cleanup temp files unless KEEP_DEBUG_PAGES=1
-        if not KEEP_DEBUG_PAGES:
-            shutil.rmtree(tmp_dir, ignore_errors=True)
-            logger.info("🧹 Temporary files cleaned up: %s", tmp_dir)
-        else:
-            logger.info("⚠️ Debug mode enabled — temp files kept at %s", tmp_dir)
-
-
+        for pool in (page_pool, upload_pool, embed_pool, upsert_pool, caption_pool):
+            pool.shutdown(wait=True, cancel_futures=True)
+        renderer.close()
 
+        if KEEP_DEBUG_PAGES:
+            logger.info("⚠️ Debug mode enabled — rendered pages kept at %s", debug_dir)
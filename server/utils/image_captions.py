@@ -0,0 +1,245 @@
+"""
+Image captioning stage for ingestion.
+
+Embedded images are collected during the page pass, drained every page
+window and captioned once per distinct image:
+
+- images sharing an xref (logos/backgrounds placed on every page) are seen once
+- tiny, tiny-in-bytes or near-uniform (low entropy) images are dropped
+- near-duplicates across xrefs are merged by a 64-bit difference hash (dHash),
+  looked up through band buckets so each image is compared with few others
+- captions are cached in Redis by the SHA-256 of the image bytes, so re-uploads
+  and images shared between documents are never captioned twice
+- the remaining images are uploaded and captioned concurrently, at most
+  IMAGE_CAPTION_CONCURRENCY at a time; with a local asset store the model
+  is sent the image inline as a base64 data URI, since it cannot download
+  from this server
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from redis_client import redis_sync_binary_client
+from utils.asset_store import get_asset_store
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+IMAGE_CAPTIONS_ENABLED = os.getenv("IMAGE_CAPTIONS_ENABLED", "0") == "1"
+IMAGE_CAPTION_CONCURRENCY = int(os.getenv("IMAGE_CAPTION_CONCURRENCY", "4"))
+IMAGE_MIN_BYTES = int(os.getenv("IMAGE_MIN_BYTES", "2048"))
+IMAGE_MIN_SIDE_PX = int(os.getenv("IMAGE_MIN_SIDE_PX", "64"))
+IMAGE_MIN_ENTROPY = float(os.getenv("IMAGE_MIN_ENTROPY", "2.0"))
+IMAGE_DHASH_MAX_DISTANCE = int(os.getenv("IMAGE_DHASH_MAX_DISTANCE", "5"))
+CAPTION_CACHE_TTL_SECONDS = int(os.getenv("CAPTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+
+def _caption_key(sha256: str) -> str:
+    return f"caption:sha256:{sha256}"
+
+
+def dhash(image: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: compares neighbouring pixels of a 9x8 grayscale thumbnail."""
+    small = image.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def _distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(value: int, count: int, bits: int = 64) -> List[int]:
+    """Split a hash into `count` contiguous bit ranges."""
+    bands = []
+    start = 0
+    for i in range(count):
+        width = bits // count + (1 if i < bits % count else 0)
+        bands.append((value >> start) & ((1 << width) - 1))
+        start += width
+    return bands
+
+
+def inspect_image(image_bytes: bytes) -> Dict[str, Any]:
+    """Size/entropy/hash facts for one image; `keep` says whether it is worth captioning."""
+    facts: Dict[str, Any] = {"bytes": len(image_bytes), "keep": False}
+    if len(image_bytes) < IMAGE_MIN_BYTES:
+        facts["reason"] = "too_few_bytes"
+        return facts
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.load()
+            facts["width"], facts["height"] = img.size
+            if min(img.size) < IMAGE_MIN_SIDE_PX:
+                facts["reason"] = "too_small"
+                return facts
+            facts["entropy"] = round(img.convert("L").entropy(), 3)
+            if facts["entropy"] < IMAGE_MIN_ENTROPY:
+                facts["reason"] = "low_entropy"
+                return facts
+            facts["dhash"] = dhash(img)
+    except Exception as e:
+        facts["reason"] = f"unreadable: {e}"
+        return facts
+    facts["sha256"] = hashlib.sha256(image_bytes).hexdigest()
+    facts["keep"] = True
+    return facts
+
+
+class ImageCollector:
+    """
+    Thread-safe collector fed by page workers. Only images that survive the
+    xref, size/entropy and dHash checks are kept in memory, and only until
+    the next `drain`; their hashes are kept for de-duplication across the
+    whole document.
+    """
+
+    def __init__(self, max_distance: int = IMAGE_DHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.candidates: List[Dict[str, Any]] = []
+        # Two hashes within max_distance bits differ in at most max_distance of
+        # these max_distance + 1 bands, so they share at least one exactly:
+        # only hashes in the same bucket of some band need comparing.
+        self._dhash_buckets: List[Dict[int, List[int]]] = [{} for _ in range(min(64, max_distance + 1))]
+        self._seen_xrefs: set[int] = set()
+        self._lock = threading.Lock()
+        self.stats = {"seen": 0, "duplicate_xref": 0, "filtered": 0, "near_duplicate": 0, "kept": 0}
+
+    def add(self, page_number: int, image: Dict[str, Any]) -> None:
+        with self._lock:
+            self.stats["seen"] += 1
+            if image["xref"] in self._seen_xrefs:
+                self.stats["duplicate_xref"] += 1
+                return
+            self._seen_xrefs.add(image["xref"])
+
+        facts = inspect_image(image["bytes"])
+        if not facts["keep"]:
+            with self._lock:
+                self.stats["filtered"] += 1
+            logger.debug("Skipping image xref=%s on page %d: %s", image["xref"], page_number, facts.get("reason"))
+            return
+
+        with self._lock:
+            bands = _bands(facts["dhash"], len(self._dhash_buckets))
+            for bucket, band in zip(self._dhash_buckets, bands):
+                for kept in bucket.get(band, ()):
+                    if _distance(kept, facts["dhash"]) <= self.max_distance:
+                        self.stats["near_duplicate"] += 1
+                        return
+            for bucket, band in zip(self._dhash_buckets, bands):
+                bucket.setdefault(band, []).append(facts["dhash"])
+            self.candidates.append({
+                "page": page_number,
+                "xref": image["xref"],
+                "bytes": image["bytes"],
+                "filename": f"page{page_number}_img{image['index']}.{image['ext']}",
+                "sha256": facts["sha256"],
+                "dhash": facts["dhash"],
+            })
+            self.stats["kept"] += 1
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """Hand over the candidates (and their bytes) collected since the last drain."""
+        with self._lock:
+            drained, self.candidates = self.candidates, []
+            return drained
+
+    def known_xrefs(self) -> frozenset:
+        """Xrefs already seen; renderers can skip extracting their bytes again."""
+        with self._lock:
+            return frozenset(self._seen_xrefs)
+
+
+async def _caption_one(candidate: Dict[str, Any], slots: asyncio.Semaphore) -> Optional[Dict[str, Any]]:
+    # Imported lazily: it creates an API client at import time.
+    from utils.image_summary import image_summary
+
+    # The sync client (in a thread) keeps this usable from any event loop,
+    # including the short-lived one an ingestion thread runs this stage on.
+    key = _caption_key(candidate["sha256"])
+    try:
+        cached = await asyncio.to_thread(redis_sync_binary_client.get, key)
+    except Exception as e:
+        logger.warning("Caption cache unavailable: %s", e)
+        cached = None
+    if cached:
+        return {**candidate, **_decode_cached(cached.decode("utf-8")), "cached": True}
+
+    async with slots:
+        try:
+            store = get_asset_store()
+            image_url = await store.aput(candidate["bytes"], candidate["filename"])
+            if not image_url or not isinstance(image_url, str):
+                logger.warning("Failed to upload image or invalid URL: %s", candidate["filename"])
+                return None
+            model_url = image_url if store.remote_fetchable else _data_uri(candidate)
+            summary = await asyncio.to_thread(image_summary, model_url)
+        except Exception as e:
+            logger.error("Error captioning image %s: %s", candidate["filename"], e)
+            return None
+
+    if not summary:
+        logger.warning("Failed to generate summary for image: %s", candidate["filename"])
+        return None
+    try:
+        await asyncio.to_thread(
+            redis_sync_binary_client.setex, key, CAPTION_CACHE_TTL_SECONDS, f"{image_url}\n{summary}".encode("utf-8")
+        )
+    except Exception as e:
+        logger.warning("Caption cache write failed: %s", e)
+    return {**candidate, "image_url": image_url, "summary": summary, "cached": False}
+
+
+def _data_uri(candidate: Dict[str, Any]) -> str:
+    mime = mimetypes.guess_type(candidate["filename"])[0] or "image/png"
+    return f"data:{mime};base64,{base64.b64encode(candidate['bytes']).decode('ascii')}"
+
+
+def _decode_cached(raw: str) -> Dict[str, str]:
+    image_url, _, summary = raw.partition("\n")
+    return {"image_url": image_url, "summary": summary}
+
+
+async def caption_images(
+    candidates: List[Dict[str, Any]],
+    concurrency: int = IMAGE_CAPTION_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """
+    Caption distinct images concurrently. Returns text-index chunks
+    ({"text", "image_url", "type": "image", "page", "sha256"}) in page order; images
+    that fail to upload or caption are skipped.
+    """
+    slots = asyncio.Semaphore(max(1, concurrency))
+    results = await asyncio.gather(*(_caption_one(c, slots) for c in candidates))
+    captioned = [r for r in results if r]
+    logger.info(
+        "Captioned %d/%d images (%d from cache)",
+        len(captioned), len(candidates), sum(1 for r in captioned if r["cached"]),
+    )
+    return [
+        {
+            "text": f"[Image from Page {r['page']}]: {r['summary']}",
+            "image_url": r["image_url"],
+            "type": "image",
+            "page": r["page"],
+            "sha256": r["sha256"],
+        }
+        for r in sorted(captioned, key=lambda r: (r["page"], r["xref"]))
+    ]
@@ -0,0 +1,262 @@
+"""
+BM25 keyword index kept in Redis next to each vector index.
+
+Ingestion adds every chunk it upserts (same ID, same metadata) so that
+identifiers like ticket numbers, part codes and names can be found by exact
+term match, which embeddings handle poorly. Retrieval fuses these hits with
+the vector matches (reciprocal rank fusion) and, for short exact-match
+lookups, answers from the keyword index alone without embedding the query.
+
+Keys, per vector index and namespace (`bm25:{index}:{namespace}`):
+    :t:{term}   hash chunk_id -> term frequency (postings)
+    :len        hash chunk_id -> chunk length in terms
+    :doc        hash chunk_id -> JSON {"terms": [...], "metadata": {...}}
+    :total      total length of all chunks (for the average)
+"""
+
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from redis_client import redis_client, redis_sync_client
+
+logger = logging.getLogger(__name__)
+
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "1") == "1"
+KEYWORD_FAST_PATH_ENABLED = os.getenv("KEYWORD_FAST_PATH_ENABLED", "1") == "1"
+# Exact-match lookups may carry this many words besides the identifiers ("status of TCK-1234");
+# anything longer is a question about the identifier and keeps vector search.
+KEYWORD_FAST_PATH_MAX_EXTRA_TERMS = int(os.getenv("KEYWORD_FAST_PATH_MAX_EXTRA_TERMS", "1"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Terms in more chunks than this are never read in full: they only score the
+# candidates found through rarer query terms. A query made only of such
+# common terms gets no keyword hits (vector search still answers it).
+KEYWORD_MAX_POSTINGS = int(os.getenv("KEYWORD_MAX_POSTINGS", "5000"))
+
+_TOKEN = re.compile(r"[0-9a-z]+(?:[-_./:#][0-9a-z]+)*")
+_PARTS = re.compile(r"[0-9a-z]+")
+_SEPARATORS = frozenset("-_./:#")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or our "
+    "show tell that the their there this to was we what when where which who why with you".split()
+)
+
+
+def _prefix(index_name: str, namespace: Optional[str]) -> str:
+    return f"bm25:{index_name}:{namespace or ''}"
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased terms. Compound tokens keep their full form and also add
+    their parts, so "TCK-1234" matches both "tck-1234" and "1234".
+    """
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        terms.append(token)
+        parts = _PARTS.findall(token)
+        if len(parts) > 1:
+            terms.extend(p for p in parts if p not in _STOPWORDS)
+    return terms
+
+
+def identifiers(query: str) -> List[str]:
+    """
+    Tokens that look like ticket numbers or part codes:
+    - digits joined by a separator, at least 5 characters ("tck-1234", "4.2.1")
+    - at least 6 characters with 3 or more digits ("a7x9b2", "inv20240042")
+    - numbers of 5 or more digits
+    Short alphanumerics like "q3", "h1", "fy25" or "mp4" and plain counts like
+    "section 12" are ordinary words, not identifiers.
+    """
+    found = []
+    for token in dict.fromkeys(_TOKEN.findall(query.lower())):
+        digits = sum(c.isdigit() for c in token)
+        if not digits:
+            continue
+        separated = any(c in _SEPARATORS for c in token)
+        if (separated and len(token) >= 5) or (len(token) >= 6 and digits >= 3) or digits >= 5:
+            found.append(token)
+    return found
+
+
+# ---------------- ingestion (sync, worker threads) ----------------
+def _remove(pipe, prefix: str, chunk_ids: Sequence[str], docs: Sequence[Optional[str]], lengths: Sequence[Optional[str]]) -> None:
+    for chunk_id, doc, length in zip(chunk_ids, docs, lengths):
+        if doc is None:
+            continue
+        for term in json.loads(doc)["terms"]:
+            pipe.hdel(f"{prefix}:t:{term}", chunk_id)
+        pipe.incrby(f"{prefix}:total", -int(length or 0))
+    pipe.hdel(f"{prefix}:len", *chunk_ids)
+    pipe.hdel(f"{prefix}:doc", *chunk_ids)
+
+
+def index_keywords(index_name: str, namespace: Optional[str], chunks: Iterable[Tuple[str, str, Dict[str, Any]]]) -> bool:
+    """
+    Index (chunk_id, text, metadata) triples, replacing earlier versions of
+    the same IDs. Failures are logged; retrieval then falls back to vectors.
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return True
+    prefix = _prefix(index_name, namespace)
+    ids = [c[0] for c in chunks]
+    try:
+        old_docs = redis_sync_client.hmget(f"{prefix}:doc", ids)
+        old_lengths = redis_sync_client.hmget(f"{prefix}:len", ids)
+        pipe = redis_sync_client.pipeline(transaction=False)
+        _remove(pipe, prefix, ids, old_docs, old_lengths)
+        for chunk_id, text, metadata in chunks:
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                pipe.hset(f"{prefix}:t:{term}", chunk_id, tf)
+            length = sum(counts.values())
+            pipe.hset(f"{prefix}:len", chunk_id, length)
+            pipe.hset(f"{prefix}:doc", chunk_id, json.dumps({"terms": list(counts), "metadata": metadata}))
+            pipe.incrby(f"{prefix}:total", length)
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning("Could not update keyword index for %s: %s", index_name, e)
+        return False
+
+
+def delete_keywords(index_name: str, namespace: Optional[str], chunk_ids: List[str]) -> None:
+    if not chunk_ids:
+        return
+    prefix = _prefix(index_name, namespace)
+    try:
+        docs = redis_sync_client.hmget(f"{prefix}:doc", chunk_ids)
+        lengths = redis_sync_client.hmget(f"{prefix}:len", chunk_ids)
+        pipe = redis_sync_client.pipeline(transaction=False)
+        _remove(pipe, prefix, chunk_ids, docs, lengths)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Could not delete keyword entries for %s: %s", index_name, e)
+
+
+def drop_keyword_index(index_name: str, namespace: Optional[str] = None) -> None:
+    """Remove every key of one keyword index."""
+    prefix = _prefix(index_name, namespace)
+    try:
+        batch = []
+        for key in redis_sync_client.scan_iter(match=f"{prefix}:*", count=1000):
+            batch.append(key)
+            if len(batch) >= 1000:
+                redis_sync_client.delete(*batch)
+                batch = []
+        if batch:
+            redis_sync_client.delete(*batch)
+    except Exception as e:
+        logger.warning("Could not drop keyword index for %s: %s", index_name, e)
+
+
+# ---------------- retrieval (async) ----------------
+async def search_keywords(index_name: str, namespace: Optional[str], query: str, top_k: int = 10) -> List[Dict[str, Any]]:
+    """
+    BM25 top-k as vector-store-style matches: {"id", "score", "metadata",
+    "matched_terms"}. Returns [] if the index is missing or Redis fails.
+    Only posting lists of at most KEYWORD_MAX_POSTINGS entries are read whole.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    prefix = _prefix(index_name, namespace)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hlen(f"{prefix}:len")
+        pipe.get(f"{prefix}:total")
+        for term in terms:
+            pipe.hlen(f"{prefix}:t:{term}")
+        doc_count, total, *dfs = await pipe.execute()
+        if not doc_count:
+            return []
+        df = {term: n for term, n in zip(terms, dfs) if n}
+        rare = [term for term in df if df[term] <= KEYWORD_MAX_POSTINGS]
+        common = [term for term in df if df[term] > KEYWORD_MAX_POSTINGS]
+        if not rare:
+            return []
+
+        pipe = redis_client.pipeline(transaction=False)
+        for term in rare:
+            pipe.hgetall(f"{prefix}:t:{term}")
+        postings = dict(zip(rare, await pipe.execute()))
+        candidates = sorted({chunk_id for p in postings.values() for chunk_id in p})
+        if not candidates:
+            return []
+
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hmget(f"{prefix}:len", candidates)
+        for term in common:
+            pipe.hmget(f"{prefix}:t:{term}", candidates)
+        candidate_lengths, *common_tfs = await pipe.execute()
+        lengths = dict(zip(candidates, candidate_lengths))
+        for term, tfs in zip(common, common_tfs):
+            postings[term] = {chunk_id: tf for chunk_id, tf in zip(candidates, tfs) if tf is not None}
+        avg_len = max(1.0, int(total or 0) / doc_count)
+
+        scores: Dict[str, float] = {}
+        matched: Dict[str, List[str]] = {}
+        for term in terms:
+            posting = postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (doc_count - df[term] + 0.5) / (df[term] + 0.5))
+            for chunk_id, tf in posting.items():
+                tf = int(tf)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * int(lengths.get(chunk_id) or 0) / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                matched.setdefault(chunk_id, []).append(term)
+
+        best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        docs = await redis_client.hmget(f"{prefix}:doc", best)
+    except Exception as e:
+        logger.warning("Keyword search failed for %s: %s", index_name, e)
+        return []
+
+    return [
+        {
+            "id": chunk_id,
+            "score": scores[chunk_id],
+            "metadata": json.loads(doc)["metadata"] if doc else {},
+            "matched_terms": matched[chunk_id],
+        }
+        for chunk_id, doc in zip(best, docs)
+    ]
+
+
+def exact_matches(query: str, hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The hits that answer `query` as an exact-match lookup: the query is
+    mostly identifiers and these hits contain all of them. Empty otherwise.
+    """
+    ids = identifiers(query)
+    if not ids:
+        return []
+    extra = [t for t in _TOKEN.findall(query.lower()) if t not in _STOPWORDS and t not in ids]
+    if len(extra) > KEYWORD_FAST_PATH_MAX_EXTRA_TERMS:
+        return []
+    return [h for h in hits if set(ids) <= set(h["matched_terms"])]
+
+
+def rrf_fuse(*ranked_lists: List[Dict[str, Any]], top_k: int = 10, k: int = RRF_K) -> List[Dict[str, Any]]:
+    """Reciprocal rank fusion of match lists; metadata and values come from the first list that has them."""
+    fused: Dict[str, Dict[str, Any]] = {}
+    for matches in ranked_lists:
+        for rank, match in enumerate(matches, start=1):
+            entry = fused.setdefault(match["id"], {"id": match["id"], "score": 0.0, "metadata": {}})
+            entry["score"] += 1.0 / (k + rank)
+            if not entry["metadata"]:
+                entry["metadata"] = match.get("metadata") or {}
+            if "values" not in entry and match.get("values"):
+                entry["values"] = match["values"]
+    return sorted(fused.values(), key=lambda m: m["score"], reverse=True)[:top_k]
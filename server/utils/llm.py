@@ -1,23 +1,43 @@
 from google import genai
+import logging
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 key = os.getenv("LLM_API_KEY") 
 
 client = genai.Client(api_key=key)
+MODEL = "gemini-2.5-flash"
+CHAT_ERROR = "Error: Unable to get response from the model."
 
 def chat(prompt): 
     print("prompt : " , prompt)
     try:
         response = client.models.generate_content(
-            model="gemini-2.5-flash",
+            model=MODEL,
             contents=prompt,
         )
         return response.text
     except Exception as e:
         print(f"An error occurred during chat: {e}")
-        return "Error: Unable to get response from the model."
+        return CHAT_ERROR
+
+
+async def chat_stream(prompt):
+    """Like `chat`, but yields the answer text chunk by chunk as the model produces it."""
+    logger.debug("Streaming prompt: %s", prompt)
+    try:
+        stream = await client.aio.models.generate_content_stream(
+            model=MODEL,
+            contents=prompt,
+        )
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+    except Exception:
+        logger.exception("Streaming chat failed")
+        yield CHAT_ERROR
   
 
 
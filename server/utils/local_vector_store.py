@@ -0,0 +1,475 @@
+"""
+In-process vector store (VECTOR_STORE=local).
+
+Each index is a directory; each namespace inside it holds:
+
+    vectors.f32    float32 rows (unit-normalised for cosine), memory-mapped
+                   and grown by doubling, so the OS page cache does the work
+    records.jsonl  append-only sidecar: {"op": "put", "id", "row", "metadata"}
+                   and {"op": "del", "id"} lines, replayed on open
+
+Queries are exact top-k by one NumPy matrix-vector product over the live rows
+(`query_many` batches several queries into one matrix product). With
+LOCAL_VECTOR_STORE_HNSW=1 and hnswlib installed, namespaces with at least
+LOCAL_VECTOR_STORE_HNSW_MIN vectors are also served from an HNSW graph,
+built in memory on first query and kept current on writes.
+
+LOCAL_VECTOR_STORE_QUANTIZATION keeps a compact in-memory copy of every row
+and scans that instead of the float matrix:
+
+    int8     one signed byte per dimension plus a float32 scale per row (~4x)
+    binary   one sign bit per dimension, compared by Hamming distance (32x)
+
+The best `top_k * LOCAL_VECTOR_STORE_RESCORE` candidates are then rescored
+exactly against their float32 rows, so only those pages of vectors.f32 are
+touched. utils/vector_benchmark.py measures the recall and QPS trade-off
+(numbers in the README).
+
+A store belongs to one process: namespaces are loaded once, when first
+opened, and writes are only locked within the process. The API and its
+ingestion jobs must share that process (INGEST_JOB_MODE=inprocess, one
+uvicorn worker); ingestion_jobs refuses INGEST_JOB_MODE=redis with it.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.vector_store import VectorIndex, VectorStore
+
+try:
+    import hnswlib
+except ImportError:  # optional
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+LOCAL_HNSW = os.getenv("LOCAL_VECTOR_STORE_HNSW", "0") == "1"
+LOCAL_HNSW_MIN_VECTORS = int(os.getenv("LOCAL_VECTOR_STORE_HNSW_MIN", "5000"))
+LOCAL_QUANTIZATION = os.getenv("LOCAL_VECTOR_STORE_QUANTIZATION", "none")
+LOCAL_RESCORE_FACTOR = int(os.getenv("LOCAL_VECTOR_STORE_RESCORE", "10"))
+# Rewrite a namespace once more than this fraction of its rows are deleted.
+LOCAL_COMPACT_RATIO = 0.5
+
+_DEFAULT_NAMESPACE = "__default__"
+_INITIAL_CAPACITY = 1024
+_METRICS = ("cosine", "dotproduct")
+_QUANTIZATIONS = ("none", "int8", "binary")
+# Rows per step when scanning int8 codes (small enough to stay in cache) and
+# when re-encoding a namespace on open.
+_SCAN_BLOCK = 512
+_ENCODE_BLOCK = 65536
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(words)
+    return _POPCOUNT[words.view(np.uint8)].reshape(*words.shape, -1).sum(axis=-1)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 codes and the float32 scale that restores each row."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(matrix: np.ndarray) -> np.ndarray:
+    """Sign bits packed eight dimensions to a byte."""
+    return np.packbits(matrix > 0, axis=-1)
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (argpartition, then sort only those k)."""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class _Namespace:
+    """Vectors, ids and metadata of one namespace. All access is under `_lock`."""
+
+    def __init__(self, path: str, dimension: int, metric: str, quantization: str = "none", rescore_factor: int = LOCAL_RESCORE_FACTOR):
+        if quantization not in _QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}' (expected one of {_QUANTIZATIONS})")
+        self.path = path
+        self.dimension = dimension
+        self.metric = metric
+        self.quantization = quantization
+        self.rescore_factor = max(1, rescore_factor)
+        self._lock = threading.RLock()
+        self._vectors_file = os.path.join(path, "vectors.f32")
+        self._records_file = os.path.join(path, "records.jsonl")
+        self.ids: List[Optional[str]] = []
+        self.metadata: List[Optional[Dict[str, Any]]] = []
+        self.rows: Dict[str, int] = {}
+        self.count = 0
+        self.capacity = 0
+        self.vectors: Optional[np.memmap] = None
+        self.alive = np.zeros(0, dtype=bool)
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self._hnsw = None
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # ---------------- storage ----------------
+    def _map(self, capacity: int) -> None:
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None
+        with open(self._vectors_file, "r+b" if os.path.exists(self._vectors_file) else "w+b") as f:
+            f.truncate(capacity * self.dimension * 4)
+        self.vectors = np.memmap(self._vectors_file, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: len(self.alive)] = self.alive[:capacity]
+        self.alive = alive
+        if self.quantization != "none":
+            width = self.dimension if self.quantization == "int8" else (self.dimension + 7) // 8
+            codes = np.zeros((capacity, width), dtype=np.int8 if self.quantization == "int8" else np.uint8)
+            scales = np.ones(capacity, dtype=np.float32)
+            if self.codes is not None:
+                keep = min(len(self.codes), capacity)
+                codes[:keep] = self.codes[:keep]
+                scales[:keep] = self.scales[:keep]
+            self.codes, self.scales = codes, scales
+        self.capacity = capacity
+        if self._hnsw is not None:
+            self._hnsw.resize_index(capacity)
+
+    def _load(self) -> None:
+        existing = os.path.getsize(self._vectors_file) // (self.dimension * 4) if os.path.exists(self._vectors_file) else 0
+        self._map(max(existing, _INITIAL_CAPACITY))
+        if not os.path.exists(self._records_file):
+            return
+        with open(self._records_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._apply(json.loads(line))
+        for start in range(0, self.count, _ENCODE_BLOCK):
+            self._encode(np.arange(start, min(self.count, start + _ENCODE_BLOCK)))
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        if record["op"] == "put":
+            row = record["row"]
+            while len(self.ids) <= row:
+                self.ids.append(None)
+                self.metadata.append(None)
+            old = self.rows.get(record["id"])
+            if old is not None and old != row:
+                self.ids[old], self.metadata[old] = None, None
+                self.alive[old] = False
+            self.ids[row] = record["id"]
+            self.metadata[row] = record.get("metadata") or {}
+            self.rows[record["id"]] = row
+            self.alive[row] = True
+            self.count = max(self.count, row + 1)
+        elif record["op"] == "del":
+            row = self.rows.pop(record["id"], None)
+            if row is not None:
+                self.ids[row], self.metadata[row] = None, None
+                self.alive[row] = False
+
+    def _log(self, records: List[Dict[str, Any]]) -> None:
+        with open(self._records_file, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records))
+
+    def _prepare(self, values: np.ndarray) -> np.ndarray:
+        return _normalize(values) if self.metric == "cosine" else values
+
+    def _encode(self, rows: np.ndarray) -> None:
+        """Refresh the quantized copy of `rows` from the float matrix."""
+        if self.quantization == "none" or len(rows) == 0:
+            return
+        values = np.asarray(self.vectors[rows])
+        if self.quantization == "int8":
+            self.codes[rows], self.scales[rows] = quantize_int8(values)
+        else:
+            self.codes[rows] = quantize_binary(values)
+
+    def resident_bytes(self) -> int:
+        """Bytes a full scan reads: the float rows, or their quantized copy."""
+        if self.quantization == "none":
+            return self.count * self.dimension * 4
+        return self.codes[: self.count].nbytes + (self.scales[: self.count].nbytes if self.quantization == "int8" else 0)
+
+    # ---------------- writes ----------------
+    def upsert(self, vectors: List[Dict[str, Any]]) -> int:
+        if not vectors:
+            return 0
+        values = np.asarray([v["values"] for v in vectors], dtype=np.float32)
+        if values.ndim != 2 or values.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {values.shape[-1]} does not match index dimension {self.dimension}")
+        values = self._prepare(values)
+
+        with self._lock:
+            records, rows = [], []
+            for v in vectors:
+                row = self.rows.get(v["id"])
+                if row is None:
+                    row = self.count
+                    self.count += 1
+                    # Reserve the slot now so duplicate ids in one batch share it.
+                    self.rows[v["id"]] = row
+                rows.append(row)
+                records.append({"op": "put", "id": v["id"], "row": row, "metadata": v.get("metadata") or {}})
+            if self.count > self.capacity:
+                self._map(max(self.count, self.capacity * 2))
+            self.vectors[rows] = values
+            self.vectors.flush()
+            self._encode(np.asarray(rows))
+            for record in records:
+                self._apply(record)
+            self._log(records)
+            if self._hnsw is not None:
+                self._hnsw.add_items(values, np.asarray(rows))
+            return len(vectors)
+
+    def delete(self, ids: List[str]) -> int:
+        with self._lock:
+            present = [i for i in ids if i in self.rows]
+            if self._hnsw is not None:
+                for vid in present:
+                    self._hnsw.mark_deleted(self.rows[vid])
+            records = [{"op": "del", "id": vid} for vid in present]
+            for record in records:
+                self._apply(record)
+            if records:
+                self._log(records)
+            if self.count > _INITIAL_CAPACITY and len(self.rows) < self.count * (1 - LOCAL_COMPACT_RATIO):
+                self._compact()
+            return len(present)
+
+    def _compact(self) -> None:
+        """Rewrite the namespace with only live rows."""
+        live = [row for row in range(self.count) if self.alive[row]]
+        vectors = np.array(self.vectors[live]) if live else np.zeros((0, self.dimension), dtype=np.float32)
+        entries = [(self.ids[row], self.metadata[row]) for row in live]
+        self.vectors, self.codes, self.scales = None, None, None
+        os.remove(self._vectors_file)
+        self.ids, self.metadata, self.rows, self.count = [], [], {}, 0
+        self.alive = np.zeros(0, dtype=bool)
+        self._hnsw = None
+        self._map(max(len(live), _INITIAL_CAPACITY))
+        records = []
+        for row, (vid, meta) in enumerate(entries):
+            records.append({"op": "put", "id": vid, "row": row, "metadata": meta})
+            self._apply(records[-1])
+        self.vectors[: len(live)] = vectors
+        self.vectors.flush()
+        self._encode(np.arange(len(live)))
+        tmp = self._records_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records))
+        os.replace(tmp, self._records_file)
+        logger.info("Compacted local vector namespace %s to %d rows", self.path, len(live))
+
+    # ---------------- reads ----------------
+    def _graph(self):
+        if not LOCAL_HNSW or hnswlib is None or len(self.rows) < LOCAL_HNSW_MIN_VECTORS:
+            return None
+        if self._hnsw is None:
+            space = "cosine" if self.metric == "cosine" else "ip"
+            graph = hnswlib.Index(space=space, dim=self.dimension)
+            graph.init_index(max_elements=self.capacity, ef_construction=200, M=16)
+            live = np.flatnonzero(self.alive[: self.count])
+            graph.add_items(np.asarray(self.vectors[live]), live)
+            self._hnsw = graph
+            logger.info("Built HNSW graph for %s (%d vectors)", self.path, len(live))
+        return self._hnsw
+
+    def _matches(self, rows, scores, include_metadata: bool, include_values: bool) -> List[Dict[str, Any]]:
+        matches = []
+        for row, score in zip(rows, scores):
+            match = {"id": self.ids[row], "score": float(score)}
+            if include_metadata:
+                match["metadata"] = self.metadata[row]
+            if include_values:
+                match["values"] = self.vectors[row].tolist()
+            matches.append(match)
+        return matches
+
+    def query_many(self, queries: np.ndarray, top_k: int, include_metadata: bool = True, include_values: bool = False) -> List[List[Dict[str, Any]]]:
+        queries = self._prepare(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        with self._lock:
+            live_count = len(self.rows)
+            k = min(top_k, live_count)
+            if k <= 0:
+                return [[] for _ in range(len(queries))]
+
+            graph = self._graph()
+            if graph is not None:
+                graph.set_ef(max(64, 2 * k))
+                labels, distances = graph.knn_query(queries, k=k)
+                return [
+                    self._matches(lab, 1.0 - dist, include_metadata, include_values)
+                    for lab, dist in zip(labels, distances)
+                ]
+
+            if self.quantization == "none":
+                scores = queries @ np.asarray(self.vectors[: self.count]).T
+                scores[:, ~self.alive[: self.count]] = -np.inf
+                results = []
+                for row_scores in scores:
+                    best = top_k_rows(row_scores, k)
+                    results.append(self._matches(best, row_scores[best], include_metadata, include_values))
+                return results
+
+            # Scan the quantized copy, then rescore a small candidate set exactly.
+            approx = self._approximate_scores(queries)
+            approx[:, ~self.alive[: self.count]] = -np.inf
+            results = []
+            for query, row_scores in zip(queries, approx):
+                # Ascending rows read vectors.f32 front to back.
+                candidates = np.sort(top_k_rows(row_scores, min(live_count, k * self.rescore_factor)))
+                exact = np.asarray(self.vectors[candidates]) @ query
+                best = top_k_rows(exact, k)
+                results.append(self._matches(candidates[best], exact[best], include_metadata, include_values))
+            return results
+
+    def _approximate_scores(self, queries: np.ndarray) -> np.ndarray:
+        """Scores of every row against the quantized copy."""
+        scores = np.empty((len(queries), self.count), dtype=np.float32)
+        if self.quantization == "int8":
+            # Widen one cache-sized block at a time into a reused buffer, then BLAS.
+            scratch = np.empty((_SCAN_BLOCK, self.dimension), dtype=np.float32)
+            for start in range(0, self.count, _SCAN_BLOCK):
+                end = min(self.count, start + _SCAN_BLOCK)
+                block = scratch[: end - start]
+                block[...] = self.codes[start:end]
+                scores[:, start:end] = (queries @ block.T) * self.scales[start:end]
+            return scores
+
+        codes, query_bits = self.codes[: self.count], quantize_binary(queries)
+        if codes.shape[1] % 8 == 0:
+            codes, query_bits = codes.view(np.uint64), query_bits.view(np.uint64)
+        for i, bits in enumerate(query_bits):
+            # Fewer differing sign bits = more similar.
+            scores[i] = -_popcount(np.bitwise_xor(codes, bits)).sum(axis=1, dtype=np.int32)
+        return scores
+
+class LocalIndex(VectorIndex):
+    def __init__(self, path: str, dimension: int, metric: str, quantization: str = LOCAL_QUANTIZATION):
+        self.path = path
+        self.dimension = dimension
+        self.metric = metric
+        self.quantization = quantization
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._lock = threading.Lock()
+
+    def _namespace(self, namespace: Optional[str]) -> _Namespace:
+        name = namespace or _DEFAULT_NAMESPACE
+        with self._lock:
+            ns = self._namespaces.get(name)
+            if ns is None:
+                ns = self._namespaces[name] = _Namespace(
+                    os.path.join(self.path, "ns", name), self.dimension, self.metric, self.quantization
+                )
+            return ns
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: Optional[str] = None) -> Dict[str, int]:
+        return {"upserted_count": self._namespace(namespace).upsert(vectors)}
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        namespace: Optional[str] = None,
+        include_metadata: bool = True,
+        include_values: bool = False,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        matches = self._namespace(namespace).query_many(np.asarray([vector]), top_k, include_metadata, include_values)[0]
+        return {"matches": matches, "namespace": namespace or ""}
+
+    def query_many(self, vectors: List[List[float]], top_k: int = 10, namespace: Optional[str] = None, include_metadata: bool = True) -> List[Dict[str, Any]]:
+        """Several queries in one matrix product."""
+        results = self._namespace(namespace).query_many(np.asarray(vectors), top_k, include_metadata)
+        return [{"matches": m, "namespace": namespace or ""} for m in results]
+
+    def delete(self, ids: Optional[List[str]] = None, namespace: Optional[str] = None, delete_all: bool = False) -> Dict[str, Any]:
+        if delete_all:
+            name = namespace or _DEFAULT_NAMESPACE
+            with self._lock:
+                self._namespaces.pop(name, None)
+                shutil.rmtree(os.path.join(self.path, "ns", name), ignore_errors=True)
+            return {}
+        self._namespace(namespace).delete(ids or [])
+        return {}
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        namespaces = {}
+        ns_root = os.path.join(self.path, "ns")
+        for name in sorted(os.listdir(ns_root)) if os.path.isdir(ns_root) else []:
+            ns = self._namespace(name)
+            namespaces[name] = {"vector_count": len(ns.rows), "scan_bytes": ns.resident_bytes()}
+        return {
+            "dimension": self.dimension,
+            "quantization": self.quantization,
+            "namespaces": namespaces,
+            "total_vector_count": sum(n["vector_count"] for n in namespaces.values()),
+        }
+
+
+class LocalVectorStore(VectorStore):
+    """Indexes are directories under `root`, each with an index.json describing it."""
+
+    def __init__(self, root: str, quantization: str = LOCAL_QUANTIZATION):
+        super().__init__()
+        self.root = root
+        self.quantization = quantization
+        self._indexes: Dict[str, LocalIndex] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _config_path(self, name: str) -> str:
+        return os.path.join(self.root, name, "index.json")
+
+    def index(self, name: str) -> LocalIndex:
+        with self._lock:
+            idx = self._indexes.get(name)
+            if idx is None:
+                if not os.path.exists(self._config_path(name)):
+                    raise LookupError(f"Index '{name}' not found")
+                with open(self._config_path(name), "r", encoding="utf-8") as f:
+                    config = json.load(f)
+                idx = self._indexes[name] = LocalIndex(
+                    os.path.join(self.root, name), config["dimension"], config["metric"], self.quantization
+                )
+            return idx
+
+    def list_indexes(self) -> List[str]:
+        return sorted(n for n in os.listdir(self.root) if os.path.exists(self._config_path(n)))
+
+    def create_index(self, name: str, dimension: int, metric: str = "cosine") -> None:
+        if metric not in _METRICS:
+            raise ValueError(f"Local vector store supports {_METRICS}, not '{metric}'")
+        os.makedirs(os.path.join(self.root, name), exist_ok=True)
+        with open(self._config_path(name), "w", encoding="utf-8") as f:
+            json.dump({"dimension": dimension, "metric": metric}, f)
+        logger.info("Created local vector index '%s' (dim=%d, %s)", name, dimension, metric)
+
+    def delete_index(self, name: str) -> None:
+        with self._lock:
+            self._indexes.pop(name, None)
+        shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        self.forget_index(name)
+
+    def stats(self, name: str) -> Tuple[int, int]:
+        """(vector count, bytes a full scan reads) across namespaces."""
+        namespaces = self.index(name).describe_index_stats()["namespaces"].values()
+        return sum(n["vector_count"] for n in namespaces), sum(n["scan_bytes"] for n in namespaces)
@@ -0,0 +1,348 @@
+"""
+Page images produced on first use.
+
+Every indexed document is registered (`pagedoc:{doc_id}` in Redis: its PDF
+URL and thumbnail width), so any page can be rendered later from the stored
+PDF. Renditions are cached on disk under
+`PAGE_IMAGE_CACHE_DIR/{doc_id}/{page}/{size}.{ext}` and served by
+`GET /documents/{doc_id}/pages/{page}/image?size=`:
+
+    thumb    WebP, the document's thumbnail width (result cards)
+    medium   WebP, PAGE_IMAGE_MEDIUM_WIDTH wide
+    full     PNG at PAGE_IMAGE_DPI (same as the page images ingestion uploads)
+
+Each page is rendered straight at the target width rather than downscaled.
+The disk cache is capped at PAGE_IMAGE_CACHE_MAX_MB; past it, the least
+recently served renditions are deleted and rendered again when next needed.
+
+Search results link thumbnails through `thumbnail_url`: with an asset store
+that resizes images itself (Cloudinary), a resized URL of the page image;
+otherwise the endpoint above, under ASSET_BASE_URL.
+
+With PAGE_IMAGE_UPLOAD=lazy, ingestion does not upload a rendered PNG for
+every page; OCR vectors carry an empty page_image_url. The first time a
+search result references a page, its full rendition is uploaded to the asset
+store and the URL cached in Redis under `pageimg:{doc_id}:{page_number}`, so
+later results reuse it. Most pages of a large document are never shown, so
+most are never uploaded.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import fitz
+from PIL import Image
+
+from redis_client import redis_client, redis_sync_client
+from utils.asset_store import ASSET_BASE_URL, ASSET_STORE, get_asset_store
+from utils.page_render import open_pdf_bytes, pixmap_to_png
+
+logger = logging.getLogger(__name__)
+
+PAGE_IMAGE_UPLOAD = os.getenv("PAGE_IMAGE_UPLOAD", "eager")  # eager | lazy
+PAGE_IMAGES_LAZY = PAGE_IMAGE_UPLOAD == "lazy"
+PAGE_IMAGE_DPI = int(os.getenv("PAGE_IMAGE_DPI", "150"))
+PAGE_IMAGE_MEDIUM_WIDTH = int(os.getenv("PAGE_IMAGE_MEDIUM_WIDTH", "1200"))
+PAGE_IMAGE_WEBP_QUALITY = int(os.getenv("PAGE_IMAGE_WEBP_QUALITY", "80"))
+PAGE_IMAGE_CACHE_DIR = os.getenv("PAGE_IMAGE_CACHE_DIR", "page_image_cache")
+PAGE_IMAGE_CACHE_MAX_MB = int(os.getenv("PAGE_IMAGE_CACHE_MAX_MB", "1024"))  # 0 = unbounded
+PAGE_IMAGE_MAX_AGE_SECONDS = int(os.getenv("PAGE_IMAGE_MAX_AGE_SECONDS", "86400"))
+DEFAULT_THUMBNAIL_WIDTH = 600
+# Source PDFs kept in memory so several pages of one document download it once.
+PDF_CACHE_SIZE = int(os.getenv("PAGE_IMAGE_PDF_CACHE_SIZE", "4"))
+
+PAGE_IMAGE_SIZES = {"thumb": "image/webp", "medium": "image/webp", "full": "image/png"}
+
+_pdf_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_pdf_lock = threading.Lock()
+_inflight: Dict[str, asyncio.Task] = {}
+# Bytes in the rendition cache as of the last scan plus renditions written since.
+_cache_bytes: Optional[int] = None
+_cache_lock = threading.Lock()
+
+
+def _key(doc_id: str, page_number: int) -> str:
+    return f"pageimg:{doc_id}:{page_number}"
+
+
+def _doc_key(doc_id: str) -> str:
+    return f"pagedoc:{doc_id}"
+
+
+def _page_dir(doc_id: str, page_number: int) -> str:
+    return os.path.join(PAGE_IMAGE_CACHE_DIR, os.path.basename(doc_id), str(page_number))
+
+
+def rendition_path(doc_id: str, page_number: int, size: str) -> str:
+    ext = "png" if size == "full" else "webp"
+    return os.path.join(_page_dir(doc_id, page_number), f"{size}.{ext}")
+
+
+def rendition_etag(path: str) -> str:
+    st = os.stat(path)
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header lists `etag` (weak comparison) or is `*`."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def _touch(path: str) -> bool:
+    """Mark a rendition as just served (atime only: mtime is part of its ETag). False if it is gone."""
+    try:
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        return True
+    except OSError:
+        return False
+
+
+def _scan_cache() -> List[tuple]:
+    """(atime, size, path) of every cached rendition."""
+    entries = []
+    for root, _, files in os.walk(PAGE_IMAGE_CACHE_DIR):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_atime, st.st_size, path))
+    return entries
+
+
+def _account(size: int) -> None:
+    """Count a newly written rendition; over the cap, evict least recently served ones."""
+    global _cache_bytes
+    limit = PAGE_IMAGE_CACHE_MAX_MB * 1024 * 1024
+    if limit <= 0:
+        return
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(entry[1] for entry in _scan_cache())
+        else:
+            _cache_bytes += size
+        if _cache_bytes <= limit:
+            return
+        entries = sorted(_scan_cache())
+        total = sum(entry[1] for entry in entries)
+        evicted = 0
+        # Down to 90% of the cap, so the next renders do not rescan right away.
+        for _, entry_size, path in entries:
+            if total <= limit * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= entry_size
+            evicted += 1
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        _cache_bytes = total
+    logger.info("Evicted %d page renditions; cache now %.1f MB", evicted, total / (1024 * 1024))
+
+
+async def _singleflight(key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+    """Concurrent callers with the same key share one run of `factory`."""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(factory())
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+# ---------------- documents ----------------
+def register_document(doc_id: str, pdf_url: Optional[str], thumbnail_width: int = DEFAULT_THUMBNAIL_WIDTH) -> None:
+    """Remember where a document's PDF lives so its pages can be rendered on demand."""
+    if not pdf_url:
+        return
+    try:
+        redis_sync_client.hset(_doc_key(doc_id), mapping={"pdf_url": pdf_url, "thumbnail_width": thumbnail_width})
+    except Exception as e:
+        logger.warning("Could not register document %s for page images: %s", doc_id, e)
+
+
+async def document_pdf_url(doc_id: str) -> Optional[str]:
+    """The registered PDF URL of a document (chunks upserted before the PDF upload finished carry none)."""
+    try:
+        return await redis_client.hget(_doc_key(doc_id), "pdf_url")
+    except Exception as e:
+        logger.warning("Page image registry unavailable: %s", e)
+        return None
+
+
+def load_pdf(pdf_url: str) -> bytes:
+    """The document's PDF from the asset store, through a small LRU."""
+    with _pdf_lock:
+        if pdf_url in _pdf_cache:
+            _pdf_cache.move_to_end(pdf_url)
+            return _pdf_cache[pdf_url]
+    data = get_asset_store().fetch(pdf_url)
+    with _pdf_lock:
+        _pdf_cache[pdf_url] = data
+        while len(_pdf_cache) > PDF_CACHE_SIZE:
+            _pdf_cache.popitem(last=False)
+    return data
+
+
+# ---------------- rendering ----------------
+def render_page_png(pdf_bytes: bytes, page_number: int, dpi: int = PAGE_IMAGE_DPI) -> bytes:
+    doc = open_pdf_bytes(pdf_bytes)
+    try:
+        page = doc.load_page(page_number - 1)
+        return pixmap_to_png(page.get_pixmap(matrix=fitz.Matrix(dpi / 72.0, dpi / 72.0)))
+    finally:
+        doc.close()
+
+
+def render_page_webp(pdf_bytes: bytes, page_number: int, width: int) -> bytes:
+    doc = open_pdf_bytes(pdf_bytes)
+    try:
+        page = doc.load_page(page_number - 1)
+        zoom = width / page.rect.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        out = io.BytesIO()
+        Image.frombytes("RGB", (pix.width, pix.height), pix.samples).save(
+            out, "WEBP", quality=PAGE_IMAGE_WEBP_QUALITY, method=4
+        )
+        return out.getvalue()
+    finally:
+        doc.close()
+
+
+def _write_rendition(doc_id: str, page_number: int, size: str, pdf_url: str, thumbnail_width: int) -> str:
+    """Render one size of a page into the disk cache (no-op if it is already there)."""
+    path = rendition_path(doc_id, page_number, size)
+    if os.path.exists(path):
+        return path
+    pdf_bytes = load_pdf(pdf_url)
+    if size == "full":
+        data = render_page_png(pdf_bytes, page_number)
+    else:
+        data = render_page_webp(pdf_bytes, page_number, thumbnail_width if size == "thumb" else PAGE_IMAGE_MEDIUM_WIDTH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    _account(len(data))
+    return path
+
+
+async def get_page_rendition(doc_id: str, page_number: int, size: str) -> Optional[str]:
+    """
+    Path of a cached rendition, rendering it on first request. None if the
+    document is unknown or the page does not exist.
+    """
+    if size not in PAGE_IMAGE_SIZES:
+        raise ValueError(f"Unknown page image size '{size}' (expected one of {list(PAGE_IMAGE_SIZES)})")
+    path = rendition_path(doc_id, page_number, size)
+    if _touch(path):
+        return path
+
+    async def _render() -> Optional[str]:
+        try:
+            doc = await redis_client.hgetall(_doc_key(doc_id))
+        except Exception as e:
+            logger.warning("Page image registry unavailable: %s", e)
+            return None
+        if not doc or page_number < 1:
+            return None
+        try:
+            return await asyncio.to_thread(
+                _write_rendition, doc_id, page_number, size, doc["pdf_url"],
+                int(doc.get("thumbnail_width") or DEFAULT_THUMBNAIL_WIDTH),
+            )
+        except (IndexError, ValueError) as e:
+            logger.info("No page %d in %s: %s", page_number, doc_id, e)
+            return None
+        except Exception as e:
+            logger.error("Could not render %s page %d (%s): %s", doc_id, page_number, size, e)
+            return None
+
+    return await _singleflight(f"render:{doc_id}:{page_number}:{size}", _render)
+
+
+# ---------------- lazily uploaded page images ----------------
+def _produce(doc_id: str, page_number: int, pdf_url: str) -> Optional[str]:
+    path = _write_rendition(doc_id, page_number, "full", pdf_url, DEFAULT_THUMBNAIL_WIDTH)
+    with open(path, "rb") as f:
+        return get_asset_store().put(f.read(), f"{doc_id}_page_{page_number}.png")
+
+
+async def _resolve(doc_id: str, page_number: int, pdf_url: str) -> Optional[str]:
+    key = _key(doc_id, page_number)
+    try:
+        cached = await redis_client.get(key)
+    except Exception as e:
+        logger.warning("Page image cache unavailable: %s", e)
+        cached = None
+    if cached:
+        return cached
+
+    try:
+        url = await asyncio.to_thread(_produce, doc_id, page_number, pdf_url)
+    except Exception as e:
+        logger.error("Could not produce image for %s page %d: %s", doc_id, page_number, e)
+        return None
+    if url:
+        try:
+            await redis_client.set(key, url)
+        except Exception as e:
+            logger.warning("Page image cache write failed: %s", e)
+    return url
+
+
+async def page_image_url(doc_id: str, page_number: int, pdf_url: str) -> Optional[str]:
+    """URL of a page image, producing it on first request; concurrent requests share one upload."""
+    return await _singleflight(_key(doc_id, page_number), lambda: _resolve(doc_id, page_number, pdf_url))
+
+
+def thumbnail_url(doc_id: Optional[str], page_number: Optional[int], page_image_url: Optional[str]) -> Optional[str]:
+    """URL of a page's thumbnail for result cards (see the module docstring)."""
+    store = get_asset_store()
+    if page_image_url:
+        resized = store.resized_url(page_image_url, DEFAULT_THUMBNAIL_WIDTH)
+        if resized:
+            return resized
+    if not doc_id or ASSET_STORE != "local":
+        # ASSET_BASE_URL is this app's public address only when it serves the assets.
+        return None
+    return f"{ASSET_BASE_URL}/documents/{doc_id}/pages/{page_number}/image?size=thumb"
+
+
+def forget_document(doc_id: str) -> None:
+    """Drop a document's registration and every cached rendition (its index was cleared)."""
+    shutil.rmtree(os.path.join(PAGE_IMAGE_CACHE_DIR, os.path.basename(doc_id)), ignore_errors=True)
+    try:
+        redis_sync_client.delete(_doc_key(doc_id))
+    except Exception as e:
+        logger.warning("Could not unregister document %s: %s", doc_id, e)
+
+
+def forget_page_images(doc_id: str, pages: List[int]) -> None:
+    """Drop cached URLs and renditions of pages whose content changed or that were removed."""
+    if not pages:
+        return
+    for page_number in pages:
+        shutil.rmtree(_page_dir(doc_id, page_number), ignore_errors=True)
+    try:
+        redis_sync_client.delete(*(_key(doc_id, p) for p in pages))
+    except Exception as e:
+        logger.warning("Could not clear page image cache for %s: %s", doc_id, e)
@@ -0,0 +1,110 @@
+"""
+Per-document page manifests for incremental re-indexing.
+
+After a document is indexed, the manifest records its doc_id, the
+fingerprint of every page (native text + rendered image) and how many
+vectors each page produced in each index. When a new revision of the same
+document is uploaded, only pages whose fingerprint changed are re-OCR'd and
+re-embedded. Vectors those pages no longer need, and vectors of pages that
+were removed, are deleted.
+
+What makes an upload a revision is its caller-chosen `document_key` (the
+/upload form field); an index may hold many documents side by side, so the
+target index says nothing about which of them is being replaced. Uploads
+without a key are always new documents.
+
+Keys:
+    ingest:manifest:{index_name}:{namespace}:{document_key or doc_id}
+        one manifest per document in an OCR index/namespace; never expires,
+        dropped when that index or namespace is cleared (utils.delete_index)
+    ingest:document:{document_key}
+        the index names a keyed document was uploaded into, so a revision
+        finds them without the caller pinning index names
+"""
+
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from redis_client import redis_client, redis_sync_client
+
+logger = logging.getLogger(__name__)
+
+
+def _manifest_key(index_name: str, namespace: Optional[str], key: str) -> str:
+    return f"ingest:manifest:{index_name}:{namespace or ''}:{key}"
+
+
+def _document_key(document_key: str) -> str:
+    return f"ingest:document:{document_key}"
+
+
+def page_fingerprint(text: str, png: bytes) -> str:
+    """Stable hash of a page's text layer and its rendered image."""
+    digest = hashlib.sha256(text.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(hashlib.sha256(png).digest())
+    return digest.hexdigest()
+
+
+def load_manifest(index_name: str, namespace: Optional[str], key: str) -> Optional[Dict[str, Any]]:
+    try:
+        raw = redis_sync_client.get(_manifest_key(index_name, namespace, key))
+    except Exception as e:
+        logger.warning("Could not load page manifest for %s: %s", index_name, e)
+        return None
+    return json.loads(raw) if raw else None
+
+
+def save_manifest(index_name: str, namespace: Optional[str], key: str, manifest: Dict[str, Any]) -> None:
+    try:
+        redis_sync_client.set(_manifest_key(index_name, namespace, key), json.dumps(manifest))
+    except Exception as e:
+        # Only costs the next revision a full re-index.
+        logger.warning("Could not save page manifest for %s: %s", index_name, e)
+
+
+def list_manifests(index_name: str, namespace: Optional[str] = None) -> List[Dict[str, Any]]:
+    """The manifests of every document indexed into one index/namespace."""
+    try:
+        keys = list(redis_sync_client.scan_iter(match=_manifest_key(index_name, namespace, "*"), count=1000))
+        raws = redis_sync_client.mget(keys) if keys else []
+    except Exception as e:
+        logger.warning("Could not list page manifests for %s: %s", index_name, e)
+        return []
+    return [json.loads(raw) for raw in raws if raw]
+
+
+def drop_manifests(index_name: str, namespace: Optional[str] = None) -> None:
+    """Remove every manifest of one index/namespace, and the index records of their document keys."""
+    document_keys = [_document_key(m["document_key"]) for m in list_manifests(index_name, namespace) if m.get("document_key")]
+    try:
+        keys = list(redis_sync_client.scan_iter(match=_manifest_key(index_name, namespace, "*"), count=1000))
+        for i in range(0, len(keys), 1000):
+            redis_sync_client.delete(*keys[i:i + 1000])
+        if document_keys:
+            redis_sync_client.delete(*document_keys)
+    except Exception as e:
+        logger.warning("Could not drop page manifests for %s: %s", index_name, e)
+
+
+async def document_indexes(document_key: str) -> Optional[Dict[str, str]]:
+    """{"index_name_pdf", "index_name_ocr"} a keyed document was last uploaded into, or None."""
+    try:
+        raw = await redis_client.get(_document_key(document_key))
+    except Exception as e:
+        logger.warning("Could not look up indexes of document %s: %s", document_key, e)
+        return None
+    return json.loads(raw) if raw else None
+
+
+async def remember_document_indexes(document_key: str, index_name_pdf: str, index_name_ocr: str) -> None:
+    try:
+        await redis_client.set(_document_key(document_key), json.dumps({
+            "index_name_pdf": index_name_pdf,
+            "index_name_ocr": index_name_ocr,
+        }))
+    except Exception as e:
+        # The next revision then lands in fresh indexes and is indexed in full.
+        logger.warning("Could not record indexes of document %s: %s", document_key, e)
@@ -0,0 +1,284 @@
+"""
+PyMuPDF page rendering and text/image extraction, in-thread or on a process pool.
+
+`page.get_pixmap` holds the GIL, so rendering on threads cannot use more than
+one core. With INGEST_PROCESS_WORKERS > 0 (or "auto" for one per CPU) pages
+are rendered on a shared spawn-based process pool instead; each
+worker opens the document itself and returns plain bytes/strings to the
+parent. With 0 (default) everything runs in the calling thread.
+
+Pages are submitted one task each rather than as page ranges: the ingestion
+pipeline streams pages through OCR, upload and image deduplication as they
+are rendered, and the images to skip on a page depend on the pages before
+it. Instead each worker keeps its RENDER_DOC_CACHE_SIZE most recently used
+documents open, so pages of several concurrent jobs can interleave on one
+worker without reopening their PDFs.
+
+Documents are opened from memory (`fitz.open(stream=...)`). In process
+mode the PDF bytes are placed in one shared-memory block per document and
+workers attach to it by name, so no temp file is written and the bytes are
+not re-pickled for every task.
+
+Functions submitted to the pool are module-level so they pickle. This
+module itself only imports PyMuPDF, but a spawned worker also re-imports
+the parent's `__main__` script as `__mp_main__`: under `uvicorn main:app`
+that is only uvicorn's entry point, while with `python main.py` or
+`python ingestion_jobs.py` (INGEST_JOB_MODE=redis workers) each pool
+process imports the whole server stack once when it starts.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+_workers_env = os.getenv("INGEST_PROCESS_WORKERS", "0")
+INGEST_PROCESS_WORKERS = (os.cpu_count() or 1) if _workers_env == "auto" else int(_workers_env)
+# Open documents kept per pool worker (each holds its PDF bytes in memory).
+RENDER_DOC_CACHE_SIZE = max(1, int(os.getenv("RENDER_DOC_CACHE_SIZE", "4")))
+
+# Native-text page detection (pages that pass can skip OCR).
+OCR_SKIP_NATIVE_PAGES = os.getenv("OCR_SKIP_NATIVE_PAGES", "1") == "1"
+NATIVE_MIN_CHARS = int(os.getenv("NATIVE_MIN_CHARS", "40"))
+NATIVE_MIN_CHARS_PER_SQ_INCH = float(os.getenv("NATIVE_MIN_CHARS_PER_SQ_INCH", "1.0"))
+NATIVE_MAX_IMAGE_COVERAGE = float(os.getenv("NATIVE_MAX_IMAGE_COVERAGE", "0.5"))
+NATIVE_MAX_BAD_GLYPH_RATIO = float(os.getenv("NATIVE_MAX_BAD_GLYPH_RATIO", "0.05"))
+
+
+# ==========================================================
+# Worker-side functions (run in pool processes or in-thread)
+# ==========================================================
+# (shared-memory name, size) of a PDF published by the parent process.
+SharedPdf = Tuple[str, int]
+
+_worker_docs: "OrderedDict[SharedPdf, fitz.Document]" = OrderedDict()
+
+
+def open_pdf_bytes(pdf_bytes: bytes) -> fitz.Document:
+    return fitz.open(stream=pdf_bytes, filetype="pdf")
+
+
+def _open_cached(shared: SharedPdf) -> fitz.Document:
+    """LRU of open documents per worker process; reopening per page is wasteful."""
+    doc = _worker_docs.get(shared)
+    if doc is not None:
+        _worker_docs.move_to_end(shared)
+        return doc
+    name, size = shared
+    # Spawned workers share the parent's resource tracker, so attaching
+    # does not register a second owner; the parent unlinks the block.
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        pdf_bytes = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    doc = _worker_docs[shared] = open_pdf_bytes(pdf_bytes)
+    while len(_worker_docs) > RENDER_DOC_CACHE_SIZE:
+        _worker_docs.popitem(last=False)[1].close()
+    return doc
+
+
+def pixmap_to_png(pix: fitz.Pixmap) -> bytes:
+    """Convert to RGB if has alpha channel, then encode as PNG."""
+    if pix.alpha:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    return pix.tobytes("png")
+
+
+def _image_coverage(page: fitz.Page) -> float:
+    """Fraction of the page area covered by placed images (overlaps counted once per image)."""
+    page_rect = page.rect
+    page_area = abs(page_rect) or 1.0
+    covered = 0.0
+    for info in page.get_image_info():
+        covered += abs(fitz.Rect(info["bbox"]) & page_rect)
+    return min(1.0, covered / page_area)
+
+
+def classify_page(page: fitz.Page, text: str, words: List[tuple]) -> Dict[str, Any]:
+    """
+    Decide whether a page's native text layer is good enough to skip OCR.
+    Scanned pages have (almost) no text layer; slides/figures are mostly image;
+    broken font encodings show up as U+FFFD replacement glyphs.
+    """
+    chars = sum(len(w[4]) for w in words)
+    area_sq_in = max(abs(page.rect) / (72.0 * 72.0), 1e-6)
+    bad_glyphs = text.count("\ufffd")
+    metrics = {
+        "glyphs": chars,
+        "words": len(words),
+        "chars_per_sq_inch": round(chars / area_sq_in, 2),
+        "image_coverage": round(_image_coverage(page), 3),
+        "bad_glyph_ratio": round(bad_glyphs / chars, 3) if chars else 0.0,
+    }
+    native = (
+        OCR_SKIP_NATIVE_PAGES
+        and chars >= NATIVE_MIN_CHARS
+        and metrics["chars_per_sq_inch"] >= NATIVE_MIN_CHARS_PER_SQ_INCH
+        and metrics["image_coverage"] <= NATIVE_MAX_IMAGE_COVERAGE
+        and metrics["bad_glyph_ratio"] <= NATIVE_MAX_BAD_GLYPH_RATIO
+    )
+    return {"needs_ocr": not native, "metrics": metrics}
+
+
+def native_word_boxes(words: List[tuple], dpi: int) -> List[Dict[str, Any]]:
+    """PyMuPDF word tuples (PDF points) -> OCR.space-style boxes in rendered-pixel space."""
+    scale = dpi / 72.0
+    return [
+        {
+            "word": w[4],
+            "x": int(round(w[0] * scale)),
+            "y": int(round(w[1] * scale)),
+            "w": int(round((w[2] - w[0]) * scale)),
+            "h": int(round((w[3] - w[1]) * scale)),
+            "confidence": 100.0,
+        }
+        for w in words
+    ]
+
+
+def _page_images(doc: fitz.Document, page: fitz.Page, page_num: int, skip_xrefs: frozenset = frozenset()) -> List[Dict[str, Any]]:
+    images = []
+    for img_index, img_info in enumerate(page.get_images(full=True)):
+        xref = img_info[0]
+        if xref in skip_xrefs:
+            # Still report it so callers can count repeats, just without the bytes.
+            images.append({"index": img_index + 1, "xref": xref, "ext": "", "bytes": b""})
+            continue
+        try:
+            base_image = doc.extract_image(xref)
+            images.append({
+                "index": img_index + 1,
+                "xref": xref,
+                "ext": base_image["ext"],
+                "bytes": base_image["image"],
+            })
+        except Exception as e:
+            logger.warning(f"Failed to extract image {img_index + 1} from page {page_num + 1}: {str(e)}")
+    return images
+
+
+def _render(doc: fitz.Document, page_num: int, dpi: int, extract_images: bool = False, skip_xrefs: frozenset = frozenset()) -> Dict[str, Any]:
+    page = doc.load_page(page_num)
+    png = pixmap_to_png(page.get_pixmap(matrix=fitz.Matrix(dpi / 72.0, dpi / 72.0)))
+    text = page.get_text()
+    words = page.get_text("words")
+    classification = classify_page(page, text, words)
+    return {
+        "png": png,
+        "text": text,
+        "words": native_word_boxes(words, dpi) if not classification["needs_ocr"] else [],
+        "images": _page_images(doc, page, page_num, skip_xrefs) if extract_images else [],
+        **classification,
+    }
+
+
+def render_page(shared: SharedPdf, page_num: int, dpi: int, extract_images: bool = False, skip_xrefs: frozenset = frozenset()) -> Dict[str, Any]:
+    return _render(_open_cached(shared), page_num, dpi, extract_images, skip_xrefs)
+
+
+# ==========================================================
+# Parent-side API
+# ==========================================================
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: forking a threaded server process is unsafe
+                _pool = ProcessPoolExecutor(
+                    max_workers=max(1, INGEST_PROCESS_WORKERS),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logger.info("Started page render process pool with %d workers", max(1, INGEST_PROCESS_WORKERS))
+    return _pool
+
+
+def page_count(pdf_bytes: bytes) -> int:
+    with open_pdf_bytes(pdf_bytes) as doc:
+        return doc.page_count
+
+
+class SharedPdfBlock:
+    """Publishes PDF bytes in shared memory for pool workers; unlink when done."""
+
+    def __init__(self, pdf_bytes: bytes):
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, len(pdf_bytes)))
+        self._shm.buf[: len(pdf_bytes)] = pdf_bytes
+        self.ref: SharedPdf = (self._shm.name, len(pdf_bytes))
+
+    def close(self) -> None:
+        self._shm.close()
+        self._shm.unlink()
+
+
+class PageRenderer:
+    """
+    Renders pages of one in-memory PDF to PNG bytes and classifies them. Safe to call from many
+    threads: in thread mode each thread gets its own fitz.Document (documents
+    are not thread-safe); in process mode calls are forwarded to the pool.
+    """
+
+    def __init__(self, pdf_bytes: bytes, dpi: int, workers: int = INGEST_PROCESS_WORKERS, extract_images: bool = False):
+        self.pdf_bytes = pdf_bytes
+        self.dpi = dpi
+        self.extract_images = extract_images
+        self.use_processes = workers > 0
+        self._shared: Optional[SharedPdfBlock] = None
+        self._local = threading.local()
+        self._opened: List[fitz.Document] = []
+        self._lock = threading.Lock()
+
+    @property
+    def parallelism(self) -> int:
+        """How many renders can usefully run at once."""
+        return max(1, INGEST_PROCESS_WORKERS) if self.use_processes else 1
+
+    def _thread_doc(self) -> fitz.Document:
+        doc = getattr(self._local, "doc", None)
+        if doc is None:
+            doc = open_pdf_bytes(self.pdf_bytes)
+            self._local.doc = doc
+            with self._lock:
+                self._opened.append(doc)
+        return doc
+
+    def _shared_ref(self) -> SharedPdf:
+        with self._lock:
+            if self._shared is None:
+                self._shared = SharedPdfBlock(self.pdf_bytes)
+            return self._shared.ref
+
+    def render(self, page_num: int, skip_xrefs: frozenset = frozenset()) -> Dict[str, Any]:
+        """
+        PNG bytes plus the page's native text layer and OCR classification:
+        {"png", "text", "words", "images", "needs_ocr", "metrics"}. `words` is
+        only filled for pages that can skip OCR; `images` only when the
+        renderer extracts images (bytes are omitted for `skip_xrefs`).
+        """
+        if self.use_processes:
+            return get_process_pool().submit(
+                render_page, self._shared_ref(), page_num, self.dpi, self.extract_images, skip_xrefs
+            ).result()
+        return _render(self._thread_doc(), page_num, self.dpi, self.extract_images, skip_xrefs)
+
+    def close(self) -> None:
+        with self._lock:
+            for doc in self._opened:
+                doc.close()
+            self._opened.clear()
+            if self._shared is not None:
+                self._shared.close()
+                self._shared = None
@@ -1,45 +1,165 @@
-import requests
+"""
+Web search through the Serper API.
+
+`asearch_serper` is what the retrieval pipeline uses:
+- one pooled keep-alive httpx.AsyncClient per event loop, with a connect
+  timeout and an overall deadline (a slow Serper response costs at most
+  SERPER_TIMEOUT_SECONDS, after which the search returns no results)
+- results cached in Redis by normalized query (`serper:{sha256}`) for
+  SERPER_CACHE_TTL_SECONDS
+- identical concurrent searches share one request
+- Serper is sent the query as the user wrote it; normalisation (case and
+  whitespace) only decides what counts as the same search
+
+`search_serper` is the blocking variant for scripts; it is not cached.
+"""
+
+import asyncio
+import hashlib
 import json
+import logging
 import os
+import re
+import weakref
+from typing import Dict, List
+
+import httpx
+import requests
 from dotenv import load_dotenv
 
+from redis_client import redis_client
+
 # Load .env file to keep API key secure
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
 SERPER_URL = "https://google.serper.dev/search"
+SERPER_TIMEOUT_SECONDS = float(os.getenv("SERPER_TIMEOUT_SECONDS", "5"))
+SERPER_CONNECT_TIMEOUT_SECONDS = float(os.getenv("SERPER_CONNECT_TIMEOUT_SECONDS", "2"))
+SERPER_MAX_CONNECTIONS = int(os.getenv("SERPER_MAX_CONNECTIONS", "20"))
+SERPER_CACHE_TTL_SECONDS = int(os.getenv("SERPER_CACHE_TTL_SECONDS", "3600"))
+
+# Per event loop: connections cannot be shared across loops, and an entry
+# goes away with its loop.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_inflight: Dict[tuple, asyncio.Task] = {}
+
+
+def _headers() -> Dict[str, str]:
+    return {
+        "X-API-KEY": SERPER_API_KEY or "",
+        "Content-Type": "application/json"
+    }
+
+
+def _extract_results(data: Dict) -> List[Dict]:
+    # Extract snippet-like results
+    results = []
+    for item in data.get("organic", []):
+        results.append({
+            "title": item.get("title"),
+            "link": item.get("link"),
+            "snippet": item.get("snippet")
+        })
+    return results
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query.lower()).strip()
+
+
+def _cache_key(normalized: str) -> str:
+    return f"serper:{hashlib.sha256(normalized.encode('utf-8')).hexdigest()}"
 
 
 def search_serper(query: str):
     """
     Search the web using Serper API and return top results with snippets.
     """
-    headers = {
-        "X-API-KEY": SERPER_API_KEY,
-        "Content-Type": "application/json"
-    }
+    try:
+        response = requests.post(
+            SERPER_URL,
+            headers=_headers(),
+            data=json.dumps({"q": query}),
+            timeout=(SERPER_CONNECT_TIMEOUT_SECONDS, SERPER_TIMEOUT_SECONDS),
+        )
+        response.raise_for_status()
+        return _extract_results(response.json())
+
+    except requests.exceptions.RequestException as e:
+        logger.error("Error during Serper API call: %s", e)
+        return []
+
+
+# ---------------- async client ----------------
+def _get_client() -> httpx.AsyncClient:
+    """The pooled client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            headers=_headers(),
+            timeout=httpx.Timeout(SERPER_TIMEOUT_SECONDS, connect=SERPER_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=SERPER_MAX_CONNECTIONS, max_keepalive_connections=SERPER_MAX_CONNECTIONS),
+        )
+        _clients[loop] = client
+    return client
 
-    payload = json.dumps({"q": query})
+
+async def aclose_serper() -> None:
+    """Close the running loop's client."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def _fetch(query: str, normalized: str) -> List[Dict]:
+    key = _cache_key(normalized)
+    try:
+        cached = await redis_client.get(key)
+    except Exception as e:
+        logger.warning("Web search cache unavailable: %s", e)
+        cached = None
+    if cached is not None:
+        logger.info("Web search cache hit")
+        return json.loads(cached)
 
     try:
-        response = requests.post(SERPER_URL, headers=headers, data=payload)
+        # httpx timeouts apply per connect/read; the deadline also bounds a trickling response.
+        response = await asyncio.wait_for(
+            _get_client().post(SERPER_URL, json={"q": query}), SERPER_TIMEOUT_SECONDS
+        )
         response.raise_for_status()
-        data = response.json()
+        results = _extract_results(response.json())
+    except (httpx.TimeoutException, asyncio.TimeoutError):
+        logger.warning("Serper search timed out after %.1fs", SERPER_TIMEOUT_SECONDS)
+        return []
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error("Error during Serper API call: %s", e)
+        return []
 
-        # Extract snippet-like results
-        results = []
-        for item in data.get("organic", []):
-            results.append({
-                "title": item.get("title"),
-                "link": item.get("link"),
-                "snippet": item.get("snippet")
-            })
+    try:
+        await redis_client.set(key, json.dumps(results), ex=SERPER_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning("Web search cache write failed: %s", e)
+    return results
 
-        return results
 
-    except requests.exceptions.RequestException as e:
-        print("Error during Serper API call:", e)
+async def asearch_serper(query: str) -> List[Dict]:
+    """Top web results with snippets; errors and timeouts give []."""
+    normalized = normalize_query(query)
+    if not normalized:
         return []
+    # Serper gets the query as typed; the normalized form only keys the cache and sharing.
+    inflight_key = (asyncio.get_running_loop(), normalized)
+    task = _inflight.get(inflight_key)
+    if task is None:
+        task = asyncio.create_task(_fetch(query.strip(), normalized))
+        _inflight[inflight_key] = task
+        task.add_done_callback(lambda _: _inflight.pop(inflight_key, None))
+    # Shielded: one caller giving up must not cancel the search for the others.
+    return list(await asyncio.shield(task))
 
 
 # if __name__ == "__main__":
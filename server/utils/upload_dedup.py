@@ -0,0 +1,147 @@
+"""
+Content-addressed upload deduplication.
+
+Uploads are fingerprinted by the SHA-256 of their bytes. Once a document has
+been indexed, its index names and pdf_url are stored in Redis under that
+fingerprint (for UPLOAD_DEDUP_TTL_SECONDS, and dropped when either index is
+deleted), so a repeat upload can return them without re-running extraction,
+OCR and embedding. While a document is still being processed an in-flight
+marker, owned by one job id, points identical uploads at the running job.
+
+Redis errors are logged and treated as misses: uploads are then simply not
+deduplicated.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+INFLIGHT_TTL_SECONDS = 2 * 3600
+# How long a duplicate upload waits for the claiming job's first status write.
+CLAIM_STATUS_RETRIES = 5
+CLAIM_STATUS_RETRY_SECONDS = 0.2
+UPLOAD_DEDUP_TTL_SECONDS = int(os.getenv("UPLOAD_DEDUP_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Claim-or-read, compare-and-set and compare-and-delete on the in-flight
+# marker, so a claim never silently vanishes between two commands and a job
+# only ever changes a claim it owns.
+_CLAIM = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return false
+end
+return redis.call('GET', KEYS[1])
+"""
+_TAKE_OVER = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3]) and 1 or 0
+end
+return 0
+"""
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def upload_fingerprint(
+    content: bytes,
+    index_name_text: Optional[str] = None,
+    index_name_ocr: Optional[str] = None,
+    document_key: Optional[str] = None,
+) -> str:
+    """
+    SHA-256 of the uploaded bytes. When the caller pins target index names
+    or a document key they become part of the key, so the same file can
+    still be added to a different pair of indexes or as another document.
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    if index_name_text or index_name_ocr or document_key:
+        return f"{digest}:{index_name_text or ''}:{index_name_ocr or ''}:{document_key or ''}"
+    return digest
+
+
+def _doc_key(fingerprint: str) -> str:
+    return f"upload:sha256:{fingerprint}"
+
+
+def _inflight_key(fingerprint: str) -> str:
+    return f"upload:sha256:{fingerprint}:inflight"
+
+
+def _index_key(index_name: str) -> str:
+    return f"upload:index:{index_name}"
+
+
+async def get_indexed_document(fingerprint: str) -> Optional[Dict[str, Any]]:
+    try:
+        raw = await redis_client.get(_doc_key(fingerprint))
+    except Exception as e:
+        logger.warning(f"Could not look up upload fingerprint {fingerprint[:12]}…: {e}")
+        return None
+    return json.loads(raw) if raw else None
+
+
+async def record_indexed_document(fingerprint: str, record: Dict[str, Any]) -> None:
+    """Store the finished upload and drop the in-flight marker if `record["job_id"]` still holds it."""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(_doc_key(fingerprint), json.dumps(record), ex=UPLOAD_DEDUP_TTL_SECONDS)
+    # Reverse mapping, so deleting either index can drop the record.
+    for index_name in {record.get("index_name_pdf"), record.get("index_name_ocr")} - {None}:
+        pipe.set(_index_key(index_name), fingerprint, ex=UPLOAD_DEDUP_TTL_SECONDS)
+    pipe.eval(_RELEASE, 1, _inflight_key(fingerprint), record["job_id"])
+    try:
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record upload fingerprint {fingerprint[:12]}…: {e}")
+        return
+    logger.info(f"Recorded upload fingerprint {fingerprint[:12]}…")
+
+
+async def forget_indexed_document(index_name: str) -> None:
+    """Drop the dedup record of the upload that created `index_name` (the index is being deleted)."""
+    try:
+        fingerprint = await redis_client.get(_index_key(index_name))
+        if fingerprint:
+            await redis_client.delete(_doc_key(fingerprint), _index_key(index_name))
+            logger.info(f"Forgot upload fingerprint {fingerprint[:12]}… of deleted index {index_name}")
+    except Exception as e:
+        logger.warning(f"Could not forget upload fingerprint of {index_name}: {e}")
+
+
+async def claim_fingerprint(fingerprint: str, job_id: str) -> Optional[str]:
+    """
+    Mark `fingerprint` as being processed by `job_id`.
+    Returns None if the claim succeeded (or Redis is unreachable, so there
+    is nothing to claim), otherwise the id of the job that already holds it.
+    """
+    try:
+        return await redis_client.eval(_CLAIM, 1, _inflight_key(fingerprint), job_id, INFLIGHT_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Could not claim upload fingerprint {fingerprint[:12]}…: {e}")
+        return None
+
+
+async def take_over_fingerprint(fingerprint: str, stale_job_id: str, job_id: str) -> bool:
+    """
+    Move the claim from `stale_job_id` (a job that no longer exists) to
+    `job_id`. False if the claim changed hands or expired in the meantime.
+    """
+    return bool(await redis_client.eval(
+        _TAKE_OVER, 1, _inflight_key(fingerprint), stale_job_id, job_id, INFLIGHT_TTL_SECONDS
+    ))
+
+
+async def release_fingerprint(fingerprint: str, job_id: str) -> None:
+    """Drop the in-flight marker if `job_id` still holds it."""
+    try:
+        await redis_client.eval(_RELEASE, 1, _inflight_key(fingerprint), job_id)
+    except Exception as e:
+        logger.warning(f"Could not release upload fingerprint {fingerprint[:12]}…: {e}")
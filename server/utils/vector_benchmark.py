@@ -0,0 +1,117 @@
+"""
+Recall / speed benchmark for the local vector store's quantization modes.
+
+    cd server
+    python -m utils.vector_benchmark --index <index> [--namespace <ns>]
+    python -m utils.vector_benchmark --synthetic 100000 --dimension 384
+
+With --index, vectors are read from that index in LOCAL_VECTOR_STORE_DIR (our
+document corpus); `--queries` of them are held out as queries and the rest are
+indexed. Each mode is built in a temporary directory and compared against
+exact float32 search: recall@k, queries per second and bytes scanned per
+vector.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from utils.local_vector_store import _DEFAULT_NAMESPACE, _QUANTIZATIONS, LOCAL_RESCORE_FACTOR, _Namespace
+from utils.vector_store import LOCAL_VECTOR_STORE_DIR
+
+
+def load_corpus(index_name: str, namespace: str) -> np.ndarray:
+    from utils.local_vector_store import LocalVectorStore
+
+    ns = LocalVectorStore(LOCAL_VECTOR_STORE_DIR).index(index_name)._namespace(namespace)
+    live = np.flatnonzero(ns.alive[: ns.count])
+    return np.asarray(ns.vectors[live])
+
+
+def synthetic_corpus(count: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """Clustered vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, count // 200), dimension))
+    vectors = centers[rng.integers(len(centers), size=count)] + 0.6 * rng.normal(size=(count, dimension))
+    return vectors.astype(np.float32)
+
+
+def _build(root: str, mode: str, corpus: np.ndarray, rescore_factor: int) -> _Namespace:
+    ns = _Namespace(os.path.join(root, mode), corpus.shape[1], "cosine", mode, rescore_factor)
+    for start in range(0, len(corpus), 5000):
+        block = corpus[start : start + 5000]
+        ns.upsert([{"id": str(start + i), "values": v} for i, v in enumerate(block)])
+    return ns
+
+
+def _search(ns: _Namespace, queries: np.ndarray, k: int) -> Tuple[List[set], float]:
+    results = []
+    started = time.perf_counter()
+    for query in queries:
+        matches = ns.query_many(query[None, :], k, include_metadata=False)[0]
+        results.append({m["id"] for m in matches})
+    return results, len(queries) / (time.perf_counter() - started)
+
+
+def run(corpus: np.ndarray, num_queries: int, k: int, rescore_factor: int) -> List[Dict[str, float]]:
+    rng = np.random.default_rng(1)
+    order = rng.permutation(len(corpus))
+    queries, corpus = corpus[order[:num_queries]], corpus[order[num_queries:]]
+
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        truth = None
+        for mode in _QUANTIZATIONS:
+            ns = _build(root, mode, corpus, rescore_factor)
+            results, qps = _search(ns, queries, k)
+            if truth is None:
+                truth = results
+            recall = float(np.mean([len(r & t) / len(t) for r, t in zip(results, truth)]))
+            rows.append({
+                "mode": mode,
+                "bytes_per_vector": ns.resident_bytes() / max(1, len(ns.rows)),
+                f"recall@{k}": recall,
+                "qps": qps,
+            })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="local index to read the corpus from")
+    parser.add_argument("--namespace", default=_DEFAULT_NAMESPACE)
+    parser.add_argument("--synthetic", type=int, default=50000, help="corpus size when no --index is given")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore", type=int, default=LOCAL_RESCORE_FACTOR, help="candidates per result to rescore")
+    args = parser.parse_args()
+
+    if args.index:
+        corpus = load_corpus(args.index, args.namespace)
+        source = f"{args.index}/{args.namespace}"
+    else:
+        corpus = synthetic_corpus(args.synthetic, args.dimension)
+        source = "synthetic"
+    if len(corpus) <= args.queries:
+        raise SystemExit(f"Corpus has {len(corpus)} vectors; need more than --queries={args.queries}")
+
+    print(f"corpus={source} vectors={len(corpus) - args.queries} dim={corpus.shape[1]} "
+          f"queries={args.queries} k={args.k} rescore={args.rescore}x")
+    rows = run(corpus, args.queries, args.k, args.rescore)
+    baseline = rows[0]
+    print(f"{'mode':<8} {'bytes/vec':>10} {'memory':>8} {'recall@' + str(args.k):>10} {'qps':>9} {'speedup':>8}")
+    for row in rows:
+        print(
+            f"{row['mode']:<8} {row['bytes_per_vector']:>10.0f} "
+            f"{baseline['bytes_per_vector'] / row['bytes_per_vector']:>7.1f}x "
+            f"{row[f'recall@{args.k}']:>10.3f} {row['qps']:>9.0f} {row['qps'] / baseline['qps']:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Vector store abstraction.
+
+Ingestion and retrieval talk to a VectorStore instead of the Pinecone client
+directly, so the backend can be swapped with VECTOR_STORE:
+
+- "pinecone" (default): hosted Pinecone serverless indexes
+- "local": in-process engine over memory-mapped float32 matrices
+  (utils.local_vector_store), for on-prem deployments and offline tests
+
+Index handles returned by `VectorStore.index(name)` follow Pinecone's
+`upsert(vectors=, namespace=)`, `query(vector=, top_k=, ...)` and
+`delete(ids=, namespace=, delete_all=)` call shapes, and query results are
+dicts with a "matches" list of {"id", "score", "metadata"}.
+"""
+
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+LOCAL_VECTOR_STORE_DIR = os.getenv("LOCAL_VECTOR_STORE_DIR", "vector_store")
+
+
+class VectorIndex(ABC):
+    """One named index; vectors are {"id", "values", "metadata"} dicts."""
+
+    @abstractmethod
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: Optional[str] = None) -> Any:
+        ...
+
+    @abstractmethod
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        namespace: Optional[str] = None,
+        include_metadata: bool = True,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def delete(self, ids: Optional[List[str]] = None, namespace: Optional[str] = None, delete_all: bool = False) -> Any:
+        ...
+
+
+class VectorStore(ABC):
+    """Creates, opens and drops indexes by name."""
+
+    def __init__(self):
+        self._ready: set[str] = set()
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def index(self, name: str) -> VectorIndex:
+        ...
+
+    @abstractmethod
+    def list_indexes(self) -> List[str]:
+        ...
+
+    @abstractmethod
+    def create_index(self, name: str, dimension: int, metric: str = "cosine") -> None:
+        ...
+
+    @abstractmethod
+    def delete_index(self, name: str) -> None:
+        ...
+
+    def ensure_index(self, name: str, dimension: int) -> None:
+        """Create the index unless it exists; known indexes are remembered per process."""
+        with self._lock:
+            if name in self._ready:
+                return
+            if name not in self.list_indexes():
+                self.create_index(name, dimension)
+            self._ready.add(name)
+
+    def forget_index(self, name: str) -> None:
+        with self._lock:
+            self._ready.discard(name)
+
+
+class PineconeVectorStore(VectorStore):
+    """Pinecone serverless indexes; Pinecone's Index objects already match VectorIndex."""
+
+    def __init__(self, client=None):
+        super().__init__()
+        from utils.db_connections import get_pinecone_connector
+
+        self.client = client or get_pinecone_connector()
+
+    def index(self, name: str):
+        return self.client.Index(name)
+
+    def list_indexes(self) -> List[str]:
+        return list(self.client.list_indexes().names())
+
+    def create_index(self, name: str, dimension: int, metric: str = "cosine") -> None:
+        from pinecone import ServerlessSpec
+
+        self.client.create_index(
+            name=name,
+            dimension=dimension,
+            metric=metric,
+            spec=ServerlessSpec(cloud="aws", region="us-east-1")
+        )
+
+    def delete_index(self, name: str) -> None:
+        self.client.delete_index(name)
+        self.forget_index(name)
+
+
+_store_instance: Optional[VectorStore] = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorStore:
+    global _store_instance
+    if _store_instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                if VECTOR_STORE == "local":
+                    from utils.local_vector_store import LocalVectorStore
+
+                    _store_instance = LocalVectorStore(LOCAL_VECTOR_STORE_DIR)
+                elif VECTOR_STORE == "pinecone":
+                    _store_instance = PineconeVectorStore()
+                else:
+                    raise ValueError(f"Unknown VECTOR_STORE '{VECTOR_STORE}' (expected 'pinecone' or 'local')")
+    return _store_instance
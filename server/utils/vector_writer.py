@@ -0,0 +1,159 @@
+"""
+Batched, parallel, retrying Pinecone writes.
+
+Pinecone rejects upsert requests above ~2 MB and recommends at most a few
+hundred vectors per request. VectorWriter splits a write by vector count and
+by estimated JSON payload size, sends the batches concurrently, retries
+failed batches with exponential backoff and raises VectorWriteError if any
+batch still fails, so callers never lose vectors silently.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+UPSERT_MAX_VECTORS = int(os.getenv("UPSERT_MAX_VECTORS", "100"))
+UPSERT_MAX_BYTES = int(os.getenv("UPSERT_MAX_BYTES", str(1536 * 1024)))
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", "4"))
+UPSERT_MAX_RETRIES = int(os.getenv("UPSERT_MAX_RETRIES", "4"))
+UPSERT_BACKOFF_SECONDS = float(os.getenv("UPSERT_BACKOFF_SECONDS", "0.5"))
+DELETE_MAX_IDS = 1000
+
+
+class VectorWriteError(RuntimeError):
+    """Raised when some vectors could not be written after retries."""
+
+    def __init__(self, message: str, written: int, failed: int):
+        super().__init__(message)
+        self.written = written
+        self.failed = failed
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_upsert_executor() -> ThreadPoolExecutor:
+    """Process-wide pool for batch requests; shared by every writer."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max(1, UPSERT_CONCURRENCY), thread_name_prefix="pinecone-write")
+    return _executor
+
+
+def estimate_vector_bytes(vector: Dict[str, Any]) -> int:
+    """Approximate JSON size of one vector on the wire."""
+    return len(json.dumps(vector, separators=(",", ":"), default=str))
+
+
+class VectorWriter:
+    """Writes vectors to one Pinecone index/namespace in size-bounded parallel batches."""
+
+    def __init__(
+        self,
+        index,
+        namespace: Optional[str] = None,
+        max_vectors: int = UPSERT_MAX_VECTORS,
+        max_bytes: int = UPSERT_MAX_BYTES,
+        max_retries: int = UPSERT_MAX_RETRIES,
+        backoff_seconds: float = UPSERT_BACKOFF_SECONDS,
+        name: str = "",
+    ):
+        self.index = index
+        self.namespace = namespace
+        self.max_vectors = max(1, max_vectors)
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.name = name or "index"
+
+    # ---------------- helpers ----------------
+    def batches(self, vectors: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Split by count and payload bytes; an oversized single vector still gets its own batch."""
+        batches: List[List[Dict[str, Any]]] = []
+        current: List[Dict[str, Any]] = []
+        current_bytes = 0
+        for vector in vectors:
+            size = estimate_vector_bytes(vector)
+            if current and (len(current) >= self.max_vectors or current_bytes + size > self.max_bytes):
+                batches.append(current)
+                current, current_bytes = [], 0
+            current.append(vector)
+            current_bytes += size
+        if current:
+            batches.append(current)
+        return batches
+
+    def _with_retries(self, action: str, size: int, call) -> None:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                call()
+                return
+            except Exception as e:
+                if attempt > self.max_retries:
+                    raise
+                wait = self.backoff_seconds * (2 ** (attempt - 1)) * (1 + random.random() * 0.25)
+                logger.warning(
+                    "Pinecone %s of %d on '%s' failed (attempt %s). Retrying in %.1fs. Error: %s",
+                    action, size, self.name, attempt, wait, e,
+                )
+                time.sleep(wait)
+
+    def _run(self, action: str, batches: List[list], send) -> int:
+        """Send every batch (in parallel when there are several); raise if any batch fails."""
+        if not batches:
+            return 0
+
+        def _one(batch: list) -> int:
+            self._with_retries(action, len(batch), lambda: send(batch))
+            return len(batch)
+
+        if len(batches) == 1:
+            try:
+                return _one(batches[0])
+            except Exception as e:
+                raise VectorWriteError(f"Pinecone {action} to '{self.name}' failed: {e}", 0, len(batches[0])) from e
+
+        futures = [get_upsert_executor().submit(_one, b) for b in batches]
+        written, failed, errors = 0, 0, []
+        for batch, fut in zip(batches, futures):
+            try:
+                written += fut.result()
+            except Exception as e:
+                failed += len(batch)
+                errors.append(e)
+        if errors:
+            raise VectorWriteError(
+                f"Pinecone {action} to '{self.name}' incomplete: {written} written, {failed} failed ({errors[0]})",
+                written, failed,
+            ) from errors[0]
+        return written
+
+    # ---------------- API ----------------
+    def upsert(self, vectors: List[Dict[str, Any]]) -> int:
+        """Write all vectors; returns how many were written or raises VectorWriteError."""
+        return self._run(
+            "upsert",
+            self.batches(vectors),
+            lambda batch: self.index.upsert(vectors=batch, namespace=self.namespace),
+        )
+
+    def delete(self, ids: List[str]) -> int:
+        """Delete vectors by ID in batches; returns how many IDs were sent."""
+        batches = [ids[i : i + DELETE_MAX_IDS] for i in range(0, len(ids), DELETE_MAX_IDS)]
+        return self._run(
+            "delete",
+            batches,
+            lambda batch: self.index.delete(ids=batch, namespace=self.namespace),
+        )
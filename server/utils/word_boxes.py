@@ -0,0 +1,118 @@
+"""
+Per-page OCR word boxes, stored once per page instead of in every vector.
+
+Boxes are packed into a compact little-endian binary blob and kept in Redis
+under `wordboxes:{doc_id}:{page_number}`; clients fetch them only when they
+want to draw highlights.
+
+Layout (version 1):
+    header   "<3sBI"   magic b"WBX", version, word count n
+    coords   uint16 x 4n   x, y, w, h per word (rendered-pixel space, clamped)
+    conf     uint8 x n     confidence 0-100, 255 = unknown
+    words    utf-8 words joined by NUL
+"""
+
+import logging
+import re
+import struct
+import sys
+from array import array
+from typing import Any, Dict, List, Optional
+
+from redis_client import redis_binary_client, redis_sync_binary_client
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"WBX"
+_VERSION = 1
+_HEADER = struct.Struct("<3sBI")
+_NO_CONFIDENCE = 255
+
+
+def _key(doc_id: str, page_number: int) -> str:
+    return f"wordboxes:{doc_id}:{page_number}"
+
+
+def _clamp(value: Any, high: int) -> int:
+    try:
+        return max(0, min(high, int(round(float(value)))))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _little_endian(arr: array) -> array:
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def pack_word_boxes(words: List[Dict[str, Any]]) -> bytes:
+    coords = array("H")
+    conf = array("B")
+    texts = []
+    for w in words:
+        coords.extend(_clamp(w.get(k), 0xFFFF) for k in ("x", "y", "w", "h"))
+        c = w.get("confidence")
+        conf.append(_NO_CONFIDENCE if c is None else _clamp(c, 100))
+        texts.append((w.get("word") or "").replace("\x00", ""))
+    return b"".join((
+        _HEADER.pack(_MAGIC, _VERSION, len(texts)),
+        _little_endian(coords).tobytes(),
+        conf.tobytes(),
+        "\x00".join(texts).encode("utf-8"),
+    ))
+
+
+def unpack_word_boxes(raw: bytes) -> List[Dict[str, Any]]:
+    magic, version, count = _HEADER.unpack_from(raw)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f"Unknown word box format {magic!r} v{version}")
+    offset = _HEADER.size
+    coords = array("H")
+    coords.frombytes(raw[offset : offset + 8 * count])
+    _little_endian(coords)
+    offset += 8 * count
+    conf = array("B", raw[offset : offset + count])
+    offset += count
+    texts = raw[offset:].decode("utf-8").split("\x00") if count else []
+    return [
+        {
+            "word": texts[i],
+            "x": coords[4 * i],
+            "y": coords[4 * i + 1],
+            "w": coords[4 * i + 2],
+            "h": coords[4 * i + 3],
+            "confidence": None if conf[i] == _NO_CONFIDENCE else float(conf[i]),
+        }
+        for i in range(count)
+    ]
+
+
+def save_page_word_boxes(doc_id: str, page_number: int, words: List[Dict[str, Any]]) -> bool:
+    """Store one page's boxes (called from ingestion threads). Failures only lose highlights."""
+    try:
+        redis_sync_binary_client.set(_key(doc_id, page_number), pack_word_boxes(words))
+        return True
+    except Exception as e:
+        logger.warning("Could not store word boxes for %s page %d: %s", doc_id, page_number, e)
+        return False
+
+
+async def load_page_word_boxes(doc_id: str, page_number: int) -> Optional[List[Dict[str, Any]]]:
+    raw = await redis_binary_client.get(_key(doc_id, page_number))
+    return unpack_word_boxes(raw) if raw else None
+
+
+def match_words(words: List[Dict[str, Any]], terms: str) -> List[Dict[str, Any]]:
+    """Boxes whose word matches one of the (case-insensitive) terms, for highlighting."""
+    wanted = {t for t in re.findall(r"\w+", terms.lower())}
+    return [w for w in words if set(re.findall(r"\w+", w["word"].lower())) & wanted]
+
+
+def delete_page_word_boxes(doc_id: str, pages: List[int]) -> None:
+    if not pages:
+        return
+    try:
+        redis_sync_binary_client.delete(*(_key(doc_id, p) for p in pages))
+    except Exception as e:
+        logger.warning("Could not delete word boxes for %s: %s", doc_id, e)